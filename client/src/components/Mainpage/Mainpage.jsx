@@ -100,6 +100,7 @@ function Mainpage() {
 
   const [chats, setChats] = useState([]);
   const [currentChat, setCurrentChat] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [query, setQuery] = useState("");
   const [selectedFile, setSelectedFile] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
@@ -134,21 +135,30 @@ function Mainpage() {
     }
   }, [user]);
 
-  const fetchChatHistory = async () => {
+  const fetchChatHistory = async (cursor = null) => {
     try {
       const token = localStorage.getItem('token');
       const response = await axios.get('http://localhost:5000/chat/history', {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: cursor ? { cursor } : {}
+      });
+      // The list only carries summaries; messages are loaded when a chat is opened
+      setChats(prev => {
+        const loaded = new Map(prev.filter(chat => chat.historyLoaded).map(chat => [chat.id, chat.history]));
+        const fetchedChats = response.data.chats.map(chat => ({
+          id: chat.id,
+          name: chat.name,
+          history: loaded.get(chat.id) || [],
+          historyLoaded: loaded.has(chat.id),
+          pinned: chat.pinned
+        }));
+        if (!cursor) return fetchedChats;
+        const seen = new Set(prev.map(chat => chat.id));
+        return [...prev, ...fetchedChats.filter(chat => !seen.has(chat.id))];
       });
-      const fetchedChats = response.data.chats.map(chat => ({
-        id: chat.id,
-        name: chat.name,
-        history: chat.history || [],
-        pinned: chat.pinned
-      }));
-      setChats(fetchedChats);
-      if (fetchedChats.length > 0 && !currentChat) {
-        setCurrentChat(fetchedChats[0].id);
+      setNextCursor(response.data.next_cursor || null);
+      if (!cursor && response.data.chats.length > 0 && !currentChat) {
+        setCurrentChat(response.data.chats[0].id);
       }
     } catch (err) {
       console.error("Error fetching chat history:", err);
@@ -156,6 +166,29 @@ function Mainpage() {
     }
   };
 
+  const fetchChatMessages = async (chatId) => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`http://localhost:5000/chat/${chatId}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setChats(prev => prev.map(chat =>
+        chat.id === chatId ? { ...chat, history: response.data.history || [], historyLoaded: true } : chat
+      ));
+    } catch (err) {
+      console.error("Error fetching chat messages:", err);
+      // Don't keep retrying a chat the server can't return
+      setChats(prev => prev.map(chat => chat.id === chatId ? { ...chat, historyLoaded: true } : chat));
+    }
+  };
+
+  useEffect(() => {
+    const chat = chats.find(chat => chat.id === currentChat);
+    if (user && !user.isGuest && chat && !chat.historyLoaded) {
+      fetchChatMessages(chat.id);
+    }
+  }, [currentChat, chats, user]);
+
   const handleLogout = () => {
     localStorage.removeItem("token");
     localStorage.removeItem("user");
@@ -225,6 +258,7 @@ function Mainpage() {
           id: newChatId, 
           name: "New Chat", 
           history: [userMessage], 
+          historyLoaded: true,
           pinned: false 
         };
         setChats(prev => [...prev, newChat]);
@@ -315,6 +349,7 @@ function Mainpage() {
       id: newChatId,
       name: "New Chat",
       history: [],
+      historyLoaded: true,
       pinned: false
     };
     
@@ -660,6 +695,11 @@ function Mainpage() {
                   </div>
                 </li>
               ))}
+              {nextCursor && (
+                <li className="HistoryItem" onClick={() => fetchChatHistory(nextCursor)}>
+                  <span className="ChatName">Load more...</span>
+                </li>
+              )}
             </ul>
           </>
         )}
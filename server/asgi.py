@@ -0,0 +1,57 @@
+"""ASGI entry point: the asyncio query path in front of the regular Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+POST /document/process-document is served natively on the event loop, so a
+request waiting on the LLM or MongoDB holds no thread. Every other route is
+forwarded to the unchanged Flask app through a WSGI adapter.
+"""
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.routing import Mount, Route
+from server import app as flask_app, start_services
+from routes.async_document import process_document_async, async_llm_client
+from utils.tracing import start_trace, current_trace, end_trace, server_timing
+import os
+import time
+
+class ServerTimingMiddleware:
+    """Server-Timing for the natively served routes; Flask adds its own for the forwarded ones."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = start_trace()
+        trace = current_trace()
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if not any(name.lower() == b"server-timing" for name, _ in headers):
+                    headers.append((b"server-timing", server_timing(trace, time.perf_counter() - started).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            end_trace(token)
+
+async def close_clients():
+    await async_llm_client.aclose()
+
+app = Starlette(
+    routes=[
+        Route("/document/process-document", process_document_async, methods=["POST", "OPTIONS"]),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=int(os.getenv("WSGI_THREADS", 10))))
+    ],
+    middleware=[Middleware(ServerTimingMiddleware)],
+    on_startup=[start_services],
+    on_shutdown=[close_clients]
+)
+app.state.flask_app = flask_app
@@ -0,0 +1,154 @@
+"""Deterministic synthetic research papers for the pipeline benchmarks.
+
+The same seed and size always produce the same text, so timings from different
+commits are measured on identical input. PDFs are written by hand (one Helvetica
+text stream per page) so generating them needs nothing beyond the standard
+library; DOCX files use python-docx, which the server already depends on.
+
+    python -m benchmarks.corpus --out cache/benchmarks/corpus --sizes small,medium
+"""
+import argparse
+import os
+import random
+
+# Bump when the generated content changes so stale corpora are rebuilt
+CORPUS_VERSION = 1
+# Pages per PDF; DOCX files get the same text as DOCX_PARAGRAPHS_PER_PAGE paragraphs per page
+SIZES = {"small": 5, "medium": 40, "large": 120}
+DOCX_PARAGRAPHS_PER_PAGE = 8
+LINES_PER_PAGE = 58
+LINE_WIDTH = 95
+SECTIONS = ["Introduction", "Related Work", "Methodology", "Experiments", "Results", "Discussion", "Conclusion"]
+VOCABULARY = (
+    "model data training evaluation baseline transformer attention layer network accuracy dataset benchmark "
+    "retrieval embedding vector index latency throughput memory gradient loss optimizer parameter sample batch "
+    "inference encoder decoder token sequence context document query ranking precision recall score metric "
+    "experiment analysis method approach result significant improvement compared proposed observed distribution "
+    "the of and to in a is that for with on as by this we are be from these which our"
+).split()
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.08:
+        words.append(f"(see Figure {rng.randint(1, 12)})")
+    elif rng.random() < 0.08:
+        words.append(f"as shown in Table {rng.randint(1, 8)}")
+    return " ".join(words).capitalize() + "."
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 6)))
+
+def generate_paper(pages: int, seed: int = 0) -> dict:
+    """Title, authors and (heading, paragraphs) sections sized to roughly ``pages`` PDF pages."""
+    rng = random.Random(f"{seed}:{pages}")
+    paragraphs = pages * DOCX_PARAGRAPHS_PER_PAGE
+    per_section = max(1, (paragraphs - 2) // len(SECTIONS))
+    sections = [("Abstract", [_paragraph(rng), _paragraph(rng)])]
+    for number, heading in enumerate(SECTIONS, start=1):
+        sections.append((f"{number}. {heading}", [_paragraph(rng) for _ in range(per_section)]))
+    sections.append(("References", [f"[{i}] {_sentence(rng)}" for i in range(1, 11)]))
+    return {
+        "title": f"A Synthetic Study of Retrieval Pipelines at {pages} Pages",
+        "author": "Ada Benchmark, Alan Fixture",
+        "affiliation": "Department of Performance, University of Benchmarks",
+        "sections": sections
+    }
+
+def _wrap(text: str, width: int = LINE_WIDTH) -> list:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+def _paper_lines(paper: dict) -> list:
+    lines = [paper["title"], paper["author"], paper["affiliation"], ""]
+    for heading, paragraphs in paper["sections"]:
+        lines.append(heading)
+        for paragraph in paragraphs:
+            lines.extend(_wrap(paragraph))
+            lines.append("")
+    return lines
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: str, paper: dict) -> None:
+    lines = _paper_lines(paper)
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+    # Objects: 1 catalog, 2 page tree, 3 font, 4 info, then a (page, content stream) pair per page
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        4: f"<< /Title ({_pdf_escape(paper['title'])}) /Author ({_pdf_escape(paper['author'])}) >>".encode("latin-1")
+    }
+    kids = []
+    for number, page_lines in enumerate(pages):
+        page_id, content_id = 5 + 2 * number, 6 + 2 * number
+        kids.append(f"{page_id} 0 R")
+        stream = "BT /F1 10 Tf 12 TL 50 760 Td\n" + "".join(f"({_pdf_escape(line)}) Tj T*\n" for line in page_lines) + "ET"
+        stream = stream.encode("latin-1")
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode("latin-1")
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode("latin-1")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += f"{object_id} 0 obj\n".encode("latin-1") + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for object_id in sorted(objects):
+        out += f"{offsets[object_id]:010d} 00000 n \n".encode("latin-1")
+    out += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info 4 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n").encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+def write_docx(path: str, paper: dict) -> None:
+    from docx import Document
+    doc = Document()
+    doc.core_properties.title = paper["title"]
+    doc.core_properties.author = paper["author"]
+    doc.add_heading(paper["title"], level=0)
+    doc.add_paragraph(paper["author"])
+    doc.add_paragraph(paper["affiliation"])
+    for heading, paragraphs in paper["sections"]:
+        doc.add_heading(heading, level=1)
+        for paragraph in paragraphs:
+            doc.add_paragraph(paragraph)
+    doc.save(path)
+
+def build_corpus(out_dir: str, sizes: list = None, seed: int = 0) -> dict:
+    """Write (or reuse) one PDF and one DOCX per size; returns {(kind, size): path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = {}
+    for size in sizes or list(SIZES):
+        paper = None
+        for kind, writer in (("pdf", write_pdf), ("docx", write_docx)):
+            path = os.path.join(out_dir, f"paper_v{CORPUS_VERSION}_s{seed}_{size}.{kind}")
+            if not os.path.exists(path):
+                paper = paper or generate_paper(SIZES[size], seed)
+                writer(path + ".tmp", paper)
+                os.replace(path + ".tmp", path)
+            corpus[(kind, size)] = path
+    return corpus
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the synthetic benchmark corpus")
+    parser.add_argument("--out", default=os.path.join("cache", "benchmarks", "corpus"))
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for (kind, size), path in sorted(build_corpus(args.out, args.sizes.split(","), args.seed).items()):
+        print(f"{kind:4} {size:6} {os.path.getsize(path):>10} bytes  {path}")
+
+if __name__ == "__main__":
+    main()
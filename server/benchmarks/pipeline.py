@@ -0,0 +1,191 @@
+"""Micro-benchmarks for the ingestion and prompt-building pipeline.
+
+Runs each stage over the synthetic corpus (see ``benchmarks.corpus``) and reports,
+per document kind and size:
+
+* ``median_s`` / ``min_s``: wall time over ``--repeat`` runs, after one untimed warm-up run
+* ``peak_mb``: peak Python heap allocated during one extra run, measured with tracemalloc
+  (allocations made inside C extensions such as pdfminer's are not seen)
+
+Stages: ``extract_pdf_metadata``, ``extract_docx_metadata``, ``extract_text_from_pdf``,
+``load_document`` on a cold parse cache, its parts ``read``, ``split`` and ``tag``, then
+``prepare_context`` (no vector index, so no embedding model) and ``generate_llm_prompt``.
+
+    python -m benchmarks.pipeline --save-baseline cache/benchmarks/baseline.json
+    # ... make a change ...
+    python -m benchmarks.pipeline --baseline cache/benchmarks/baseline.json
+
+Run it from the server directory, like the server itself.
+
+With ``--baseline`` the process exits non-zero when a stage got slower or used more memory
+than the baseline by more than the allowed ratio. Differences below ``--min-time-delta`` /
+``--min-memory-delta`` are treated as noise.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES = [
+    "What dataset and baseline does the paper use?",
+    "Summarize the results and compare them with the baseline",
+    "Explain the methodology in technical detail"
+]
+CHAT_HISTORY = [
+    {"type": "summary", "content": "The user asked about the training setup; the paper trains a transformer encoder."},
+    {"type": "user", "content": "Which optimizer is used?"},
+    {"type": "response", "content": "The paper trains with a gradient optimizer over batches of samples. " * 20},
+    {"type": "user", "content": "And the evaluation metric?"},
+    {"type": "response", "content": "Accuracy, precision and recall on the benchmark dataset. " * 20}
+]
+
+def measure(fn, setup=None, repeat: int = 5) -> dict:
+    """Time ``fn(*setup())`` ``repeat`` times, then take its peak heap in one more run."""
+    fn(*(setup() if setup else ()))
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        started = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - started)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"median_s": statistics.median(times), "min_s": min(times), "peak_mb": peak / (1024 * 1024)}
+
+def document_stages(kind: str, path: str, cache_dirs: list) -> dict:
+    from utils.file_utils import extract_pdf_metadata, extract_docx_metadata, extract_text_from_pdf
+    from utils.nlp_utils import (read_document, split_documents, tag_sections, load_document, prepare_context,
+                                 generate_llm_prompt, analyze_query_intent, determine_response_style)
+
+    def extract_text(p):
+        with open(p, "rb") as f:
+            return extract_text_from_pdf(f)
+
+    def cold_cache():
+        # Every run must miss the parse cache and the text store
+        for cache_dir in cache_dirs:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return (path,)
+
+    def split_input():
+        return (read_document(path)[0],)
+
+    def tag_input():
+        return (split_documents(read_document(path)[0]),)
+
+    stages = {}
+    if kind == "pdf":
+        stages["extract_pdf_metadata"] = (extract_pdf_metadata, lambda: (path,))
+        stages["extract_text_from_pdf"] = (extract_text, lambda: (path,))
+    else:
+        stages["extract_docx_metadata"] = (extract_docx_metadata, lambda: (path,))
+    stages.update({
+        "load_document": (load_document, cold_cache),
+        "load_document.read": (read_document, lambda: (path,)),
+        "load_document.split": (split_documents, split_input),
+        "load_document.tag": (tag_sections, tag_input)
+    })
+
+    documents, metadata = load_document(path)
+    plans = [(query, analyze_query_intent(query)) for query in QUERIES]
+
+    def build_contexts():
+        return [prepare_context(query, documents, metadata, intent, CHAT_HISTORY) for query, intent in plans]
+
+    contexts = build_contexts()
+    styles = [determine_response_style(intent, metadata) for _, intent in plans]
+
+    def build_prompts():
+        return [generate_llm_prompt(query, context["text"], style)
+                for (query, _), context, style in zip(plans, contexts, styles)]
+
+    stages["prepare_context"] = (build_contexts, None)
+    stages["generate_llm_prompt"] = (build_prompts, None)
+    return stages
+
+def run(corpus: dict, repeat: int, only: list, cache_dirs: list) -> dict:
+    results = {}
+    for (kind, size), path in sorted(corpus.items()):
+        for stage, (fn, setup) in document_stages(kind, path, cache_dirs).items():
+            if only and not any(name in stage for name in only):
+                continue
+            key = f"{kind}/{size}/{stage}"
+            results[key] = measure(fn, setup, repeat)
+            print(f"{key:45} {results[key]['median_s'] * 1000:10.2f} ms {results[key]['peak_mb']:9.2f} MB",
+                  file=sys.stderr)
+    return results
+
+def compare(results: dict, baseline: dict, args) -> list:
+    failures = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        time_limit = max(previous["median_s"] * (1 + args.max_time_regression),
+                         previous["median_s"] + args.min_time_delta)
+        if current["median_s"] > time_limit:
+            failures.append(f"{key}: {current['median_s'] * 1000:.2f} ms vs baseline {previous['median_s'] * 1000:.2f} ms")
+        memory_limit = max(previous["peak_mb"] * (1 + args.max_memory_regression),
+                           previous["peak_mb"] + args.min_memory_delta)
+        if current["peak_mb"] > memory_limit:
+            failures.append(f"{key}: {current['peak_mb']:.2f} MB vs baseline {previous['peak_mb']:.2f} MB")
+    return failures
+
+def main():
+    from benchmarks.corpus import SIZES, build_corpus
+    parser = argparse.ArgumentParser(description="Time and memory per ingestion and prompt-building stage")
+    parser.add_argument("--sizes", default=",".join(SIZES))
+    parser.add_argument("--kinds", default="pdf,docx")
+    parser.add_argument("--stages", default="", help="Comma-separated substrings of stage names to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default=os.path.join(SERVER_DIR, "cache", "benchmarks", "corpus"))
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--save-baseline", help="Write results to this baseline file")
+    parser.add_argument("--baseline", help="Fail on regressions against this baseline file")
+    parser.add_argument("--max-time-regression", type=float, default=0.25)
+    parser.add_argument("--max-memory-regression", type=float, default=0.25)
+    parser.add_argument("--min-time-delta", type=float, default=0.005, help="Seconds")
+    parser.add_argument("--min-memory-delta", type=float, default=1.0, help="MB")
+    args = parser.parse_args()
+
+    # Parse caches live in a scratch directory so runs never touch (or hit) the real ones
+    scratch = tempfile.mkdtemp(prefix="tattva-bench-")
+    cache_dirs = [os.path.join(scratch, "parsed"), os.path.join(scratch, "text")]
+    os.environ["PARSED_CACHE_DIR"], os.environ["TEXT_STORE_DIR"] = cache_dirs
+    try:
+        corpus = build_corpus(args.corpus_dir, args.sizes.split(","), args.seed)
+        corpus = {key: path for key, path in corpus.items() if key[0] in args.kinds.split(",")}
+        results = run(corpus, args.repeat, [s for s in args.stages.split(",") if s], cache_dirs)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    print(report)
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args)
+        if failures:
+            print("FAIL:\n  " + "\n  ".join(failures), file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
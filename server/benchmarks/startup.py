@@ -0,0 +1,85 @@
+"""Cold-start benchmark for the Flask server.
+
+Each run starts a fresh interpreter in the server directory and reports:
+
+* ``import_s``: time to ``import server``
+* ``first_request_s``: time from process launch until the first request (``GET /ready``) is served
+* ``warmup_s``: time for ``warm_up()`` to load the embedding model afterwards
+* ``heavy_modules``: model/ML packages already imported when the server finished importing
+
+    python -m benchmarks.startup --runs 5 --max-import-seconds 2
+
+The process exits non-zero when the median import time exceeds ``--max-import-seconds``
+or a heavy module is imported eagerly, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "langchain_community", "langchain"]
+
+PROBE = """
+import json, sys, time
+started = time.time()
+import server
+imported = time.time()
+server.app.test_client().get("/ready")
+first_request = time.time()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+warmup_s = None
+if {warm_up!r}:
+    from utils.nlp_utils import warm_up
+    warmup_s = warm_up()
+print(json.dumps({{"started": started, "imported": imported, "first_request": first_request,
+                  "heavy_modules": heavy, "warmup_s": warmup_s}}))
+"""
+
+def run_once(warm_up: bool) -> dict:
+    launched = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES, warm_up=warm_up)],
+        cwd=SERVER_DIR, capture_output=True, text=True, check=True
+    )
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    return {
+        "interpreter_s": probe["started"] - launched,
+        "import_s": probe["imported"] - probe["started"],
+        "first_request_s": probe["first_request"] - launched,
+        "warmup_s": probe["warmup_s"],
+        "heavy_modules": probe["heavy_modules"]
+    }
+
+def summarize(runs: list) -> dict:
+    summary = {"runs": len(runs), "heavy_modules": sorted({m for run in runs for m in run["heavy_modules"]})}
+    for key in ("interpreter_s", "import_s", "first_request_s", "warmup_s"):
+        values = [run[key] for run in runs if run[key] is not None]
+        if values:
+            summary[key] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure server import time and time to first request")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warm-up", action="store_true", help="Also time loading the embedding model")
+    parser.add_argument("--max-import-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    summary = summarize([run_once(args.warm_up) for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2))
+
+    failures = []
+    if summary["heavy_modules"]:
+        failures.append(f"imported eagerly: {', '.join(summary['heavy_modules'])}")
+    if args.max_import_seconds is not None and summary["import_s"]["median"] > args.max_import_seconds:
+        failures.append(f"median import {summary['import_s']['median']:.2f}s > {args.max_import_seconds:.2f}s")
+    if failures:
+        print("FAIL: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
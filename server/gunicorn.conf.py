@@ -0,0 +1,5 @@
+# Picked up automatically by ``gunicorn server:app`` run from this directory
+def post_worker_init(worker):
+    # Importing server has no side effects; each worker starts its own sweeper and warm-up here
+    from server import start_services
+    start_services()
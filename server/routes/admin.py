@@ -0,0 +1,59 @@
+from flask import Blueprint, request, jsonify, send_file, Response
+from flask_jwt_extended import verify_jwt_in_request, get_jwt
+from functools import wraps
+from io import StringIO
+from utils.profiling import list_profiles, get_profile, delete_profile
+import pstats
+import logging
+
+logger = logging.getLogger(__name__)
+admin_bp = Blueprint('admin', __name__)
+
+def is_admin_request():
+    """True when the request carries a valid JWT issued to an admin (see ADMIN_USERNAMES)."""
+    try:
+        verify_jwt_in_request(optional=True)
+        return bool(get_jwt().get("admin"))
+    except Exception:
+        return False
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({"error": "Admin access required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@admin_bp.route('/profiles', methods=['GET'])
+@admin_required
+def get_profiles():
+    return jsonify({"profiles": list_profiles()})
+
+@admin_bp.route('/profiles/<request_id>', methods=['GET'])
+@admin_required
+def download_profile(request_id):
+    """Download a stored profile: collapsed stacks, or pstats (raw, or as a text report with ?format=text)."""
+    try:
+        profile = get_profile(request_id)
+        if profile is None:
+            return jsonify({"error": "Profile not found"}), 404
+        if profile["format"] == "pstats" and request.args.get("format") == "text":
+            report = StringIO()
+            stats = pstats.Stats(profile["path"], stream=report)
+            stats.sort_stats(request.args.get("sort", "cumulative")).print_stats(int(request.args.get("limit", 60)))
+            return Response(report.getvalue(), mimetype="text/plain")
+        return send_file(profile["path"], as_attachment=True,
+                         mimetype="text/plain" if profile["format"] == "collapsed" else "application/octet-stream")
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid report options: {str(e)}"}), 400
+    except Exception as e:
+        logger.error(f"Error reading profile {request_id}: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to read profile"}), 500
+
+@admin_bp.route('/profiles/<request_id>', methods=['DELETE'])
+@admin_required
+def remove_profile(request_id):
+    if not delete_profile(request_id):
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify({"message": "Profile deleted"})
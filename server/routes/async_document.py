@@ -0,0 +1,229 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from bson import ObjectId
+from flask_jwt_extended import decode_token
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from utils import async_db
+from utils.file_utils import allowed_file, FileProcessingError
+from utils.jobs import build_document_record
+from utils.blob_store import store_upload, release_blob
+from utils.text_store import DOCUMENT_PROJECTION
+from utils.chat_store import (SESSION_PROJECTION, new_chat_session, migrate_legacy_history, message_count,
+                              exchange_messages, aappend_messages, aget_recent_messages)
+from utils.chat_memory import with_summary, history_window, schedule_summary
+from utils.document_summary import astored_summary, record_upload_answer
+from utils.llm_cache import aget_cached_response, acache_response
+from utils.llm_client import AsyncLLMClient, LLMServiceError
+from utils.tracing import span
+from utils.nlp_utils import (load_document, index_document, index_user_document, plan_document_query, query_cache_key,
+                             llm_options, TOGETHER_API_URL, TOGETHER_API_KEY, LLAMA_MODEL)
+
+logger = logging.getLogger(__name__)
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type"
+}
+
+async_llm_client = AsyncLLMClient(TOGETHER_API_URL, TOGETHER_API_KEY, LLAMA_MODEL)
+
+def _json(body, status=200):
+    return JSONResponse(body, status_code=status, headers=CORS_HEADERS)
+
+def _user_id_from(request: Request):
+    """Optional JWT identity, decoded with the Flask app's JWT settings."""
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return None
+    flask_app = request.app.state.flask_app
+    try:
+        with flask_app.app_context():
+            claims = decode_token(auth_header[len("Bearer "):])
+        return claims[flask_app.config.get("JWT_IDENTITY_CLAIM", "sub")]
+    except Exception:
+        return None
+
+def _load_and_index(filepath, content_hash=None):
+    documents, metadata = load_document(filepath, content_hash)
+    index_document(filepath, documents)
+    return documents, metadata
+
+async def process_document_async(request: Request):
+    """asyncio version of POST /document/process-document.
+
+    Mongo goes through Motor and the LLM through httpx, so waiting on either
+    holds no thread; parsing and retrieval still run in the default executor.
+    """
+    if request.method == "OPTIONS":
+        return Response(status_code=204, headers=CORS_HEADERS)
+
+    upload_folder = request.app.state.flask_app.config["UPLOAD_FOLDER"]
+    filepath = None
+    document_id = None
+    blob = None
+    try:
+        user_id = _user_id_from(request)
+        form = await request.form()
+        file = form.get("file")
+        query_text = (form.get("query") or "").strip()
+        chat_id = form.get("chat_id")
+        chat_name = form.get("chat_name", "New Chat")
+        live = (form.get("live") or "").lower() in ("1", "true", "yes")
+        has_file = file is not None and not isinstance(file, str) and file.filename
+
+        if not query_text:
+            return _json({"error": "Query cannot be empty"}, 400)
+
+        documents = None
+        metadata = None
+        chat_history = []
+        chat_session = None
+
+        # Handle case with new file upload
+        if has_file:
+            if not allowed_file(file.filename):
+                return _json({"error": "Invalid file type"}, 400)
+
+            file_ext = file.filename.rsplit('.', 1)[1].lower()
+            upload = await asyncio.to_thread(store_upload, file.file, upload_folder, file_ext)
+            filepath = upload["filepath"]
+            blob = upload["stored_name"]
+
+            documents, metadata = await asyncio.to_thread(_load_and_index, filepath, upload["content_hash"])
+            if not documents and not metadata.get("text_length"):
+                raise FileProcessingError("Failed to process document content")
+
+            if user_id:
+                doc_data = build_document_record(user_id, file.filename, blob, filepath, file_ext, metadata)
+                result = await async_db.documents_collection.insert_one(doc_data)
+                document_id = str(result.inserted_id)
+                await asyncio.to_thread(index_user_document, user_id, document_id, filepath, doc_data["content_hash"])
+                # The documents record now owns the blob reference
+                blob = None
+        # Handle query-only case with existing chat
+        elif chat_id and user_id:
+            chat_session = await async_db.chat_sessions_collection.find_one({
+                "_id": ObjectId(chat_id),
+                "user_id": user_id
+            }, SESSION_PROJECTION)
+            if not chat_session:
+                return _json({"error": "Chat session not found or not authorized"}, 404)
+            document_id = chat_session.get("document_id")
+            if document_id:
+                doc = await async_db.documents_collection.find_one({"_id": ObjectId(document_id)}, DOCUMENT_PROJECTION)
+                if doc:
+                    filepath = os.path.join(upload_folder, doc["stored_name"])
+                    if os.path.exists(filepath):
+                        documents, metadata = await asyncio.to_thread(_load_and_index, filepath)
+                    else:
+                        metadata = doc.get("metadata", {"title": "Untitled Document", "author": "Unknown Author"})
+                        documents = []
+            if not document_id:
+                return _json({"error": "No document associated with this chat"}, 400)
+        else:
+            return _json({"error": "Must provide a file or a valid chat_id with an associated document"}, 400)
+
+        # Create or fetch chat session
+        if user_id and not chat_session and chat_id:
+            chat_session = await async_db.chat_sessions_collection.find_one({"_id": ObjectId(chat_id), "user_id": user_id},
+                                                                            SESSION_PROJECTION)
+        if user_id and chat_session:
+            if "message_count" not in chat_session:
+                chat_session = await asyncio.to_thread(migrate_legacy_history, chat_session)
+            chat_history = with_summary(chat_session, await aget_recent_messages(async_db.chat_messages_collection,
+                                                                                 chat_session, history_window(chat_session)))
+        elif user_id:
+            result = await async_db.chat_sessions_collection.insert_one(new_chat_session(user_id, chat_name, document_id))
+            chat_session = await async_db.chat_sessions_collection.find_one({"_id": result.inserted_id}, SESSION_PROJECTION)
+
+        if not metadata:
+            metadata = {"title": "Untitled Document", "author": "Unknown Author"}
+
+        context_usage = None
+        answered = True
+        # An upload's summary is recorded once it has been answered (below), not backfilled here
+        summary = None if live else await astored_summary(None if has_file else filepath, metadata.get("content_hash"),
+                                                          query_text, async_db.document_summaries_collection)
+        cache_key = query_cache_key(query_text, metadata, chat_history, user_id)
+        cached = None if summary is not None else await aget_cached_response(cache_key, async_db.llm_cache_collection)
+        if summary is not None:
+            response = summary
+        elif cached is not None:
+            response = cached
+        else:
+            plan = await asyncio.to_thread(plan_document_query, filepath or "", query_text, chat_history,
+                                           documents, metadata, False, user_id)
+            context_usage = plan.get("context_usage")
+            if plan["response"] is not None:
+                response = plan["response"]
+            else:
+                try:
+                    with span("llm"):
+                        response = await async_llm_client.complete(**llm_options(plan["prompt"]))
+                    await acache_response(plan["cache_key"], response, async_db.llm_cache_collection)
+                except LLMServiceError as e:
+                    answered = False
+                    response = str(e)
+
+        if user_id and chat_session:
+            document_ref = document_id or chat_session.get("document_id")
+            await async_db.queries_collection.insert_one({
+                "user_id": user_id,
+                "chat_session_id": str(chat_session["_id"]),
+                "document_id": document_ref,
+                "query": query_text,
+                "response": response,
+                "timestamp": datetime.utcnow(),
+                "is_summary": "summar" in query_text.lower()
+            })
+            start_seq = message_count(chat_session)
+            update_result = await async_db.chat_sessions_collection.update_one(
+                {"_id": chat_session["_id"], "version": chat_session["version"]},
+                {
+                    "$set": {
+                        "last_updated": datetime.utcnow(),
+                        "document_id": document_ref,
+                        "message_count": start_seq + 2
+                    },
+                    "$inc": {"version": 1}
+                }
+            )
+            if update_result.modified_count == 0:
+                raise ValueError("Chat update failed due to concurrent modification")
+            await aappend_messages(async_db.chat_messages_collection, chat_session, start_seq,
+                                   exchange_messages(query_text, response, file.filename if has_file else None,
+                                                     document_ref))
+            # Summarization runs on a worker thread with the sync client, never on the event loop
+            schedule_summary(chat_session, start_seq + 2)
+
+        # Anonymous uploads keep no documents record, so nothing would ever read their summary back
+        if has_file and user_id and summary is None:
+            await asyncio.to_thread(record_upload_answer, filepath, metadata.get("content_hash"), query_text,
+                                    response if answered else None)
+
+        return _json({
+            "response": response,
+            "context_tokens": context_usage,
+            "stored_summary": summary is not None,
+            "title": metadata.get("title", "Untitled Document"),
+            "author": metadata.get("author", "Unknown Author"),
+            "chat_id": str(chat_session["_id"]) if chat_session else None
+        })
+
+    except FileProcessingError as e:
+        logger.error(f"Document processing error: {str(e)}")
+        return _json({"error": str(e)}, 400)
+    except ValueError as e:
+        logger.error(f"Concurrency or data error: {str(e)}")
+        return _json({"error": str(e)}, 409)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return _json({"error": f"Internal server error: {str(e)}"}, 500)
+    finally:
+        # Anonymous uploads and failed requests give their blob back; the sweeper deletes it once unreferenced
+        if blob:
+            await asyncio.to_thread(release_blob, blob)
@@ -2,9 +2,12 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from utils.db import users_collection
 from datetime import datetime
+import os
 
 auth_bp = Blueprint('auth', __name__)
 bcrypt = None  # Will be set in server.py
+# Users who get admin tokens (profiling, /admin); a user document can also set is_admin
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
 
 def set_bcrypt(bcrypt_instance):
     global bcrypt
@@ -48,7 +51,8 @@ def login():
         {"$set": {"last_login": datetime.utcnow()}}
     )
 
-    token = create_access_token(identity=str(user['_id']))
+    is_admin = user.get("is_admin", False) or user['username'] in ADMIN_USERNAMES
+    token = create_access_token(identity=str(user['_id']), additional_claims={"admin": True} if is_admin else None)
     return jsonify({
         "message": "Login successful",
         "token": token,
@@ -1,13 +1,40 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.db import chat_sessions_collection, queries_collection, documents_collection
+from utils.chat_store import (SESSION_PROJECTION, MESSAGE_PAGE_SIZE, new_chat_session, migrate_legacy_history,
+                              get_messages, delete_messages, clear_messages)
+from utils.text_store import DOCUMENT_PROJECTION
 from bson import ObjectId
+from bson.errors import InvalidId
 import logging
+import os
+import json
+import base64
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 chat_bp = Blueprint('chat', __name__)
 
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+MAX_HISTORY_PAGE_SIZE = 200
+HISTORY_SORT = [("pinned", -1), ("last_updated", -1), ("_id", -1)]
+MAX_MESSAGE_PAGE_SIZE = 200
+
+def _encode_cursor(session):
+    position = [session.get("pinned", False), session["last_updated"].isoformat(), str(session["_id"])]
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+def _cursor_filter(cursor):
+    """Match sessions that sort strictly after the cursor position."""
+    pinned, last_updated, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    last_updated = datetime.fromisoformat(last_updated)
+    session_id = ObjectId(session_id)
+    return {"$or": [
+        {"pinned": {"$lt": pinned}},
+        {"pinned": pinned, "last_updated": {"$lt": last_updated}},
+        {"pinned": pinned, "last_updated": last_updated, "_id": {"$lt": session_id}}
+    ]}
+
 @chat_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_chat_history():
@@ -15,39 +42,134 @@ def get_chat_history():
         user_id = get_jwt_identity()
         if not user_id:
             return jsonify({"error": "Invalid user identity"}), 401
-            
-        chat_sessions = chat_sessions_collection.find({"user_id": user_id})
-        chat_list = []
 
-        for session in chat_sessions:
-            doc_metadata = None
-            title = "Untitled Document"
-            author = "Unknown Author"
-            if session.get("document_id"):
-                doc = documents_collection.find_one({"_id": ObjectId(session["document_id"])})
-                if doc:
-                    doc_metadata = doc["metadata"]
-                    title = doc.get("title", "Untitled Document")
-                    author = doc.get("author", "Unknown Author")
+        try:
+            limit = min(max(int(request.args.get("limit", HISTORY_PAGE_SIZE)), 1), MAX_HISTORY_PAGE_SIZE)
+            match = {"user_id": user_id}
+            if request.args.get("cursor"):
+                match.update(_cursor_filter(request.args["cursor"]))
+        except (ValueError, TypeError, InvalidId):
+            return jsonify({"error": "Invalid pagination parameters"}), 400
+
+        # One round-trip: page of sessions joined to the few document fields the sidebar shows
+        sessions = list(chat_sessions_collection.aggregate([
+            {"$match": match},
+            {"$sort": dict(HISTORY_SORT)},
+            {"$limit": limit + 1},
+            {"$lookup": {
+                "from": documents_collection.name,
+                "let": {"doc_id": "$document_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": [
+                        "$_id",
+                        {"$convert": {"input": "$$doc_id", "to": "objectId", "onError": None, "onNull": None}}
+                    ]}}},
+                    {"$project": {"_id": 0, "title": 1, "author": 1}}
+                ],
+                "as": "document"
+            }},
+            {"$project": {
+                "name": 1,
+                "created_at": 1,
+                "last_updated": 1,
+                "pinned": 1,
+                "document_id": 1,
+                "message_count": {"$ifNull": ["$message_count", {"$size": {"$ifNull": ["$history", []]}}]},
+                "document": {"$arrayElemAt": ["$document", 0]}
+            }}
+        ]))
+
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = _encode_cursor(sessions[-1])
+
+        chat_list = []
+        for session in sessions:
+            document = session.get("document") or {}
             chat_list.append({
                 "id": str(session["_id"]),
                 "name": session.get("name", "Unnamed Chat"),
                 "created_at": session.get("created_at", datetime.utcnow()).isoformat(),
                 "last_updated": session.get("last_updated", datetime.utcnow()).isoformat(),
                 "pinned": session.get("pinned", False),
-                "history": session.get("history", []),
+                "message_count": session.get("message_count", 0),
                 "document_id": session.get("document_id"),
-                "title": title,
-                "author": author,
-                "metadata": doc_metadata
+                "title": document.get("title", "Untitled Document"),
+                "author": document.get("author", "Unknown Author")
             })
 
-        return jsonify({"chats": chat_list})
+        return jsonify({"chats": chat_list, "next_cursor": next_cursor})
 
     except Exception as e:
         logger.error(f"Error retrieving chat history: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to retrieve chat history"}), 500
 
+@chat_bp.route('/<chat_id>', methods=['GET'])
+@jwt_required()
+def get_chat(chat_id):
+    try:
+        user_id = get_jwt_identity()
+        if not ObjectId.is_valid(chat_id):
+            return jsonify({"error": "Invalid chat ID format"}), 400
+
+        session = chat_sessions_collection.find_one({"_id": ObjectId(chat_id), "user_id": user_id}, SESSION_PROJECTION)
+        if not session:
+            return jsonify({"error": "Chat not found or not authorized"}), 404
+        session = migrate_legacy_history(session)
+        messages = get_messages(session)
+
+        doc_metadata = None
+        if session.get("document_id") and ObjectId.is_valid(session["document_id"]):
+            doc = documents_collection.find_one({"_id": ObjectId(session["document_id"])}, DOCUMENT_PROJECTION)
+            if doc:
+                doc_metadata = doc.get("metadata", {})
+
+        return jsonify({
+            "id": str(session["_id"]),
+            "name": session.get("name", "Unnamed Chat"),
+            "history": messages,
+            "next_before": _next_before(messages),
+            "document_id": session.get("document_id"),
+            "metadata": doc_metadata
+        })
+
+    except Exception as e:
+        logger.error(f"Error retrieving chat: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve chat"}), 500
+
+def _next_before(messages):
+    if messages and messages[0]["seq"] > 0:
+        return messages[0]["seq"]
+    return None
+
+@chat_bp.route('/<chat_id>/messages', methods=['GET'])
+@jwt_required()
+def get_chat_messages(chat_id):
+    try:
+        user_id = get_jwt_identity()
+        if not ObjectId.is_valid(chat_id):
+            return jsonify({"error": "Invalid chat ID format"}), 400
+
+        try:
+            before = request.args.get("before")
+            before = int(before) if before is not None else None
+            limit = min(max(int(request.args.get("limit", MESSAGE_PAGE_SIZE)), 1), MAX_MESSAGE_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
+
+        session = chat_sessions_collection.find_one({"_id": ObjectId(chat_id), "user_id": user_id}, SESSION_PROJECTION)
+        if not session:
+            return jsonify({"error": "Chat not found or not authorized"}), 404
+        session = migrate_legacy_history(session)
+
+        messages = get_messages(session, before=before, limit=limit)
+        return jsonify({"messages": messages, "next_before": _next_before(messages)})
+
+    except Exception as e:
+        logger.error(f"Error retrieving chat messages: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve chat messages"}), 500
+
 @chat_bp.route('/create', methods=['POST'])
 @jwt_required()
 def create_chat():
@@ -57,18 +179,7 @@ def create_chat():
         chat_name = data.get('name', 'New Chat')
         document_id = data.get('document_id')
 
-        new_chat = {
-            "user_id": user_id,
-            "name": chat_name,
-            "created_at": datetime.utcnow(),
-            "last_updated": datetime.utcnow(),
-            "pinned": False,
-            "history": [],
-            "document_id": document_id,
-            "version": 1
-        }
-
-        result = chat_sessions_collection.insert_one(new_chat)
+        result = chat_sessions_collection.insert_one(new_chat_session(user_id, chat_name, document_id))
         return jsonify({
             "message": "Chat created successfully",
             "chat_id": str(result.inserted_id)
@@ -95,6 +206,7 @@ def delete_chat(chat_id):
             return jsonify({"error": "Chat not found or not authorized"}), 404
             
         queries_collection.delete_many({"chat_session_id": chat_id})
+        delete_messages(ObjectId(chat_id))
         return jsonify({"message": "Chat deleted successfully"})
 
     except Exception as e:
@@ -112,7 +224,7 @@ def pin_chat(chat_id):
         chat_session = chat_sessions_collection.find_one({
             "_id": ObjectId(chat_id), 
             "user_id": user_id
-        })
+        }, SESSION_PROJECTION)
         
         if not chat_session:
             return jsonify({"error": "Chat not found or not authorized"}), 404
@@ -158,7 +270,7 @@ def rename_chat(chat_id):
         chat_session = chat_sessions_collection.find_one({
             "_id": ObjectId(chat_id), 
             "user_id": user_id
-        })
+        }, SESSION_PROJECTION)
         
         if not chat_session:
             return jsonify({"error": "Chat not found or not authorized"}), 404
@@ -194,22 +306,12 @@ def clear_chat_messages(chat_id):
         chat_session = chat_sessions_collection.find_one({
             "_id": ObjectId(chat_id), 
             "user_id": user_id
-        })
+        }, SESSION_PROJECTION)
         
         if not chat_session:
             return jsonify({"error": "Chat not found or not authorized"}), 404
 
-        update_result = chat_sessions_collection.update_one(
-            {"_id": ObjectId(chat_id), "version": chat_session["version"]},
-            {
-                "$set": {
-                    "history": [],
-                    "last_updated": datetime.utcnow()
-                },
-                "$inc": {"version": 1}
-            }
-        )
-        if update_result.modified_count == 0:
+        if not clear_messages(chat_session):
             return jsonify({"error": "Clear failed due to concurrent modification"}), 409
         
         return jsonify({"message": "Chat messages cleared successfully"})
@@ -1,13 +1,23 @@
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
+from flask import Blueprint, request, jsonify, send_from_directory, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from utils.db import users_collection, documents_collection, chat_sessions_collection, queries_collection
 from utils.file_utils import allowed_file, extract_text_from_pdf, extract_text_from_docx, FileProcessingError
-from utils.nlp_utils import load_document, process_document_query
+from utils.nlp_utils import (load_document, index_document, plan_document_query, answer_query, stream_answer,
+                             load_document_version, index_document_version, get_document_text,
+                             index_user_document, unindex_user_document, search_user_documents, RETRIEVAL_TOP_K)
+from utils.jobs import submit_ingestion_job, reuse_ingested_document, get_job, cancel_job, build_document_record
+from utils.blob_store import store_upload, release_blob, find_ingested_document, release_document_file
+from utils.text_store import DOCUMENT_PROJECTION
+from utils import user_index
+from utils.chat_store import (SESSION_PROJECTION, new_chat_session, migrate_legacy_history, get_recent_messages,
+                              message_count, append_messages, exchange_messages)
+from utils.chat_memory import with_summary, history_window, schedule_summary
+from utils.document_summary import stored_summary, schedule_document_summary, record_upload_answer
 from werkzeug.utils import secure_filename
 import os
 from io import BytesIO
 from docx import Document as DocxDocument
-import uuid
+import json
 from datetime import datetime
 import logging
 from bson import ObjectId
@@ -16,6 +26,8 @@ logger = logging.getLogger(__name__)
 
 document_bp = Blueprint('document', __name__)
 
+MAX_SEARCH_RESULTS = 50
+
 @document_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_file():
@@ -32,48 +44,83 @@ def upload_file():
 
         user_id = get_jwt_identity()
         file_ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_id = str(uuid.uuid4())
-        filename = f"doc_{unique_id}.{file_ext}"
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        
-        file.save(filepath)
-        documents, metadata = load_document(filepath)
-        
-        doc_data = {
-            "user_id": user_id,
-            "original_name": secure_filename(file.filename),
-            "stored_name": filename,
-            "upload_date": datetime.utcnow(),
-            "file_type": file_ext,
-            "size": os.path.getsize(filepath),
-            "extracted_text": metadata.get("extracted_text", ""),
-            "title": metadata.get("title", "Untitled Document"),
-            "author": metadata.get("author", "Unknown Author"),
-            "metadata": metadata,
-            "version": 1
-        }
-        
-        result = documents_collection.insert_one(doc_data)
-        # File is kept in uploads for future use, not deleted here
-        
+        upload = store_upload(file.stream, current_app.config['UPLOAD_FOLDER'], file_ext)
+
+        # Content seen before already has its parse and index on disk; only the user's record is new
+        existing = find_ingested_document(upload["content_hash"])
+        if existing:
+            job_id = reuse_ingested_document(user_id, upload["filepath"], file.filename, upload["stored_name"],
+                                             file_ext, existing["metadata"])
+            upload = None
+            job = get_job(job_id, user_id)
+            return jsonify({"message": "File already processed", **_serialize_job(job)}), 200
+
+        # Parsing, chunking and embedding run in the ingestion pool; poll the job for the document id
+        job_id = submit_ingestion_job(user_id, upload["filepath"], file.filename, upload["stored_name"], file_ext)
+        # The job owns the blob reference from here on
+        upload = None
+
         return jsonify({
-            "message": "File uploaded successfully",
-            "document_id": str(result.inserted_id),
-            "title": doc_data["title"],
-            "author": doc_data["author"]
-        }), 201
+            "message": "File accepted for processing",
+            "job_id": job_id,
+            "status": "queued"
+        }), 202
 
     except FileProcessingError as e:
         logger.error(f"File processing error: {str(e)}")
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
+        if locals().get('upload'):
+            release_blob(upload["stored_name"])
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Unexpected upload error: {str(e)}", exc_info=True)
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
+        if locals().get('upload'):
+            release_blob(upload["stored_name"])
         return jsonify({"error": "Failed to upload file"}), 500
 
+def _serialize_job(job):
+    return {
+        "job_id": str(job["_id"]),
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "document_id": job.get("document_id"),
+        "title": job.get("title"),
+        "author": job.get("author"),
+        "error": job.get("error")
+    }
+
+@document_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_ingestion_job(job_id):
+    try:
+        if not ObjectId.is_valid(job_id):
+            return jsonify({"error": "Invalid job ID format"}), 400
+        job = get_job(job_id, get_jwt_identity())
+        if not job:
+            return jsonify({"error": "Job not found or not authorized"}), 404
+        return jsonify(_serialize_job(job))
+
+    except Exception as e:
+        logger.error(f"Error retrieving job status: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve job status"}), 500
+
+@document_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_ingestion_job(job_id):
+    try:
+        if not ObjectId.is_valid(job_id):
+            return jsonify({"error": "Invalid job ID format"}), 400
+        user_id = get_jwt_identity()
+        job = cancel_job(job_id, user_id)
+        if not job:
+            if get_job(job_id, user_id):
+                return jsonify({"error": "Job has already finished"}), 409
+            return jsonify({"error": "Job not found or not authorized"}), 404
+        return jsonify(_serialize_job(job))
+
+    except Exception as e:
+        logger.error(f"Error cancelling job: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to cancel job"}), 500
+
 @document_bp.route('/preview/<filename>', methods=['GET'])
 def preview_document(filename):
     try:
@@ -109,179 +156,446 @@ def preview_document(filename):
         logger.error(f"Unexpected preview error: {str(e)}", exc_info=True)
         return jsonify({"error": "Failed to generate preview"}), 500
 
-@document_bp.route("/process-document", methods=["POST"])
-def process_document():
-    filepath = None
-    try:
-        user_id = None
-        try:
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
-        except Exception:
-            pass
-        
-        file = request.files.get('file')
-        query_text = request.form.get("query", "").strip()
-        chat_id = request.form.get("chat_id")
-        chat_name = request.form.get("chat_name", "New Chat")
+def _ensure_user_index(user_id):
+    # Documents stored before cross-document search existed are indexed on the user's first search.
+    # Tracked with its own marker: a shard created by a later upload may hold only that upload.
+    if user_index.is_backfilled(user_id):
+        return
+    for doc in documents_collection.find({"user_id": user_id}, {"stored_name": 1, "content_hash": 1}):
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], doc["stored_name"])
+        # Documents already in the shard are skipped by add_document
+        index_user_document(user_id, str(doc["_id"]), filepath, doc.get("content_hash"))
+    user_index.mark_backfilled(user_id)
 
+@document_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_documents():
+    try:
+        user_id = get_jwt_identity()
+        query_text = request.args.get("q", "").strip()
         if not query_text:
             return jsonify({"error": "Query cannot be empty"}), 400
+        try:
+            k = min(max(int(request.args.get("k", RETRIEVAL_TOP_K)), 1), MAX_SEARCH_RESULTS)
+        except ValueError:
+            return jsonify({"error": "Invalid result count"}), 400
 
-        document_id = None
-        documents = None
-        metadata = None
-        chat_history = []
-
-        # Handle case with new file upload
-        if file and file.filename != '':
-            if not allowed_file(file.filename):
-                return jsonify({"error": "Invalid file type"}), 400
-                
-            file_ext = file.filename.rsplit('.', 1)[1].lower()
-            unique_id = str(uuid.uuid4())
-            filename = f"doc_{unique_id}.{file_ext}"
-            filepath = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
-            file.save(filepath)
-            
-            documents, metadata = load_document(filepath)
-            if not documents and not metadata.get("extracted_text"):
-                raise FileProcessingError("Failed to process document content")
-                
-            if user_id:
-                doc_data = {
-                    "user_id": user_id,
-                    "original_name": secure_filename(file.filename),
-                    "stored_name": filename,
-                    "upload_date": datetime.utcnow(),
-                    "file_type": file_ext,
-                    "size": os.path.getsize(filepath),
-                    "extracted_text": metadata.get("extracted_text", ""),
-                    "title": metadata.get("title", "Untitled Document"),
-                    "author": metadata.get("author", "Unknown Author"),
-                    "metadata": metadata,
-                    "version": 1
-                }
-                result = documents_collection.insert_one(doc_data)
-                document_id = str(result.inserted_id)
-        # Handle query-only case with existing chat
-        elif chat_id and user_id:
-            chat_session = chat_sessions_collection.find_one({
-                "_id": ObjectId(chat_id),
-                "user_id": user_id
+        _ensure_user_index(user_id)
+        hits = search_user_documents(user_id, query_text, k)
+
+        doc_ids = list({ObjectId(hit["document_id"]) for hit in hits})
+        docs = {
+            str(doc["_id"]): doc
+            for doc in documents_collection.find({"_id": {"$in": doc_ids}, "user_id": user_id},
+                                                 {"title": 1, "original_name": 1})
+        }
+        results = []
+        for hit in hits:
+            doc = docs.get(hit["document_id"])
+            if not doc:
+                continue
+            results.append({
+                "document_id": hit["document_id"],
+                "title": doc.get("title", "Untitled Document"),
+                "original_name": doc.get("original_name"),
+                "chunk_index": hit["chunk_index"],
+                "page": hit["page"],
+                "section": hit["section"],
+                "score": hit["score"],
+                "text": hit["text"]
             })
-            if not chat_session:
-                return jsonify({"error": "Chat session not found or not authorized"}), 404
-            chat_history = chat_session.get("history", [])
-            document_id = chat_session.get("document_id")
-            if document_id:
-                doc = documents_collection.find_one({"_id": ObjectId(document_id)})
-                if doc:
-                    filepath = os.path.join(current_app.config["UPLOAD_FOLDER"], doc["stored_name"])
-                    if os.path.exists(filepath):
-                        documents, metadata = load_document(filepath)
-                    else:
-                        metadata = doc.get("metadata", {"title": "Untitled Document", "author": "Unknown Author"})
-                        documents = []
-            if not document_id:
-                return jsonify({"error": "No document associated with this chat"}), 400
-        else:
-            return jsonify({"error": "Must provide a file or a valid chat_id with an associated document"}), 400
+        return jsonify({"query": query_text, "results": results})
 
-        # Set default query if new file but no query
-        if not query_text and file:
-            query_text = os.getenv("DEFAULT_QUERY", "Provide a detailed summary of this research paper.")
+    except Exception as e:
+        logger.error(f"Error searching documents: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to search documents"}), 500
 
-        # Create or fetch chat session
-        chat_session = None
-        if user_id:
-            if chat_id:
-                chat_session = chat_sessions_collection.find_one({"_id": ObjectId(chat_id), "user_id": user_id})
-            if not chat_session:
-                chat_data = {
-                    "user_id": user_id,
-                    "name": chat_name,
-                    "created_at": datetime.utcnow(),
-                    "last_updated": datetime.utcnow(),
-                    "pinned": False,
-                    "history": [],
-                    "document_id": document_id,
-                    "version": 1
-                }
-                result = chat_sessions_collection.insert_one(chat_data)
-                chat_session = chat_sessions_collection.find_one({"_id": result.inserted_id})
-            else:
-                chat_history = chat_session.get("history", [])
-
-        if not metadata:
-            metadata = {"title": "Untitled Document", "author": "Unknown Author"}
-
-        response = process_document_query(filepath or "", query_text, chat_history)
-
-        if user_id and chat_session:
-            query_entry = {
-                "user_id": user_id,
-                "chat_session_id": str(chat_session["_id"]),
-                "document_id": document_id or chat_session.get("document_id"),
-                "query": query_text,
-                "response": response,
-                "timestamp": datetime.utcnow(),
-                "is_summary": "summar" in query_text.lower()
-            }
-            queries_collection.insert_one(query_entry)
-
-            update_result = chat_sessions_collection.update_one(
-                {"_id": chat_session["_id"], "version": chat_session["version"]},
-                {
-                    "$push": {
-                        "history": {
-                            "$each": [
-                                {
-                                    "type": "user",
-                                    "content": query_text,
-                                    "timestamp": datetime.utcnow().strftime("%H:%M:%S"),
-                                    "file": {
-                                        "name": file.filename if file else None,
-                                        "document_id": document_id or chat_session.get("document_id")
-                                    }
-                                },
-                                {
-                                    "type": "response",
-                                    "content": response,
-                                    "timestamp": datetime.utcnow().strftime("%H:%M:%S")
-                                }
-                            ]
-                        }
-                    },
-                    "$set": {
-                        "last_updated": datetime.utcnow(),
-                        "document_id": document_id or chat_session.get("document_id")
-                    },
-                    "$inc": {"version": 1}
-                }
-            )
-            if update_result.modified_count == 0:
-                raise ValueError("Chat update failed due to concurrent modification")
+@document_bp.route('/<document_id>/text', methods=['GET'])
+@jwt_required()
+def get_document_full_text(document_id):
+    try:
+        if not ObjectId.is_valid(document_id):
+            return jsonify({"error": "Invalid document ID format"}), 400
+
+        doc = documents_collection.find_one(
+            {"_id": ObjectId(document_id), "user_id": get_jwt_identity()},
+            {"stored_name": 1, "content_hash": 1}
+        )
+        if not doc:
+            return jsonify({"error": "Document not found or not authorized"}), 404
+
+        # Text is not kept in Mongo; it is read from the text store only when asked for
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], doc["stored_name"])
+        text = get_document_text(filepath, doc.get("content_hash"))
+        if text is None:
+            return jsonify({"error": "Document text is no longer available"}), 404
+        return jsonify({"document_id": document_id, "text": text})
+
+    except FileProcessingError as e:
+        logger.error(f"Text extraction error: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error retrieving document text: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve document text"}), 500
+
+@document_bp.route('/<document_id>', methods=['DELETE'])
+@jwt_required()
+def delete_document(document_id):
+    try:
+        if not ObjectId.is_valid(document_id):
+            return jsonify({"error": "Invalid document ID format"}), 400
+
+        doc = documents_collection.find_one_and_delete({"_id": ObjectId(document_id), "user_id": get_jwt_identity()})
+        if not doc:
+            return jsonify({"error": "Document not found or not authorized"}), 404
+
+        unindex_user_document(doc["user_id"], document_id)
+        # The file itself goes once no other record references the same content
+        release_document_file(doc, current_app.config['UPLOAD_FOLDER'])
+        return jsonify({"message": "Document deleted successfully"})
+
+    except Exception as e:
+        logger.error(f"Error deleting document: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to delete document"}), 500
+
+@document_bp.route('/<document_id>/version', methods=['POST'])
+@jwt_required()
+def upload_document_version(document_id):
+    """Replace a document's file with a new version, re-extracting and re-embedding only what changed."""
+    upload = None
+    try:
+        if not ObjectId.is_valid(document_id):
+            return jsonify({"error": "Invalid document ID format"}), 400
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+        if not allowed_file(file.filename):
+            return jsonify({"error": "Only PDF and DOCX files are allowed"}), 400
+
+        user_id = get_jwt_identity()
+        doc = documents_collection.find_one(
+            {"_id": ObjectId(document_id), "user_id": user_id},
+            {"stored_name": 1, "content_hash": 1, "file_type": 1, "version": 1}
+        )
+        if not doc:
+            return jsonify({"error": "Document not found or not authorized"}), 404
+        file_ext = file.filename.rsplit('.', 1)[1].lower()
+        if doc.get("file_type") and file_ext != doc["file_type"]:
+            return jsonify({"error": f"A new version must also be a {doc['file_type'].upper()} file"}), 400
+
+        upload = store_upload(file.stream, current_app.config['UPLOAD_FOLDER'], file_ext)
+        if upload["content_hash"] == doc.get("content_hash"):
+            release_blob(upload["stored_name"])
+            return jsonify({"message": "Document unchanged", "document_id": document_id,
+                            "version": doc.get("version", 1)})
+
+        previous_path = os.path.join(current_app.config['UPLOAD_FOLDER'], doc["stored_name"])
+        documents, metadata, stats = load_document_version(upload["filepath"], upload["content_hash"],
+                                                           doc.get("content_hash"))
+        if not documents and not metadata.get("text_length"):
+            raise FileProcessingError("Failed to process document content")
+        indexed = index_document_version(upload["filepath"], documents, previous_path, doc.get("content_hash"))
+
+        version = doc.get("version", 1) + 1
+        # Guarded on the version read above so two concurrent uploads cannot both replace it
+        updated = documents_collection.update_one(
+            {"_id": doc["_id"], "user_id": user_id, "version": doc.get("version")},
+            {"$set": {
+                "original_name": secure_filename(file.filename),
+                "stored_name": upload["stored_name"],
+                "size": upload["size"],
+                "title": metadata.get("title", "Untitled Document"),
+                "author": metadata.get("author", "Unknown Author"),
+                "metadata": metadata,
+                "content_hash": upload["content_hash"],
+                "previous_content_hash": doc.get("content_hash"),
+                "version": version,
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        if updated.modified_count == 0:
+            release_blob(upload["stored_name"])
+            return jsonify({"error": "Document was changed by another upload; retry"}), 409
+        # The record now owns the new blob; the old one goes once nothing else references it
+        filepath, upload = upload["filepath"], None
+        unindex_user_document(user_id, document_id)
+        index_user_document(user_id, document_id, filepath, metadata.get("content_hash"))
+        release_document_file(doc, current_app.config['UPLOAD_FOLDER'])
+        schedule_document_summary(filepath, metadata.get("content_hash"))
 
         return jsonify({
-            "response": response,
+            "message": "Document updated",
+            "document_id": document_id,
+            "version": version,
             "title": metadata.get("title", "Untitled Document"),
             "author": metadata.get("author", "Unknown Author"),
-            "chat_id": str(chat_session["_id"]) if chat_session else None
+            "pages_total": stats["pages_total"],
+            "pages_reextracted": stats["pages_reextracted"],
+            "chunks_total": len(documents),
+            "chunks_reembedded": indexed["chunks_reembedded"]
         })
 
+    except FileProcessingError as e:
+        logger.error(f"Document version processing error: {str(e)}")
+        if upload:
+            release_blob(upload["stored_name"])
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error uploading document version: {str(e)}", exc_info=True)
+        if upload:
+            release_blob(upload["stored_name"])
+        return jsonify({"error": "Failed to update document"}), 500
+
+def _load_query_request(state):
+    """Resolve the document and chat session for a query request.
+
+    Fills ``state`` as it goes so the caller can clean up a fresh upload on
+    failure; returns an error response tuple, or None when ready to answer.
+    """
+    user_id = None
+    try:
+        verify_jwt_in_request()
+        user_id = get_jwt_identity()
+    except Exception:
+        pass
+
+    file = request.files.get('file')
+    query_text = request.form.get("query", "").strip()
+    chat_id = request.form.get("chat_id")
+    chat_name = request.form.get("chat_name", "New Chat")
+    # Summary questions are answered from the stored summary unless the caller asks for a live answer
+    live = request.form.get("live", "").lower() in ("1", "true", "yes")
+
+    if not query_text:
+        return jsonify({"error": "Query cannot be empty"}), 400
+
+    documents = None
+    metadata = None
+    chat_session = None
+    chat_history = []
+    state.update({"user_id": user_id, "file": file, "query": query_text, "live": live})
+
+    # Handle case with new file upload
+    if file and file.filename != '':
+        if not allowed_file(file.filename):
+            return jsonify({"error": "Invalid file type"}), 400
+
+        file_ext = file.filename.rsplit('.', 1)[1].lower()
+        upload = store_upload(file.stream, current_app.config["UPLOAD_FOLDER"], file_ext)
+        state["filepath"] = upload["filepath"]
+        state["blob"] = upload["stored_name"]
+
+        # A re-uploaded file hits the parse cache and its existing index
+        documents, metadata = load_document(state["filepath"], upload["content_hash"])
+        if not documents and not metadata.get("text_length"):
+            raise FileProcessingError("Failed to process document content")
+        index_document(state["filepath"], documents)
+
+        if user_id:
+            doc_data = build_document_record(user_id, file.filename, upload["stored_name"], state["filepath"],
+                                             file_ext, metadata)
+            result = documents_collection.insert_one(doc_data)
+            state["document_id"] = str(result.inserted_id)
+            index_user_document(user_id, state["document_id"], state["filepath"], doc_data["content_hash"])
+            # The documents record now owns the blob reference
+            state["blob"] = None
+    # Handle query-only case with existing chat
+    elif chat_id and user_id:
+        chat_session = chat_sessions_collection.find_one({
+            "_id": ObjectId(chat_id),
+            "user_id": user_id
+        }, SESSION_PROJECTION)
+        if not chat_session:
+            return jsonify({"error": "Chat session not found or not authorized"}), 404
+        state["document_id"] = chat_session.get("document_id")
+        if state["document_id"]:
+            doc = documents_collection.find_one({"_id": ObjectId(state["document_id"])}, DOCUMENT_PROJECTION)
+            if doc:
+                state["filepath"] = os.path.join(current_app.config["UPLOAD_FOLDER"], doc["stored_name"])
+                if os.path.exists(state["filepath"]):
+                    documents, metadata = load_document(state["filepath"])
+                    # Documents uploaded before indexing existed get their index on first use
+                    index_document(state["filepath"], documents)
+                else:
+                    metadata = doc.get("metadata", {"title": "Untitled Document", "author": "Unknown Author"})
+                    documents = []
+        if not state["document_id"]:
+            return jsonify({"error": "No document associated with this chat"}), 400
+    else:
+        return jsonify({"error": "Must provide a file or a valid chat_id with an associated document"}), 400
+
+    # Set default query if new file but no query
+    if not query_text and file:
+        state["query"] = os.getenv("DEFAULT_QUERY", "Provide a detailed summary of this research paper.")
+
+    # Create or fetch chat session
+    if user_id:
+        if chat_id and not chat_session:
+            chat_session = chat_sessions_collection.find_one({"_id": ObjectId(chat_id), "user_id": user_id},
+                                                             SESSION_PROJECTION)
+        if not chat_session:
+            result = chat_sessions_collection.insert_one(new_chat_session(user_id, chat_name, state["document_id"]))
+            chat_session = chat_sessions_collection.find_one({"_id": result.inserted_id}, SESSION_PROJECTION)
+        else:
+            chat_session = migrate_legacy_history(chat_session)
+            # Only turns the running summary does not cover yet are read back; older ones come in via the summary
+            chat_history = with_summary(chat_session, get_recent_messages(chat_session, history_window(chat_session)))
+
+    if not metadata:
+        metadata = {"title": "Untitled Document", "author": "Unknown Author"}
+
+    state.update({
+        "chat_session": chat_session,
+        "chat_history": chat_history,
+        "documents": documents,
+        "metadata": metadata
+    })
+    return None
+
+def _save_exchange(state, response):
+    user_id = state["user_id"]
+    chat_session = state["chat_session"]
+    if not (user_id and chat_session):
+        return
+    file = state["file"]
+    document_id = state["document_id"] or chat_session.get("document_id")
+    query_entry = {
+        "user_id": user_id,
+        "chat_session_id": str(chat_session["_id"]),
+        "document_id": document_id,
+        "query": state["query"],
+        "response": response,
+        "timestamp": datetime.utcnow(),
+        "is_summary": "summar" in state["query"].lower()
+    }
+    queries_collection.insert_one(query_entry)
+
+    # The version-guarded update reserves the seq numbers the two new messages are written at
+    start_seq = message_count(chat_session)
+    update_result = chat_sessions_collection.update_one(
+        {"_id": chat_session["_id"], "version": chat_session["version"]},
+        {
+            "$set": {
+                "last_updated": datetime.utcnow(),
+                "document_id": document_id,
+                "message_count": start_seq + 2
+            },
+            "$inc": {"version": 1}
+        }
+    )
+    if update_result.modified_count == 0:
+        raise ValueError("Chat update failed due to concurrent modification")
+    append_messages(chat_session, start_seq,
+                    exchange_messages(state["query"], response, file.filename if file else None, document_id))
+    schedule_summary(chat_session, start_seq + 2)
+
+def _response_summary(state):
+    return {
+        "title": state["metadata"].get("title", "Untitled Document"),
+        "author": state["metadata"].get("author", "Unknown Author"),
+        "chat_id": str(state["chat_session"]["_id"]) if state["chat_session"] else None
+    }
+
+def _record_upload_summary(state, plan, response):
+    # Anonymous uploads keep no documents record, so nothing would ever read their summary back
+    if not (state["file"] and state["user_id"]) or plan.get("stored_summary"):
+        return
+    answer = None if plan.get("failed") else response
+    record_upload_answer(state["filepath"], state["metadata"].get("content_hash"), state["query"], answer)
+
+def _plan_query(state):
+    if not state["live"]:
+        # An upload's summary is recorded after its answer (_record_upload_summary), not backfilled here
+        backfill_path = None if state["file"] else state["filepath"]
+        summary = stored_summary(backfill_path, state["metadata"].get("content_hash"), state["query"])
+        if summary is not None:
+            return {"response": summary, "prompt": None, "cache_key": None, "stored_summary": True}
+    return plan_document_query(state["filepath"] or "", state["query"], state["chat_history"],
+                               state["documents"], state["metadata"], user_id=state["user_id"])
+
+def _release_upload(state):
+    # Anonymous uploads and failed requests give their blob back; the sweeper deletes it once unreferenced
+    if state.get("blob"):
+        release_blob(state["blob"])
+        state["blob"] = None
+
+def _new_query_state():
+    return {"filepath": None, "document_id": None, "blob": None}
+
+@document_bp.route("/process-document", methods=["POST"])
+def process_document():
+    state = _new_query_state()
+    try:
+        error_response = _load_query_request(state)
+        if error_response:
+            return error_response
+
+        plan = _plan_query(state)
+        response = answer_query(plan)
+        _save_exchange(state, response)
+        _record_upload_summary(state, plan, response)
+
+        return jsonify({"response": response, "context_tokens": plan.get("context_usage"),
+                        "stored_summary": plan.get("stored_summary", False), **_response_summary(state)})
+
     except FileProcessingError as e:
         logger.error(f"Document processing error: {str(e)}")
-        if filepath and os.path.exists(filepath) and not document_id:  # Only remove if not stored in DB
-            os.remove(filepath)
         return jsonify({"error": str(e)}), 400
     except ValueError as e:
         logger.error(f"Concurrency or data error: {str(e)}")
-        if filepath and os.path.exists(filepath) and not document_id:
-            os.remove(filepath)
         return jsonify({"error": str(e)}), 409
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-        if filepath and os.path.exists(filepath) and not document_id:
-            os.remove(filepath)
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        _release_upload(state)
+
+def _sse(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@document_bp.route("/process-document/stream", methods=["POST"])
+def process_document_stream():
+    """Same request as /process-document, answered as Server-Sent Events.
+
+    Emits ``data: {"token": ...}`` events as the LLM produces them, then a
+    ``done`` event once the full response has been saved to the chat.
+    """
+    state = _new_query_state()
+    try:
+        error_response = _load_query_request(state)
+        if error_response:
+            return error_response
+        plan = _plan_query(state)
+    except FileProcessingError as e:
+        logger.error(f"Document processing error: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        # The answer is generated from the plan alone, so the upload is not needed while streaming
+        _release_upload(state)
+
+    def generate():
+        tokens = []
+        try:
+            for token in stream_answer(plan):
+                tokens.append(token)
+                yield _sse({"token": token})
+            _save_exchange(state, "".join(tokens))
+            _record_upload_summary(state, plan, "".join(tokens))
+            yield _sse({"context_tokens": plan.get("context_usage"), "stored_summary": plan.get("stored_summary", False),
+                        **_response_summary(state)}, event="done")
+        except ValueError as e:
+            logger.error(f"Concurrency or data error: {str(e)}")
+            yield _sse({"error": str(e), "status": 409}, event="error")
+        except Exception as e:
+            logger.error(f"Unexpected streaming error: {str(e)}", exc_info=True)
+            yield _sse({"error": f"Internal server error: {str(e)}", "status": 500}, event="error")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
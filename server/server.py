@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, Response, jsonify, g, request
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
@@ -8,6 +8,17 @@ import secrets
 from routes.auth import auth_bp, set_bcrypt  # Import set_bcrypt
 from routes.document import document_bp
 from routes.chat import chat_bp
+from routes.admin import admin_bp, is_admin_request
+from utils.db import ensure_indexes, client as mongo_client
+from utils.nlp_utils import models_loaded, start_warm_up, warm_up_started
+from utils.context_packer import start_tokenizer_load
+from utils.blob_store import start_blob_sweeper
+from utils.metrics import render_prometheus, register_histogram, observe
+from utils.tracing import start_trace, end_trace, server_timing
+from utils.profiling import RequestProfile
+import logging
+import time
+import pymongo
 
 app = Flask(__name__)
 
@@ -38,10 +49,116 @@ set_bcrypt(bcrypt)  # Pass the bcrypt instance to auth.py
 # Create uploads folder
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+_services_started = False
+
+def start_services():
+    """Process-wide startup work for a serving process; safe to call more than once.
+
+    Never run at import: the ingestion and PDF shard pools spawn children that re-import the
+    main module, and each would otherwise start its own sweeper. Called from ``__main__``,
+    the gunicorn hooks in gunicorn.conf.py and the ASGI app's startup.
+    """
+    global _services_started
+    if _services_started:
+        return
+    _services_started = True
+
+    # Create Mongo indexes (TTL for the LLM response cache)
+    try:
+        ensure_indexes()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Could not ensure MongoDB indexes: {str(e)}")
+
+    # Delete uploaded files that no document references any more
+    start_blob_sweeper()
+
+    # Token budgets are estimated until the context tokenizer has loaded
+    start_tokenizer_load()
+
+    # Models load on first use; set WARMUP_ON_START to load them in the background right away (and have
+    # /ready wait for them)
+    if os.getenv("WARMUP_ON_START", "false").lower() == "true":
+        start_warm_up()
+
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(document_bp, url_prefix='/document')
 app.register_blueprint(chat_bp, url_prefix='/chat')
+app.register_blueprint(admin_bp, url_prefix='/admin')
+
+register_histogram("http_request_duration_seconds", "Request handling time by endpoint, method and status")
+
+@app.before_request
+def start_request_trace():
+    g.trace_token = start_trace()
+    g.request_started = time.perf_counter()
+    # Opt-in profiling ("X-Profile: sample|cprofile" or ?profile=...), honoured for admin tokens only
+    mode = request.headers.get("X-Profile") or request.args.get("profile")
+    if mode and is_admin_request():
+        g.profile = RequestProfile(mode.lower()).start()
+
+@app.after_request
+def add_server_timing(response):
+    # Streamed bodies are produced after this runs, so their header covers everything up to the first byte
+    profile = g.pop("profile", None)
+    if profile is not None:
+        request_id = profile.stop({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code
+        })
+        if request_id:
+            response.headers["X-Profile-Id"] = request_id
+    if "trace_token" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    trace = end_trace(g.pop("trace_token"))
+    response.headers["Server-Timing"] = server_timing(trace, elapsed)
+    # Lets the (cross-origin) client read the timings through the Performance API
+    response.headers["Timing-Allow-Origin"] = "*"
+    observe("http_request_duration_seconds", elapsed,
+            {"endpoint": request.endpoint or "unmatched", "method": request.method, "status": str(response.status_code)})
+    return response
+
+@app.teardown_request
+def stop_abandoned_profile(error):
+    # after_request does not run when a view raises; never leave a profiler attached to the thread
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.stop({"method": request.method, "path": request.path, "endpoint": request.endpoint, "status": 500})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once MongoDB answers (and the models are loaded, if a warm-up was started), else 503.
+
+    Without a warm-up the models load on the first request that needs them, so gating on them
+    would keep a readiness-gated deployment from ever receiving that request.
+    """
+    checks = {"models": models_loaded(), "mongo": False}
+    try:
+        with pymongo.timeout(float(os.getenv("READY_DB_TIMEOUT", 2))):
+            mongo_client.admin.command("ping")
+        checks["mongo"] = True
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Readiness check could not reach MongoDB: {str(e)}")
+    required = [checks["mongo"], checks["models"] or not warm_up_started()]
+    status = "ready" if all(required) else "warming"
+    return jsonify({"status": status, **checks}), 200 if status == "ready" else 503
+
+@app.route('/warmup', methods=['POST'])
+def warmup():
+    # Idempotent: starts the background warm-up at most once per process
+    started = start_warm_up()
+    return jsonify({"status": "ready" if models_loaded() else "warming", "started": started}), 202
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
\ No newline at end of file
+    debug = True
+    # With the reloader, only the child that actually serves requests starts the services
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=debug)
@@ -0,0 +1,87 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from utils import chat_store
+from utils.chat_store import new_chat_session, append_messages, get_messages, clear_messages, message_count
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().get_database("test")
+    database.chat_messages.create_index([("chat_id", 1), ("epoch", 1), ("bucket", 1)], unique=True)
+    monkeypatch.setattr(chat_store, "chat_sessions_collection", database.chat_sessions)
+    monkeypatch.setattr(chat_store, "chat_messages_collection", database.chat_messages)
+    monkeypatch.setattr(chat_store, "MESSAGE_BUCKET_SIZE", 3)
+    return database
+
+def session(db, chat_id):
+    return db.chat_sessions.find_one({"_id": chat_id})
+
+def reserve(db, chat_id, count=2):
+    """The exchange save's version-guarded seq reservation; returns the session as read before it."""
+    before = session(db, chat_id)
+    updated = db.chat_sessions.update_one(
+        {"_id": chat_id, "version": before["version"]},
+        {"$set": {"message_count": message_count(before) + count}, "$inc": {"version": 1}}
+    )
+    assert updated.modified_count == 1
+    return before
+
+def say(db, chat_id, *texts):
+    before = reserve(db, chat_id, len(texts))
+    append_messages(before, message_count(before), [{"type": "user", "content": text} for text in texts])
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+@pytest.fixture
+def chat_id(db):
+    return db.chat_sessions.insert_one(new_chat_session("user-1", "Chat", None)).inserted_id
+
+def test_messages_are_bucketed_and_read_back_in_order(db, chat_id):
+    say(db, chat_id, "m0", "m1", "m2", "m3")
+    say(db, chat_id, "m4", "m5", "m6")
+    buckets = sorted(db.chat_messages.find({"chat_id": chat_id}), key=lambda bucket: bucket["bucket"])
+    assert [bucket["count"] for bucket in buckets] == [3, 3, 1]
+    messages = get_messages(session(db, chat_id))
+    assert contents(messages) == [f"m{i}" for i in range(7)]
+    assert [message["seq"] for message in messages] == list(range(7))
+
+def test_pages_before_a_seq(db, chat_id):
+    say(db, chat_id, *[f"m{i}" for i in range(7)])
+    current = session(db, chat_id)
+    assert contents(get_messages(current, before=5, limit=3)) == ["m2", "m3", "m4"]
+    assert contents(get_messages(current, before=2, limit=3)) == ["m0", "m1"]
+    assert contents(get_messages(current, before=100, limit=2)) == ["m5", "m6"]
+    assert get_messages(current, before=0) == []
+
+def test_clear_with_a_stale_session_changes_nothing(db, chat_id):
+    say(db, chat_id, "m0", "m1")
+    stale = session(db, chat_id)
+    say(db, chat_id, "m2", "m3")
+    assert not clear_messages(stale)
+    assert contents(get_messages(session(db, chat_id))) == ["m0", "m1", "m2", "m3"]
+
+def test_append_racing_a_clear_never_resurfaces(db, chat_id):
+    say(db, chat_id, "old0", "old1", "old2", "old3")
+    # An exchange reserves seq 4-5, then the clear wins before its messages are written
+    late = reserve(db, chat_id)
+    assert clear_messages(session(db, chat_id))
+    append_messages(late, message_count(late), [{"type": "user", "content": "late4"}, {"type": "bot", "content": "late5"}])
+    say(db, chat_id, "new0", "new1", "new2", "new3", "new4", "new5")
+
+    messages = get_messages(session(db, chat_id))
+    assert contents(messages) == [f"new{i}" for i in range(6)]
+    assert [message["seq"] for message in messages] == list(range(6))
+
+    # The next clear removes the late exchange's leftover bucket as well
+    assert clear_messages(session(db, chat_id))
+    assert db.chat_messages.count_documents({"chat_id": chat_id}) == 0
+
+def test_clear_removes_buckets_written_before_epochs(db, chat_id):
+    db.chat_sessions.update_one({"_id": chat_id}, {"$unset": {"epoch": ""}, "$set": {"message_count": 1}})
+    db.chat_messages.insert_one({"chat_id": chat_id, "bucket": 0, "count": 1,
+                                 "messages": [{"type": "user", "content": "legacy", "seq": 0}]})
+    assert contents(get_messages(session(db, chat_id))) == ["legacy"]
+    assert clear_messages(session(db, chat_id))
+    assert db.chat_messages.count_documents({"chat_id": chat_id}) == 0
+    assert get_messages(session(db, chat_id)) == []
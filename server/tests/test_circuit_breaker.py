@@ -0,0 +1,125 @@
+import pytest
+
+pytest.importorskip("requests")
+import requests
+from utils import llm_client
+from utils.llm_client import CircuitBreaker, CircuitOpenError, LLMClient
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_client.time, "monotonic", clock.monotonic)
+    return clock
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.release(breaker.admit())
+        breaker.record_failure()
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.admit() == "closed"
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.admit() is None
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.admit() == "trial"
+    assert breaker.admit() is None
+
+def test_successful_trial_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    admission = breaker.admit()
+    breaker.record_success()
+    breaker.release(admission)
+    assert breaker.state == "closed"
+    assert breaker.admit() == "closed"
+
+def test_failed_trial_reopens_for_another_cool_down(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    admission = breaker.admit()
+    breaker.record_failure()
+    breaker.release(admission)
+    assert breaker.state == "open"
+    assert breaker.admit() is None
+    clock.now += 30
+    assert breaker.admit() == "trial"
+
+def test_trial_released_without_outcome_frees_the_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    clock.now += 30
+    breaker.release(breaker.admit())
+    assert breaker.state == "half_open"
+    assert breaker.admit() == "trial"
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def close(self):
+        pass
+
+class FakeSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+
+    def post(self, *args, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+def half_open_client(clock, outcomes):
+    client = LLMClient("http://llm.invalid", "key", "model", max_retries=2, backoff_base=0,
+                       breaker=CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    client.session = FakeSession(outcomes)
+    open_breaker(client.breaker)
+    clock.now += 30
+    return client
+
+def test_client_trial_with_5xx_reopens_and_recovers_later(clock):
+    client = half_open_client(clock, [503, 200])
+    with pytest.raises(CircuitOpenError):
+        client._post({}, stream=False)
+    assert client.breaker.state == "open"
+    clock.now += 30
+    assert client._post({}, stream=False).status_code == 200
+    assert client.breaker.state == "closed"
+
+def test_client_trial_with_unexpected_error_does_not_wedge_the_breaker(clock):
+    client = half_open_client(clock, [requests.exceptions.ChunkedEncodingError("truncated"), 200])
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client._post({}, stream=False)
+    assert client._post({}, stream=False).status_code == 200
+    assert client.breaker.state == "closed"
@@ -0,0 +1,80 @@
+import pytest
+
+from utils import context_packer
+from utils.context_packer import count_tokens, truncate_to_tokens, strip_overlap, select_chunks, pack_context
+
+SENTENCE = "The model is trained on a large corpus of scientific papers. "
+
+@pytest.fixture(autouse=True)
+def length_based_tokens(monkeypatch):
+    # Token counts from the ~4 chars per token estimate, whatever tokenizer is installed
+    monkeypatch.setattr(context_packer, "_tokenizer", None)
+    monkeypatch.setattr(context_packer, "_tokenizer_loaded", True)
+
+def test_truncate_returns_nothing_without_a_budget():
+    assert truncate_to_tokens(SENTENCE * 10, 0) == ""
+    assert truncate_to_tokens(SENTENCE * 10, -5) == ""
+
+def test_truncate_stays_within_the_budget():
+    text = SENTENCE * 10
+    assert truncate_to_tokens(text, 1000) == text
+    truncated = truncate_to_tokens(text, 40)
+    assert text.startswith(truncated)
+    assert 0 < count_tokens(truncated) <= 40
+
+def test_strip_overlap_drops_the_repeated_prefix():
+    previous = "Results improve on every benchmark. The largest gain is on the retrieval task."
+    text = "The largest gain is on the retrieval task. Ablations follow in section five."
+    assert strip_overlap(previous, text, 100) == "Ablations follow in section five."
+    # Overlap shorter than MIN_OVERLAP_CHARS, or beyond max_overlap, is kept
+    assert strip_overlap(previous, "task. Ablations follow.", 100) == "task. Ablations follow."
+    assert strip_overlap(previous, text, 10) == text
+
+def test_select_chunks_drops_near_duplicates():
+    texts = [
+        "transformer attention layers improve translation quality on benchmarks",
+        "transformer attention layers improve translation quality on benchmarks today",
+        "the dataset contains ten thousand annotated clinical notes"
+    ]
+    assert select_chunks(texts) == [0, 2]
+
+def test_pack_context_stays_within_budget():
+    history = [f"USER: {SENTENCE * 3}"] * 20
+    chunks = [("[Section: results]", f"Chunk {i}. " + SENTENCE * 8 + f"Unique marker {i} word{i}.") for i in range(10)]
+    for budget in (50, 200, 600, 2000):
+        packed = pack_context("TITLE: Paper", history, chunks, budget=budget, history_summary=SENTENCE * 30)
+        usage = packed["usage"]
+        assert usage["total"] == usage["metadata"] + usage["history"] + usage["chunks"]
+        assert usage["total"] <= budget
+        assert usage["history"] <= int(budget * context_packer.HISTORY_TOKEN_SHARE)
+        assert usage["chunks_used"] + usage["chunks_dropped"] == len(chunks)
+
+def test_history_is_skipped_when_metadata_fills_the_budget():
+    metadata = "TITLE: " + "word " * 200
+    packed = pack_context(metadata, ["USER: hello"], [], budget=100, history_summary="Asked about methods.")
+    assert packed["usage"]["history"] == 0
+    assert "PREVIOUS CONVERSATION" not in packed["text"]
+    assert "Asked about methods" not in packed["text"]
+
+def test_history_keeps_the_newest_lines_that_fit():
+    lines = [f"USER: question {i} " + "x" * 40 for i in range(10)]
+    packed = pack_context(None, lines, [], budget=200)
+    history = packed["text"].split("\n")[1:]
+    assert history == list(reversed(lines[:len(history)]))
+    assert 0 < len(history) < len(lines)
+
+def test_packed_chunks_have_overlap_and_duplicates_removed():
+    first = "Results improve on every benchmark. The largest gain is on the retrieval task."
+    second = "The largest gain is on the retrieval task. Ablations follow in section five."
+    chunks = [("[Section: results]", first), ("[Section: results]", first), ("[Section: results]", second)]
+    packed = pack_context(None, [], chunks, budget=500, max_overlap=100)
+    assert packed["text"].count("The largest gain") == 1
+    assert "Ablations follow in section five." in packed["text"]
+    assert packed["usage"]["chunks_used"] == 2
+
+def test_counting_before_the_tokenizer_loads_estimates_and_loads_in_the_background(monkeypatch):
+    started = []
+    monkeypatch.setattr(context_packer, "_tokenizer_loaded", False)
+    monkeypatch.setattr(context_packer, "start_tokenizer_load", lambda: started.append(True))
+    assert count_tokens("x" * 10) == 3
+    assert started == [True]
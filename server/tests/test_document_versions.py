@@ -0,0 +1,167 @@
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain")
+mongomock = pytest.importorskip("mongomock")
+from utils import cache_utils, text_store, blob_store, nlp_utils
+from utils.file_utils import pdf_page_hashes
+from utils.nlp_utils import load_document, load_document_version
+
+PAGES = [
+    ("Introduction to sparse retrieval for long scientific documents", "Helvetica"),
+    ("Results appear in Figure 1 for every benchmark we ran", "Helvetica"),
+    ("Discussion of Table 1 and the limits of the approach", "Helvetica")
+]
+
+def make_pdf(pages):
+    """A minimal PDF with one line of text per page, drawn with the page's own font resource."""
+    kids = " ".join(f"{3 + 3 * i} 0 R" for i in range(len(pages)))
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode()
+    }
+    for i, (text, font) in enumerate(pages):
+        page_id, content_id, font_id = 3 + 3 * i, 4 + 3 * i, 5 + 3 * i
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_id} 0 R "
+                            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>").encode()
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[font_id] = f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} >>".encode()
+    out = b"%PDF-1.4\n"
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += f"{number} 0 obj\n".encode() + objects[number] + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offsets[number]:010d} 00000 n \n".encode() for number in sorted(objects))
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+def write_pdf(directory, name, pages):
+    path = directory / name
+    path.write_bytes(make_pdf(pages))
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_utils, "PARSED_CACHE_DIR", str(tmp_path / "parsed"))
+    monkeypatch.setattr(text_store, "TEXT_STORE_DIR", str(tmp_path / "text"))
+
+@pytest.fixture
+def scanned(monkeypatch):
+    """Page indices the incremental parse actually extracts."""
+    calls = []
+    scan = nlp_utils.scan_pdf_pages
+
+    def spy(file_path, page_indices):
+        calls.extend(page_indices)
+        return scan(file_path, page_indices)
+
+    monkeypatch.setattr(nlp_utils, "scan_pdf_pages", spy)
+    return calls
+
+def parse(path):
+    return load_document(path, cache_utils.compute_file_hash(path))
+
+def test_page_hash_covers_the_page_resources(tmp_path):
+    original = write_pdf(tmp_path, "v1.pdf", PAGES)
+    refonted = write_pdf(tmp_path, "v2.pdf", [PAGES[0], (PAGES[1][0], "Courier"), PAGES[2]])
+    _, before = pdf_page_hashes(original)
+    _, after = pdf_page_hashes(refonted)
+    assert before[0] == after[0] and before[2] == after[2]
+    assert before[1] != after[1]
+
+def test_unchanged_pages_are_reused(tmp_path, scanned):
+    original = write_pdf(tmp_path, "v1.pdf", PAGES)
+    _, previous = parse(original)
+    edited = write_pdf(tmp_path, "v2.pdf",
+                       [PAGES[0], ("Results appear in Figure 1 and Figure 2", "Helvetica"), PAGES[2]])
+
+    chunks, metadata, stats = load_document_version(edited, cache_utils.compute_file_hash(edited),
+                                                    previous["content_hash"])
+    assert scanned == [1]
+    assert stats == {"pages_total": 3, "pages_reextracted": 1}
+    assert [chunk.metadata["page"] for chunk in chunks] == [0, 1, 2]
+    assert chunks[0].page_content == PAGES[0][0] and chunks[2].page_content == PAGES[2][0]
+    assert "Figure 2" in chunks[1].page_content
+    # Counts merge the re-extracted page's with the reused pages' stored ones
+    assert metadata["figure_count"] == 2 and metadata["table_count"] == 1
+    assert text_store.load_text(metadata["content_hash"]).split("\n") == [
+        PAGES[0][0], "Results appear in Figure 1 and Figure 2", PAGES[2][0]
+    ]
+
+def test_page_with_new_resources_is_reextracted(tmp_path, scanned):
+    original = write_pdf(tmp_path, "v1.pdf", PAGES)
+    _, previous = parse(original)
+    refonted = write_pdf(tmp_path, "v2.pdf", [PAGES[0], (PAGES[1][0], "Courier"), PAGES[2]])
+
+    chunks, metadata, stats = load_document_version(refonted, cache_utils.compute_file_hash(refonted),
+                                                    previous["content_hash"])
+    assert scanned == [1]
+    assert stats["pages_reextracted"] == 1
+    assert chunks[1].metadata["page_hash"] == pdf_page_hashes(refonted)[1][1]
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pytest.importorskip("flask_jwt_extended")
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+    from routes import document as document_routes
+
+    database = mongomock.MongoClient().get_database("test")
+    monkeypatch.setattr(document_routes, "documents_collection", database.documents)
+    monkeypatch.setattr(blob_store, "blobs_collection", database.blobs)
+    # Embedding and search indexes are covered elsewhere; only their calls matter here
+    monkeypatch.setattr(document_routes, "index_document_version",
+                        lambda file_path, documents, previous_path, previous_hash: {"chunks_reembedded": 1})
+    monkeypatch.setattr(document_routes, "index_user_document", lambda *args: None)
+    monkeypatch.setattr(document_routes, "unindex_user_document", lambda *args: None)
+    monkeypatch.setattr(document_routes, "schedule_document_summary", lambda *args: None)
+
+    app = Flask(__name__)
+    app.config.update(JWT_SECRET_KEY="test-secret-" + "x" * 32, UPLOAD_FOLDER=str(tmp_path / "uploads"))
+    (tmp_path / "uploads").mkdir()
+    JWTManager(app)
+    app.register_blueprint(document_routes.document_bp, url_prefix="/document")
+    with app.app_context():
+        token = create_access_token(identity="user-1")
+    test_client = app.test_client()
+    test_client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    test_client.database = database
+    test_client.upload_folder = app.config["UPLOAD_FOLDER"]
+    return test_client
+
+def test_version_route_replaces_the_document_reextracting_changed_pages(client, scanned):
+    first = blob_store.store_upload(BytesIO(make_pdf(PAGES)), client.upload_folder, "pdf")
+    _, metadata = load_document(first["filepath"], first["content_hash"])
+    document_id = client.database.documents.insert_one({
+        "user_id": "user-1", "stored_name": first["stored_name"], "content_hash": first["content_hash"],
+        "file_type": "pdf", "metadata": metadata, "version": 1
+    }).inserted_id
+
+    edited = make_pdf([PAGES[0], PAGES[1], ("Discussion of Table 1 and Table 2", "Helvetica")])
+    response = client.post(f"/document/{document_id}/version",
+                           data={"file": (BytesIO(edited), "paper.pdf")}, content_type="multipart/form-data")
+
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body["version"] == 2
+    assert (body["pages_total"], body["pages_reextracted"], body["chunks_total"]) == (3, 1, 3)
+    assert scanned == [2]
+    record = client.database.documents.find_one({"_id": document_id})
+    assert record["version"] == 2 and record["previous_content_hash"] == first["content_hash"]
+    assert record["metadata"]["table_count"] == 2
+    # The record holds the new blob; the old one is released for the sweeper
+    assert client.database.blobs.find_one({"_id": record["stored_name"]})["refcount"] == 1
+    assert client.database.blobs.find_one({"_id": first["stored_name"]})["refcount"] == 0
+
+def test_version_route_rejects_another_file_type(client):
+    document_id = client.database.documents.insert_one({
+        "user_id": "user-1", "stored_name": "doc_x.pdf", "content_hash": "x", "file_type": "pdf", "version": 1
+    }).inserted_id
+    response = client.post(f"/document/{document_id}/version",
+                           data={"file": (BytesIO(b"PK"), "paper.docx")}, content_type="multipart/form-data")
+    assert response.status_code == 400
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("pymongo")
+from utils.llm_cache import response_cache_key, history_digest
+
+STYLE = {"tone": "professional", "structure": "paragraph", "depth": "detailed"}
+
+def key(chat_history=None, user_id=None, query="Explain that in more detail"):
+    return response_cache_key("a" * 64, query, STYLE, "model", chat_history, user_id)
+
+def test_chats_with_different_histories_do_not_share_an_entry():
+    first = [{"type": "user", "content": "What dataset is used?"}, {"type": "bot", "content": "ImageNet."}]
+    second = [{"type": "user", "content": "Who are the authors?"}, {"type": "bot", "content": "Ada and Alan."}]
+    assert key(first, "user-1") != key(second, "user-1")
+
+def test_running_summary_is_part_of_the_key():
+    recent = [{"type": "user", "content": "And the results?"}]
+    assert key([{"type": "summary", "content": "Asked about methods."}] + recent, "user-1") != key(recent, "user-1")
+
+def test_answers_shaped_by_history_are_not_shared_across_users():
+    history = [{"type": "user", "content": "What dataset is used?"}]
+    assert key(history, "user-1") != key(history, "user-2")
+
+def test_history_free_answers_are_shared():
+    assert key(user_id="user-1") == key(user_id="user-2") == key()
+    assert history_digest([]) is None
+
+def test_query_normalisation_still_applies():
+    assert key(query="Summarize this paper?") == key(query="  summarize   THIS paper")
@@ -0,0 +1,284 @@
+"""End-to-end load test for the query path, without spending LLM quota.
+
+Starts the stub LLM (``tools/stub_llm.py``) in-process, a MongoDB (a throwaway
+``mongod`` when one is on PATH, otherwise the in-memory ``mongomock://`` stand-in,
+which needs ``pip install mongomock``) and ``server.py``, then replays a workload of
+virtual users at the chosen concurrency. Each virtual user:
+
+1. signs up and logs in,
+2. uploads a synthetic paper with its first question (``POST /document/process-document``),
+3. asks ``--questions - 1`` follow-ups in the same chat, loading the sidebar
+   (``GET /chat/history``) after each answer.
+
+    python -m tools.loadgen --users 40 --concurrency 8 --questions 5 --llm-latency 1.5
+    python -m tools.loadgen --workers 4 --threads 4 --concurrency 16   # gunicorn, needs a real mongod
+
+Reports throughput plus p50/p95/p99 latency, error and 409 (concurrent chat update) rates
+per endpoint; ``--output`` also writes them as JSON. Uploads embed the document, so the
+first requests include loading the embedding model unless ``--warm-up`` is given.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from tools.stub_llm import create_server
+from benchmarks.corpus import SIZES, build_corpus
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = [
+    "Summarize the main contribution of this paper",
+    "Which dataset and baseline are used in the experiments?",
+    "Explain the methodology in technical detail",
+    "How do the results compare with the baseline?",
+    "What are the limitations discussed by the authors?",
+    "Which evaluation metrics are reported?",
+    "What future work do the authors propose?"
+]
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_for(url: str, timeout: float, process: subprocess.Popen = None, ok=(200,)) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with {process.returncode} before {url} came up")
+        try:
+            if requests.get(url, timeout=2).status_code in ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+def start_mongod(scratch: str, timeout: float) -> tuple:
+    port = _free_port()
+    dbpath = os.path.join(scratch, "mongo")
+    os.makedirs(dbpath)
+    process = subprocess.Popen(
+        ["mongod", "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, f"mongodb://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("mongod did not start")
+
+def start_server(args, mongo_uri: str, llm_url: str, scratch: str, port: int) -> tuple:
+    # Runs inside the scratch directory, so uploads and caches never mix with the real ones
+    run_dir = os.path.join(scratch, "server")
+    os.makedirs(run_dir)
+    env = {
+        **os.environ,
+        "PYTHONPATH": SERVER_DIR,
+        "MONGO_URI": mongo_uri,
+        "TOGETHER_API_URL": llm_url,
+        "TOGETHER_API_KEY": "load-test",
+        "JWT_SECRET": "load-test-secret"
+    }
+    if args.workers:
+        command = ["gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+                   "-b", f"127.0.0.1:{port}", "--timeout", "300", "server:app"]
+    else:
+        # The threaded development server, without the debug reloader server.py's __main__ enables
+        command = [sys.executable, "-c",
+                   "import server; server.start_services(); "
+                   f"server.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log_path = os.path.join(scratch, "server.log")
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, log, log_path
+
+def _print_log_tail(log_path: str, lines: int = 40) -> None:
+    with open(log_path, errors="replace") as f:
+        tail = f.readlines()[-lines:]
+    print("Server log (tail):\n" + "".join(tail), file=sys.stderr)
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def request(self, session: requests.Session, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=300, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        with self._lock:
+            self.samples.append((label, status, time.perf_counter() - started))
+        return response
+
+def virtual_user(base_url: str, index: int, run_id: str, documents: list, args, recorder: Recorder) -> None:
+    session = requests.Session()
+    username = f"load-{run_id}-{index}"
+    recorder.request(session, "signup", "POST", f"{base_url}/auth/signup",
+                     json={"username": username, "email": f"{username}@example.com", "password": "load-test"})
+    login = recorder.request(session, "login", "POST", f"{base_url}/auth/login",
+                             json={"username": username, "password": "load-test"})
+    if login is None or login.status_code != 200:
+        return
+    session.headers["Authorization"] = f"Bearer {login.json()['token']}"
+
+    # Unique questions per user unless cached answers are part of what is being measured
+    suffix = "" if args.repeat_questions else f" ({username})"
+    questions = [QUESTIONS[(index + i) % len(QUESTIONS)] + suffix for i in range(args.questions)]
+    path = documents[index % len(documents)]
+    with open(path, "rb") as f:
+        upload = recorder.request(session, "process-document (upload)", "POST",
+                                  f"{base_url}/document/process-document",
+                                  files={"file": (os.path.basename(path), f, "application/pdf")},
+                                  data={"query": questions[0], "chat_name": f"Load test {index}"})
+    if upload is None or upload.status_code != 200:
+        return
+    chat_id = upload.json().get("chat_id")
+    for question in questions[1:]:
+        recorder.request(session, "process-document (follow-up)", "POST", f"{base_url}/document/process-document",
+                         data={"query": question, "chat_id": chat_id})
+        recorder.request(session, "chat/history", "GET", f"{base_url}/chat/history", params={"limit": 20})
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize(samples: list, elapsed: float) -> dict:
+    labels = {}
+    for label, status, latency in samples:
+        labels.setdefault(label, []).append((status, latency))
+    labels["all"] = [(status, latency) for _, status, latency in samples]
+    report = {}
+    for label, entries in labels.items():
+        latencies = sorted(latency for _, latency in entries)
+        errors = sum(1 for status, _ in entries if status == 0 or (status >= 400 and status != 409))
+        conflicts = sum(1 for status, _ in entries if status == 409)
+        report[label] = {
+            "requests": len(entries),
+            "throughput_rps": len(entries) / elapsed if elapsed else 0.0,
+            "p50_ms": _percentile(latencies, 0.50) * 1000,
+            "p95_ms": _percentile(latencies, 0.95) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "error_rate": errors / len(entries),
+            "conflict_rate": conflicts / len(entries)
+        }
+    return report
+
+def print_report(report: dict, elapsed: float) -> None:
+    print(f"\n{'endpoint':32} {'reqs':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'err %':>7} {'409 %':>7}")
+    for label, row in sorted(report.items(), key=lambda item: item[0] == "all"):
+        print(f"{label:32} {row['requests']:6d} {row['throughput_rps']:8.2f} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} "
+              f"{row['p99_ms']:9.1f} {row['error_rate'] * 100:7.2f} {row['conflict_rate'] * 100:7.2f}")
+    print(f"\nWorkload finished in {elapsed:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the query path against a stub LLM")
+    parser.add_argument("--users", type=int, default=20, help="Virtual users in total")
+    parser.add_argument("--concurrency", type=int, default=4, help="Virtual users running at once")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per user, including the upload's")
+    parser.add_argument("--documents", type=int, default=4, help="Distinct papers shared among the users")
+    parser.add_argument("--document-size", choices=list(SIZES), default="small")
+    parser.add_argument("--repeat-questions", action="store_true", help="Let users ask identical questions")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Stub LLM seconds per answer")
+    parser.add_argument("--llm-fail-rate", type=int, default=0, help="Stub answers every Nth request with 429")
+    parser.add_argument("--mongo", choices=["auto", "mongod", "mongomock"], default="auto")
+    parser.add_argument("--mongo-uri", help="Use this running MongoDB instead of starting one")
+    parser.add_argument("--workers", type=int, default=0, help="Run under gunicorn with this many workers")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per gunicorn worker")
+    parser.add_argument("--warm-up", action="store_true", help="Load the models before the workload starts")
+    parser.add_argument("--startup-timeout", type=float, default=180)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="tattva-load-")
+    processes = []
+    stub = None
+    server_log = None
+    log_path = None
+    try:
+        stub = create_server(port=0, latency=args.llm_latency, fail_rate=args.llm_fail_rate)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        llm_url = f"http://127.0.0.1:{stub.server_address[1]}/v1/chat/completions"
+
+        mongo_uri = args.mongo_uri
+        if not mongo_uri:
+            use_mongod = args.mongo == "mongod" or (args.mongo == "auto" and shutil.which("mongod"))
+            if use_mongod:
+                mongod, mongo_uri = start_mongod(scratch, args.startup_timeout)
+                processes.append(mongod)
+            else:
+                if args.workers > 1:
+                    parser.error("mongomock keeps data per process; use a mongod with --workers > 1")
+                mongo_uri = "mongomock://localhost"
+        print(f"MongoDB: {mongo_uri}", file=sys.stderr)
+
+        corpus_dir = os.path.join(scratch, "corpus")
+        documents = [build_corpus(corpus_dir, [args.document_size], seed)[("pdf", args.document_size)]
+                     for seed in range(max(1, args.documents))]
+
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server, server_log, log_path = start_server(args, mongo_uri, llm_url, scratch, port)
+        processes.append(server)
+        _wait_for(f"{base_url}/metrics", args.startup_timeout, server)
+        if args.warm_up:
+            requests.post(f"{base_url}/warmup", timeout=10)
+            _wait_for(f"{base_url}/ready", args.startup_timeout, server)
+        print(f"Server up at {base_url}", file=sys.stderr)
+
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:8]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(virtual_user, base_url, i, run_id, documents, args, recorder)
+                       for i in range(args.users)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        if not recorder.samples:
+            print("No requests were made", file=sys.stderr)
+            sys.exit(1)
+        report = summarize(recorder.samples, elapsed)
+        print_report(report, elapsed)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"elapsed_s": elapsed, "config": vars(args), "endpoints": report}, f, indent=2)
+        if report["all"]["error_rate"] and log_path:
+            _print_log_tail(log_path)
+    except Exception:
+        if log_path:
+            _print_log_tail(log_path)
+        raise
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if server_log:
+            server_log.close()
+        if stub:
+            stub.shutdown()
+            stub.server_close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
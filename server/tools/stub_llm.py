@@ -0,0 +1,121 @@
+"""Local stand-in for the Together chat completions API.
+
+Point the server at it with
+``TOGETHER_API_URL=http://127.0.0.1:8001/v1/chat/completions`` to exercise
+the query path (including ``/document/process-document/stream``) without
+spending LLM quota.
+
+    python tools/stub_llm.py --port 8001 --latency 0.5 --token-delay 0.02
+"""
+import argparse
+import itertools
+import json
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESPONSE = (
+    "This is a stubbed answer from the local LLM server. The paper introduces a method, "
+    "evaluates it on several datasets and discusses its limitations."
+)
+
+def make_handler(latency: float, token_delay: float, response_text: str, fail_rate: int = 0):
+    request_counter = itertools.count(1)
+
+    class StubLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _send_json(self, status: int, body: dict) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._send_json(400, {"error": "Invalid JSON body"})
+
+            request_number = next(request_counter)
+            # Every fail_rate-th request is rate limited so retry paths get exercised
+            if fail_rate and request_number % fail_rate == 0:
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            time.sleep(latency)
+            model = body.get("model", "stub-model")
+            if not body.get("stream"):
+                return self._send_json(200, {
+                    "id": f"stub-{request_number}",
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": response_text},
+                        "finish_reason": "stop"
+                    }]
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = response_text.split(" ")
+            for i, word in enumerate(words):
+                token = word if i == 0 else " " + word
+                chunk = {
+                    "id": f"stub-{request_number}",
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return StubLLMHandler
+
+def create_server(host: str = "127.0.0.1", port: int = 8001, latency: float = 0.0, token_delay: float = 0.0,
+                  response_text: str = DEFAULT_RESPONSE, fail_rate: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(latency, token_delay, response_text, fail_rate))
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stub Together-compatible LLM endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE)
+    parser.add_argument("--fail-rate", type=int, default=0, help="Answer every Nth request with 429")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = create_server(args.host, args.port, args.latency, args.token_delay, args.response, args.fail_rate)
+    logger.info(f"Stub LLM listening on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
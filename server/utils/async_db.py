@@ -0,0 +1,17 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from utils.db import MongoCommandTimer
+import os
+
+load_dotenv()
+
+# Motor mirror of utils.db for the ASGI serving mode
+client = AsyncIOMotorClient(os.getenv("MONGO_URI"), event_listeners=[MongoCommandTimer()])
+db = client.get_database("InsightPaper")
+
+documents_collection = db["documents"]
+chat_sessions_collection = db["chat_sessions"]
+queries_collection = db["queries"]
+chat_messages_collection = db["chat_messages"]
+llm_cache_collection = db["llm_response_cache"]
+document_summaries_collection = db["document_summaries"]
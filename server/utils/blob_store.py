@@ -0,0 +1,172 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from utils.db import blobs_collection, documents_collection, document_summaries_collection
+from utils.cache_utils import HASH_BLOCK_SIZE, remove_parsed_documents
+from utils.vector_store import index_path_for
+from utils.bm25_index import bm25_path_for
+from utils.text_store import DOCUMENT_PROJECTION, remove_text
+
+logger = logging.getLogger(__name__)
+
+# Uploads are stored once per content hash as doc_<sha256>.<ext>. Every documents record and every
+# in-flight upload holds one reference on its blob; the sweeper deletes blobs nobody references.
+BLOB_GC_INTERVAL = int(os.getenv("BLOB_GC_INTERVAL", 3600))
+# Unreferenced blobs are kept this long so a quick re-upload still finds its parse and index
+BLOB_GC_GRACE = int(os.getenv("BLOB_GC_GRACE", 3600))
+ACQUIRE_ATTEMPTS = 5
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+def blob_name(content_hash: str, file_ext: str) -> str:
+    return f"doc_{content_hash}.{file_ext}"
+
+def _stream_to_temp(stream: Any, upload_folder: str) -> Tuple[str, str, int]:
+    """Copy an upload stream to a temp file, hashing it on the way through."""
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, prefix="upload_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b""):
+                sha256.update(block)
+                size += len(block)
+                out.write(block)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, sha256.hexdigest(), size
+
+def acquire_blob(stored_name: str, content_hash: str, filepath: str, file_ext: str, size: int) -> None:
+    for attempt in range(ACQUIRE_ATTEMPTS):
+        try:
+            blobs_collection.update_one(
+                {"_id": stored_name, "deleting": {"$ne": True}},
+                {
+                    "$inc": {"refcount": 1},
+                    "$set": {"released_at": None},
+                    "$setOnInsert": {
+                        "content_hash": content_hash,
+                        "filepath": filepath,
+                        "file_type": file_ext,
+                        "size": size,
+                        "created_at": datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            # Either a concurrent first upload won the insert or the sweeper is removing this blob;
+            # both resolve quickly, so retry
+            time.sleep(0.1 * (attempt + 1))
+    raise RuntimeError(f"Could not acquire a reference on blob {stored_name}")
+
+def release_blob(stored_name: str) -> bool:
+    """Drop one reference; returns False if ``stored_name`` is not a tracked blob (e.g. a legacy upload)."""
+    result = blobs_collection.update_one(
+        {"_id": stored_name, "refcount": {"$gt": 0}},
+        {"$inc": {"refcount": -1}, "$set": {"released_at": datetime.utcnow()}}
+    )
+    return result.matched_count > 0
+
+def store_upload(stream: Any, upload_folder: str, file_ext: str) -> Dict:
+    """Store an upload by content hash and take a reference on it for the caller.
+
+    The caller must hand the reference to a documents record or give it back with release_blob.
+    """
+    tmp_path, content_hash, size = _stream_to_temp(stream, upload_folder)
+    stored_name = blob_name(content_hash, file_ext)
+    filepath = os.path.join(upload_folder, stored_name)
+    try:
+        acquire_blob(stored_name, content_hash, filepath, file_ext, size)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    # Holding a reference keeps the sweeper away, so the existing copy can be trusted
+    if os.path.exists(filepath):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, filepath)
+    return {"stored_name": stored_name, "filepath": filepath, "content_hash": content_hash, "size": size}
+
+def find_ingested_document(content_hash: str) -> Optional[Dict]:
+    """Any existing documents record for this content, whose metadata a re-upload can reuse."""
+    return documents_collection.find_one({"content_hash": content_hash}, DOCUMENT_PROJECTION)
+
+def release_document_file(doc: Dict, upload_folder: str) -> None:
+    """Give back the file reference held by a deleted documents record."""
+    if release_blob(doc["stored_name"]):
+        return
+    # Uploads from before content addressing are owned by their single record
+    filepath = os.path.join(upload_folder, doc["stored_name"])
+    for path in (filepath, index_path_for(filepath), bm25_path_for(filepath)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _remove_blob_files(blob: Dict) -> None:
+    for path in (blob["filepath"], index_path_for(blob["filepath"]), bm25_path_for(blob["filepath"])):
+        if os.path.exists(path):
+            os.remove(path)
+    # The parse cache is keyed by content alone, which another extension's blob may share
+    if not blobs_collection.find_one({"content_hash": blob["content_hash"], "_id": {"$ne": blob["_id"]}}, {"_id": 1}):
+        remove_parsed_documents(blob["content_hash"])
+        remove_text(blob["content_hash"])
+        document_summaries_collection.delete_one({"_id": blob["content_hash"]})
+
+def sweep_blobs() -> int:
+    """Delete unreferenced blobs together with their vector and BM25 indexes, parse cache entries, stored text
+    and stored summary."""
+    cutoff = datetime.utcnow() - timedelta(seconds=BLOB_GC_GRACE)
+    # Blobs left marked by an interrupted sweep are finished off as well
+    collectable = {"$or": [
+        {"deleting": True},
+        {"refcount": {"$lte": 0}, "released_at": {"$lt": cutoff}}
+    ]}
+    removed = 0
+    for candidate in list(blobs_collection.find(collectable, {"_id": 1})):
+        # Marking first stops acquire_blob from resurrecting the blob while its files are removed
+        blob = blobs_collection.find_one_and_update(
+            {"_id": candidate["_id"], **collectable},
+            {"$set": {"deleting": True}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is None:
+            continue
+        try:
+            _remove_blob_files(blob)
+        except OSError as e:
+            logger.warning(f"Could not remove files of blob {blob['_id']}: {str(e)}")
+            continue
+        blobs_collection.delete_one({"_id": blob["_id"], "deleting": True})
+        removed += 1
+    if removed:
+        logger.info(f"Garbage-collected {removed} unreferenced upload blobs")
+    return removed
+
+def _sweep_forever() -> None:
+    while True:
+        try:
+            sweep_blobs()
+        except Exception as e:
+            logger.error(f"Blob sweep failed: {str(e)}", exc_info=True)
+        time.sleep(BLOB_GC_INTERVAL)
+
+def start_blob_sweeper() -> None:
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_forever, name="blob-sweeper", daemon=True)
+            _sweeper.start()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Removed {sweep_blobs()} unreferenced blobs")
@@ -0,0 +1,122 @@
+import os
+import re
+import math
+import tempfile
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BM25_SUFFIX = ".bm25.npz"
+BM25_K1 = float(os.getenv("BM25_K1", 1.5))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Keeps identifiers such as "bert-base", "f1.5", "x_2" or "resnet50" as single terms
+TOKEN_PATTERN = re.compile(r"\w+(?:[\-\.]\w+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with".split()
+)
+
+def bm25_path_for(file_path: str) -> str:
+    """Accepts the document path or any artifact path derived from it (e.g. its vector index)."""
+    return os.path.splitext(file_path)[0] + BM25_SUFFIX
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def build_bm25_index(texts: List[str], index_path: str) -> Optional[str]:
+    """Write an inverted index over ``texts`` as flat arrays.
+
+    Terms are sorted; the postings of term ``t`` are
+    ``doc_ids[offsets[t]:offsets[t + 1]]`` with matching ``term_freqs``.
+    """
+    if not texts:
+        return None
+    postings: Dict[str, Dict[int, int]] = {}
+    doc_lengths = np.zeros(len(texts), dtype="int32")
+    for doc_id, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_lengths[doc_id] = len(tokens)
+        for token in tokens:
+            term_postings = postings.setdefault(token, {})
+            term_postings[doc_id] = term_postings.get(doc_id, 0) + 1
+
+    vocab = sorted(postings)
+    offsets = np.zeros(len(vocab) + 1, dtype="int64")
+    doc_ids = []
+    term_freqs = []
+    for term_id, term in enumerate(vocab):
+        term_postings = postings[term]
+        doc_ids.extend(term_postings.keys())
+        term_freqs.extend(term_postings.values())
+        offsets[term_id + 1] = len(doc_ids)
+
+    index_dir = os.path.dirname(index_path) or "."
+    os.makedirs(index_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                vocab=np.array(vocab, dtype=str),
+                offsets=offsets,
+                doc_ids=np.array(doc_ids, dtype="int32"),
+                term_freqs=np.array(term_freqs, dtype="float32"),
+                doc_lengths=doc_lengths
+            )
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info(f"Built BM25 index with {len(vocab)} terms over {len(texts)} chunks at {index_path}")
+    return index_path
+
+@lru_cache(maxsize=int(os.getenv("BM25_INDEX_CACHE_SIZE", 32)))
+def _open_bm25_index(index_path: str, mtime: float) -> Dict[str, Any]:
+    with np.load(index_path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+def load_bm25_index(index_path: str) -> Optional[Dict[str, Any]]:
+    if not index_path or not os.path.exists(index_path):
+        return None
+    try:
+        return _open_bm25_index(index_path, os.path.getmtime(index_path))
+    except Exception as e:
+        logger.warning(f"Failed to open BM25 index {index_path}: {str(e)}")
+        return None
+
+def bm25_chunk_count(index: Optional[Dict[str, Any]]) -> int:
+    return 0 if index is None else len(index["doc_lengths"])
+
+def search_bm25(index: Optional[Dict[str, Any]], query: str, k: int) -> List[Tuple[int, float]]:
+    if index is None:
+        return []
+    vocab = index["vocab"]
+    doc_lengths = index["doc_lengths"]
+    doc_count = len(doc_lengths)
+    avg_length = float(doc_lengths.mean()) or 1.0
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / avg_length)
+    scores = np.zeros(doc_count, dtype="float32")
+    for term in set(tokenize(query)):
+        term_id = int(np.searchsorted(vocab, term))
+        if term_id >= len(vocab) or vocab[term_id] != term:
+            continue
+        start, end = index["offsets"][term_id], index["offsets"][term_id + 1]
+        doc_ids = index["doc_ids"][start:end]
+        freqs = index["term_freqs"][start:end]
+        idf = math.log(1 + (doc_count - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+        scores[doc_ids] += idf * freqs * (BM25_K1 + 1) / (freqs + length_norm[doc_ids])
+    matched = np.flatnonzero(scores)
+    if not len(matched):
+        return []
+    top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+    return [(int(i), float(scores[i])) for i in top]
+
+def fuse_rankings(rankings: List[List[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Reciprocal rank fusion: combines rankings whose scores are on different scales."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
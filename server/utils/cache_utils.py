@@ -0,0 +1,96 @@
+import os
+import hashlib
+import json
+import pickle
+import tempfile
+import logging
+from typing import List, Tuple, Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+PARSED_CACHE_DIR = os.getenv("PARSED_CACHE_DIR", os.path.join("cache", "parsed"))
+# Bump whenever the parser output changes shape so stale entries are ignored
+PARSER_VERSION = 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def compute_file_hash(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def parsed_cache_key(content_hash: str, chunk_params: Dict) -> str:
+    params = json.dumps({"parser": PARSER_VERSION, **chunk_params}, sort_keys=True)
+    params_hash = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+    return f"{content_hash}_{params_hash}"
+
+def _parsed_cache_path(content_hash: str, chunk_params: Dict) -> str:
+    return os.path.join(PARSED_CACHE_DIR, content_hash[:2], parsed_cache_key(content_hash, chunk_params) + ".pkl")
+
+def load_parsed_document(content_hash: str, chunk_params: Dict) -> Optional[Tuple[List[Any], Dict]]:
+    cache_path = _parsed_cache_path(content_hash, chunk_params)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            documents, metadata = pickle.load(f)
+        return documents, metadata
+    except Exception as e:
+        logger.warning(f"Discarding unreadable parse cache entry {cache_path}: {str(e)}")
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+        return None
+
+def save_parsed_document(content_hash: str, chunk_params: Dict, documents: List[Any], metadata: Dict) -> None:
+    cache_path = _parsed_cache_path(content_hash, chunk_params)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    try:
+        # Write to a temp file and rename so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((documents, metadata), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Failed to write parse cache entry {cache_path}: {str(e)}")
+        if 'tmp_path' in locals() and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _page_manifest_path(content_hash: str) -> str:
+    return os.path.join(PARSED_CACHE_DIR, content_hash[:2], content_hash + ".pages.json")
+
+def load_page_manifest(content_hash: str) -> Optional[Dict]:
+    """Per-page hashes, stats and text offsets of a parsed file, used to re-parse a new version incrementally."""
+    try:
+        with open(_page_manifest_path(content_hash), 'r', encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("parser") == PARSER_VERSION else None
+
+def save_page_manifest(content_hash: str, manifest: Dict) -> None:
+    manifest_path = _page_manifest_path(content_hash)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path), suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding="utf-8") as f:
+            json.dump({"parser": PARSER_VERSION, **manifest}, f)
+        os.replace(tmp_path, manifest_path)
+    except Exception as e:
+        logger.warning(f"Failed to write page manifest {manifest_path}: {str(e)}")
+        if 'tmp_path' in locals() and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def remove_parsed_documents(content_hash: str) -> int:
+    """Drop every cached parse of a file, whatever chunk parameters it was cached under, and its page manifest."""
+    cache_dir = os.path.join(PARSED_CACHE_DIR, content_hash[:2])
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.startswith(content_hash + "_") or name == content_hash + ".pages.json":
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    return removed
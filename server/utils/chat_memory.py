@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from utils.db import chat_sessions_collection
+from utils.chat_store import get_messages, message_count
+from utils.context_packer import truncate_to_tokens
+from utils.llm_client import LLMServiceError
+from utils.nlp_utils import llm_client, HISTORY_CONTEXT_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Turns older than the last HISTORY_CONTEXT_MESSAGES are folded into a running summary stored on
+# the session ({summary, summary_seq}: messages with seq < summary_seq are covered), so the history
+# sent with each prompt stays the same size however long the chat gets.
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 200))
+# Summarize once this many turns have fallen out of the recent window, and at most this many per LLM call
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", 6))
+SUMMARY_MAX_BATCH = int(os.getenv("SUMMARY_MAX_BATCH", 20))
+SUMMARY_MESSAGE_TOKENS = int(os.getenv("SUMMARY_MESSAGE_TOKENS", 400))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 1))
+# Every turn the summary does not cover yet goes to the prompt (newest first, within the packer's
+# history budget); this only bounds how many are read back when summarization has fallen behind
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", 40))
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="chat-summary")
+_pending = set()
+_pending_lock = threading.Lock()
+
+def history_window(session: Dict) -> int:
+    """How many of the newest messages a prompt needs: all those with seq >= summary_seq."""
+    return max(0, min(message_count(session) - session.get("summary_seq", 0), HISTORY_MAX_MESSAGES))
+
+def with_summary(session: Dict, recent_messages: List[Dict]) -> List[Dict]:
+    """Chat history for a prompt: the session's running summary (if any) followed by the recent turns."""
+    summary = session.get("summary")
+    if not summary:
+        return recent_messages
+    return [{"type": "summary", "content": summary}] + recent_messages
+
+def _summary_prompt(summary: str, messages: List[Dict]) -> str:
+    turns = "\n".join(
+        f"{message['type'].upper()}: {truncate_to_tokens(message['content'], SUMMARY_MESSAGE_TOKENS)}"
+        for message in messages
+    )
+    return f"""Maintain a running summary of a conversation between a user and an assistant about a document.
+Update the summary with the new turns. Keep the questions asked, facts established and preferences stated;
+drop pleasantries and wording. Reply with the updated summary only, in at most {SUMMARY_MAX_TOKENS} tokens.
+
+CURRENT SUMMARY:
+{summary or "(none)"}
+
+NEW TURNS:
+{turns}"""
+
+def _summarize(chat_id: Any) -> None:
+    while True:
+        session = chat_sessions_collection.find_one(
+            {"_id": chat_id},
+            {"summary": 1, "summary_seq": 1, "message_count": 1, "epoch": 1}
+        )
+        if session is None:
+            return
+        start = session.get("summary_seq", 0)
+        end = min(message_count(session) - HISTORY_CONTEXT_MESSAGES, start + SUMMARY_MAX_BATCH)
+        if end - start < SUMMARY_BATCH_MESSAGES:
+            return
+        messages = get_messages(session, before=end, limit=end - start)
+        summary = llm_client.complete(
+            messages=[{"role": "system", "content": _summary_prompt(session.get("summary", ""), messages)}],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        summary = truncate_to_tokens(summary.strip(), SUMMARY_MAX_TOKENS)
+        # Guarded so a concurrent summarizer cannot fold the same turns twice, nor a cleared chat get a stale summary
+        updated = chat_sessions_collection.update_one(
+            {
+                "_id": chat_id,
+                "summary_seq": start if start else {"$in": [0, None]},
+                "epoch": session.get("epoch") or {"$in": [0, None]},
+                "message_count": {"$gte": end}
+            },
+            {"$set": {"summary": summary, "summary_seq": end}}
+        )
+        if not updated.modified_count:
+            return
+        logger.debug(f"Folded messages {start}-{end - 1} of chat {chat_id} into its summary")
+
+def _run_summary(chat_id: Any) -> None:
+    try:
+        _summarize(chat_id)
+    except LLMServiceError as e:
+        # Left for the next exchange to retry
+        logger.warning(f"Could not summarize chat {chat_id}: {str(e)}")
+    except Exception as e:
+        logger.error(f"Chat summary failed for {chat_id}: {str(e)}", exc_info=True)
+    finally:
+        with _pending_lock:
+            _pending.discard(chat_id)
+
+def schedule_summary(session: Dict, new_count: int) -> None:
+    """Fold turns that left the recent window into the summary, off the request path."""
+    if new_count - HISTORY_CONTEXT_MESSAGES - session.get("summary_seq", 0) < SUMMARY_BATCH_MESSAGES:
+        return
+    chat_id = session["_id"]
+    with _pending_lock:
+        if chat_id in _pending:
+            return
+        _pending.add(chat_id)
+    _executor.submit(_run_summary, chat_id)
@@ -0,0 +1,189 @@
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from utils.db import chat_sessions_collection, chat_messages_collection
+
+logger = logging.getLogger(__name__)
+
+# Messages live in append-only bucket documents ({chat_id, epoch, bucket, messages[]}) rather than
+# in the session, so a session stays the same size however long the conversation gets. Clearing a
+# chat restarts its seq numbers under a new epoch, so buckets of earlier epochs are never read again.
+MESSAGE_BUCKET_SIZE = int(os.getenv("MESSAGE_BUCKET_SIZE", 50))
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", 50))
+# Sessions are read without their legacy embedded history array
+SESSION_PROJECTION = {"history": 0}
+
+def new_chat_session(user_id: str, name: str, document_id: Optional[str]) -> Dict:
+    return {
+        "user_id": user_id,
+        "name": name,
+        "created_at": datetime.utcnow(),
+        "last_updated": datetime.utcnow(),
+        "pinned": False,
+        "message_count": 0,
+        "summary": "",
+        "summary_seq": 0,
+        "document_id": document_id,
+        "epoch": 0,
+        "version": 1
+    }
+
+def exchange_messages(query: str, response: str, file_name: Optional[str], document_id: Optional[str]) -> List[Dict]:
+    return [
+        {
+            "type": "user",
+            "content": query,
+            "timestamp": datetime.utcnow().strftime("%H:%M:%S"),
+            "file": {
+                "name": file_name,
+                "document_id": document_id
+            }
+        },
+        {
+            "type": "response",
+            "content": response,
+            "timestamp": datetime.utcnow().strftime("%H:%M:%S")
+        }
+    ]
+
+def _epoch(session: Dict) -> Any:
+    # Buckets written before epochs existed have no epoch field and belong to epoch 0
+    epoch = session.get("epoch", 0)
+    return epoch if epoch else {"$in": [0, None]}
+
+def _bucket_writes(session: Dict, start_seq: int, messages: List[Dict]) -> List[Tuple[Dict, Dict]]:
+    buckets = {}
+    for offset, message in enumerate(messages):
+        seq = start_seq + offset
+        buckets.setdefault(seq // MESSAGE_BUCKET_SIZE, []).append({**message, "seq": seq})
+    return [
+        (
+            {"chat_id": session["_id"], "epoch": _epoch(session), "bucket": bucket},
+            {
+                "$push": {"messages": {"$each": bucket_messages}},
+                "$inc": {"count": len(bucket_messages)},
+                "$setOnInsert": {"created_at": datetime.utcnow()}
+            }
+        )
+        for bucket, bucket_messages in sorted(buckets.items())
+    ]
+
+def _bucket_range_filter(session: Dict, first_seq: int, last_seq: int) -> Dict:
+    return {
+        "chat_id": session["_id"],
+        "epoch": _epoch(session),
+        "bucket": {"$gte": first_seq // MESSAGE_BUCKET_SIZE, "$lte": last_seq // MESSAGE_BUCKET_SIZE}
+    }
+
+def _select(buckets: List[Dict], first_seq: int, last_seq: int) -> List[Dict]:
+    messages = [
+        message for bucket in buckets for message in bucket.get("messages", [])
+        if first_seq <= message["seq"] <= last_seq
+    ]
+    return sorted(messages, key=lambda message: message["seq"])
+
+def message_count(session: Dict) -> int:
+    return session.get("message_count", 0)
+
+def append_messages(session: Dict, start_seq: int, messages: List[Dict]) -> None:
+    """Write messages at seq numbers reserved by a version-guarded update of ``session`` (as read before it)."""
+    for bucket_filter, update in _bucket_writes(session, start_seq, messages):
+        chat_messages_collection.update_one(bucket_filter, update, upsert=True)
+
+def get_messages(session: Dict, before: Optional[int] = None, limit: int = MESSAGE_PAGE_SIZE) -> List[Dict]:
+    """Up to ``limit`` messages with seq < ``before`` (default: the newest), oldest first."""
+    end = message_count(session) if before is None else min(before, message_count(session))
+    start = max(0, end - limit)
+    if end <= 0:
+        return []
+    buckets = chat_messages_collection.find(
+        _bucket_range_filter(session, start, end - 1),
+        {"messages": 1}
+    )
+    return _select(list(buckets), start, end - 1)
+
+def get_recent_messages(session: Dict, count: int) -> List[Dict]:
+    return get_messages(session, limit=count)
+
+def delete_messages(chat_id: Any, before_epoch: Optional[int] = None) -> None:
+    """Delete a chat's buckets, or only those of epochs before ``before_epoch``."""
+    bucket_filter = {"chat_id": chat_id}
+    if before_epoch is not None:
+        bucket_filter["$or"] = [{"epoch": {"$lt": before_epoch}}, {"epoch": None}]
+    chat_messages_collection.delete_many(bucket_filter)
+
+def clear_messages(session: Dict) -> bool:
+    """Empty a chat; False when ``session`` is out of date (a concurrent exchange or clear won).
+
+    The seq reset and the new epoch land in one version-guarded update, so an exchange either
+    reserved its seq numbers before it (and is cleared with the old epoch) or writes under the new one.
+    """
+    epoch = session.get("epoch", 0) + 1
+    cleared = chat_sessions_collection.update_one(
+        {"_id": session["_id"], "version": session["version"]},
+        {
+            "$set": {
+                "message_count": 0,
+                "summary": "",
+                "summary_seq": 0,
+                "epoch": epoch,
+                "last_updated": datetime.utcnow()
+            },
+            "$unset": {"history": ""},
+            "$inc": {"version": 1}
+        }
+    )
+    if cleared.modified_count == 0:
+        return False
+    delete_messages(session["_id"], before_epoch=epoch)
+    return True
+
+def migrate_legacy_history(session: Dict) -> Dict:
+    """Move a pre-bucketing session's embedded history into the message collection.
+
+    Returns the session as it should be used from now on (with message_count set).
+    """
+    if "message_count" in session:
+        return session
+    legacy = chat_sessions_collection.find_one({"_id": session["_id"]}, {"history": 1, "version": 1})
+    if legacy is None:
+        return session
+    history = legacy.get("history", [])
+    # Reserve the seq range first; the embedded array is only dropped once the buckets exist
+    migrated = chat_sessions_collection.update_one(
+        {"_id": session["_id"], "version": legacy["version"], "message_count": {"$exists": False}},
+        {"$set": {"message_count": len(history)}, "$inc": {"version": 1}}
+    )
+    if migrated.modified_count:
+        append_messages(session, 0, history)
+        chat_sessions_collection.update_one({"_id": session["_id"]}, {"$unset": {"history": ""}})
+        logger.info(f"Migrated {len(history)} messages of chat {session['_id']} to bucketed storage")
+    return chat_sessions_collection.find_one({"_id": session["_id"]}, SESSION_PROJECTION) or session
+
+async def aappend_messages(collection: Any, session: Dict, start_seq: int, messages: List[Dict]) -> None:
+    """Async variant of append_messages; ``collection`` is the Motor chat_messages collection."""
+    for bucket_filter, update in _bucket_writes(session, start_seq, messages):
+        await collection.update_one(bucket_filter, update, upsert=True)
+
+async def aget_recent_messages(collection: Any, session: Dict, count: int) -> List[Dict]:
+    end = message_count(session)
+    start = max(0, end - count)
+    if end <= 0:
+        return []
+    buckets = await collection.find(
+        _bucket_range_filter(session, start, end - 1),
+        {"messages": 1}
+    ).to_list(length=None)
+    return _select(buckets, start, end - 1)
+
+def migrate_all() -> int:
+    migrated = 0
+    for session in chat_sessions_collection.find({"message_count": {"$exists": False}}, {"_id": 1}):
+        migrate_legacy_history(session)
+        migrated += 1
+    return migrated
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Migrated {migrate_all()} chat sessions")
@@ -0,0 +1,177 @@
+import os
+import re
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer of the answering model (Llama 3.3; this mirror of its tokenizer needs no access approval);
+# until it is loaded, or if it cannot be, token counts fall back to ~4 chars per token
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "unsloth/Llama-3.3-70B-Instruct")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+# History may take at most this share of the budget so it never crowds out the document
+HISTORY_TOKEN_SHARE = float(os.getenv("HISTORY_TOKEN_SHARE", 0.25))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+# Chunks at least this similar (word-set Jaccard) to an already packed chunk are dropped outright
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", 0.6))
+MIN_OVERLAP_CHARS = 20
+MIN_PARTIAL_TOKENS = 64
+CHARS_PER_TOKEN = 4
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+_tokenizer_thread = None
+WORD_PATTERN = re.compile(r"\w+")
+
+def load_tokenizer() -> Optional[Any]:
+    """Load the tokenizer once per process; called from warm-up and startup, never on a request thread."""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(CONTEXT_TOKENIZER)
+                except Exception as e:
+                    logger.warning(f"Tokenizer {CONTEXT_TOKENIZER} unavailable, estimating tokens from length: {str(e)}")
+                _tokenizer_loaded = True
+    return _tokenizer
+
+def start_tokenizer_load() -> None:
+    """Run load_tokenizer in a background thread unless it already ran or is running."""
+    global _tokenizer_thread
+    with _tokenizer_lock:
+        if _tokenizer_loaded or _tokenizer_thread is not None:
+            return
+        _tokenizer_thread = threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True)
+    _tokenizer_thread.start()
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if not _tokenizer_loaded:
+        # Estimated until the background load finishes rather than blocking this request on a download
+        start_tokenizer_load()
+    tokenizer = _tokenizer
+    if tokenizer is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` within ``max_tokens``, cut at a sentence or line end where possible."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = min(len(text), max_tokens * CHARS_PER_TOKEN)
+    while cut > 0 and count_tokens(text[:cut]) > max_tokens:
+        cut = int(cut * 0.9)
+    prefix = text[:cut]
+    boundary = max(prefix.rfind(". "), prefix.rfind("\n"))
+    return prefix[:boundary + 1] if boundary > len(prefix) // 2 else prefix
+
+def _words(text: str) -> set:
+    return set(WORD_PATTERN.findall(text.lower()))
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def strip_overlap(previous: str, text: str, max_overlap: int) -> str:
+    """Drop the start of ``text`` that repeats the end of ``previous`` (splitter chunk overlap)."""
+    for size in range(min(max_overlap, len(previous), len(text)), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+def select_chunks(texts: List[str]) -> List[int]:
+    """Order candidates (given best first) by maximal marginal relevance, dropping near-duplicates.
+
+    Relevance is rank-based, so the ordering needs no retrieval scores.
+    """
+    word_sets = [_words(text) for text in texts]
+    remaining = list(range(len(texts)))
+    selected = []
+    while remaining:
+        best, best_score = None, None
+        for i in remaining:
+            redundancy = max((_jaccard(word_sets[i], word_sets[j]) for j in selected), default=0.0)
+            if redundancy >= DUPLICATE_THRESHOLD:
+                continue
+            score = MMR_LAMBDA / (i + 1) - (1 - MMR_LAMBDA) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+def pack_context(metadata_block: Optional[str], history_lines: List[str], chunks: List[Tuple[str, str]],
+                 budget: int = CONTEXT_TOKEN_BUDGET, max_overlap: int = 0, history_summary: Optional[str] = None) -> Dict:
+    """Fit metadata, conversation history and document chunks into one token budget.
+
+    ``history_lines`` are newest first and ``history_summary`` (covering older turns) takes
+    precedence over them; ``chunks`` are (header, text) pairs, best first.
+    Returns the context text plus how many tokens each part used.
+    """
+    parts = []
+    usage = {"metadata": 0, "history": 0, "chunks": 0}
+    remaining = budget
+
+    if metadata_block:
+        usage["metadata"] = count_tokens(metadata_block)
+        parts.append(metadata_block)
+        remaining -= usage["metadata"]
+
+    history_budget = min(remaining, int(budget * HISTORY_TOKEN_SHARE))
+    if (history_lines or history_summary) and history_budget > 0:
+        kept = []
+        if history_summary:
+            # One token of the budget goes to the line break after the summary
+            history_summary = truncate_to_tokens(history_summary, history_budget - 1)
+            if history_summary:
+                usage["history"] += count_tokens(history_summary) + 1
+        for line in history_lines:
+            tokens = count_tokens(line) + 1
+            if tokens > history_budget - usage["history"]:
+                break
+            kept.append(line)
+            usage["history"] += tokens
+        if history_summary:
+            kept.append(history_summary)
+        if kept:
+            parts.append("PREVIOUS CONVERSATION:\n" + "\n".join(reversed(kept)))
+            remaining -= usage["history"]
+
+    packed_chunks = []
+    packed_texts = []
+    order = select_chunks([text for _, text in chunks])
+    for i in order:
+        header, text = chunks[i]
+        for previous in packed_texts:
+            text = strip_overlap(previous, text, max_overlap)
+        block = f"{header}\n{text}"
+        tokens = count_tokens(block) + 1
+        if tokens > remaining:
+            if remaining - count_tokens(header) < MIN_PARTIAL_TOKENS:
+                break
+            block = truncate_to_tokens(block, remaining - 1)
+            tokens = count_tokens(block) + 1
+        packed_chunks.append(block)
+        packed_texts.append(chunks[i][1])
+        usage["chunks"] += tokens
+        remaining -= tokens
+    if packed_chunks:
+        parts.append("DOCUMENT CONTENT:\n" + "\n\n".join(packed_chunks))
+
+    usage.update({
+        "total": usage["metadata"] + usage["history"] + usage["chunks"],
+        "budget": budget,
+        "chunks_used": len(packed_chunks),
+        "chunks_dropped": len(chunks) - len(packed_chunks)
+    })
+    return {"text": "\n\n".join(parts), "usage": usage}
@@ -1,13 +1,61 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from dotenv import load_dotenv
+from utils.metrics import register_histogram, observe
+from utils.tracing import add_to_trace
 import os
 
 load_dotenv()
 
-client = MongoClient(os.getenv("MONGO_URI"))
+register_histogram("mongo_command_duration_seconds", "MongoDB command round-trip time by command",
+                   (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every Mongo command; the request's share shows up as the "mongo" Server-Timing entry."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        seconds = event.duration_micros / 1e6
+        observe("mongo_command_duration_seconds", seconds, {"command": event.command_name})
+        add_to_trace("mongo", seconds)
+
+MONGO_URI = os.getenv("MONGO_URI")
+if MONGO_URI and MONGO_URI.startswith("mongomock://"):
+    # In-memory stand-in (pip install mongomock) for load tests and local runs without a mongod;
+    # data lives only as long as the process, so use it with a single server process
+    import mongomock
+    client = mongomock.MongoClient()
+else:
+    client = MongoClient(MONGO_URI, event_listeners=[MongoCommandTimer()])
 db = client.get_database("InsightPaper")
 
 users_collection = db["users"]
 documents_collection = db["documents"]
 chat_sessions_collection = db["chat_sessions"]
-queries_collection = db["queries"]
\ No newline at end of file
+queries_collection = db["queries"]
+chat_messages_collection = db["chat_messages"]
+ingestion_jobs_collection = db["ingestion_jobs"]
+llm_cache_collection = db["llm_response_cache"]
+blobs_collection = db["blobs"]
+document_summaries_collection = db["document_summaries"]
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+
+def ensure_indexes():
+    llm_cache_collection.create_index("created_at", expireAfterSeconds=LLM_CACHE_TTL)
+    # Serves the paginated sidebar query in /chat/history
+    chat_sessions_collection.create_index([("user_id", 1), ("pinned", -1), ("last_updated", -1), ("_id", -1)])
+    # Buckets are keyed per clear epoch; the pre-epoch index would reject a cleared chat's new bucket 0
+    if "chat_id_1_bucket_1" in chat_messages_collection.index_information():
+        chat_messages_collection.drop_index("chat_id_1_bucket_1")
+    chat_messages_collection.create_index([("chat_id", 1), ("epoch", 1), ("bucket", 1)], unique=True)
+    # Re-uploads look up an already-ingested copy of the same content
+    documents_collection.create_index("content_hash")
+    blobs_collection.create_index([("refcount", 1), ("released_at", 1)])
@@ -0,0 +1,211 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from utils.db import document_summaries_collection
+from utils.context_packer import pack_context
+from utils.llm_client import LLMServiceError
+from utils.metrics import register_counter, inc_counter
+from utils.nlp_utils import (llm_client, load_document, analyze_query_intent, determine_response_style, format_metadata,
+                             generate_llm_prompt, request_completion, SECTION_PATTERNS, CHUNK_OVERLAP, LLAMA_MODEL)
+
+logger = logging.getLogger(__name__)
+
+# One summary per unique content hash, generated in the background after ingestion and served for
+# summary questions without a round-trip to the LLM (unless the request asks for a live answer).
+DOCUMENT_SUMMARY_ENABLED = os.getenv("DOCUMENT_SUMMARY_ENABLED", "true").lower() == "true"
+DOCUMENT_SUMMARY_QUERY = os.getenv("DEFAULT_QUERY", "Provide a detailed summary of this research paper.")
+DOCUMENT_SUMMARY_CONTEXT_TOKENS = int(os.getenv("DOCUMENT_SUMMARY_CONTEXT_TOKENS", 3000))
+# summary_request share of the query intent above which the stored summary answers
+DOCUMENT_SUMMARY_MIN_INTENT = float(os.getenv("DOCUMENT_SUMMARY_MIN_INTENT", 0.7))
+# Optional per-section digests, one extra LLM call per tagged section
+SECTION_DIGESTS_ENABLED = os.getenv("SECTION_DIGESTS_ENABLED", "false").lower() == "true"
+SECTION_DIGEST_CONTEXT_TOKENS = int(os.getenv("SECTION_DIGEST_CONTEXT_TOKENS", 1200))
+SECTION_DIGEST_MAX_TOKENS = int(os.getenv("SECTION_DIGEST_MAX_TOKENS", 250))
+DIGEST_SECTIONS = ["introduction", "methods", "results", "discussion"]
+SUMMARY_SECTIONS = ["abstract", "introduction", "results", "discussion"]
+# A summary that failed, or is still pending this long after it was claimed (e.g. its process died),
+# may be claimed again
+DOCUMENT_SUMMARY_RETRY_AFTER = int(os.getenv("DOCUMENT_SUMMARY_RETRY_AFTER", 600))
+DOCUMENT_SUMMARY_WORKERS = int(os.getenv("DOCUMENT_SUMMARY_WORKERS", 1))
+
+_executor = ThreadPoolExecutor(max_workers=DOCUMENT_SUMMARY_WORKERS, thread_name_prefix="document-summary")
+_pending = set()
+_pending_lock = threading.Lock()
+
+register_counter("stored_summary_answers_total", "Summary questions answered from a stored document summary")
+
+def _named_sections(query: str) -> List[str]:
+    query_lower = query.lower()
+    return [section for section in DIGEST_SECTIONS if re.search(rf"\b(?:{SECTION_PATTERNS[section]})", query_lower)]
+
+def wants_summary(query: str) -> bool:
+    share = analyze_query_intent(query)["summary_request"]
+    # "Summarize the results" also scores as technical detail, so a named section lowers the bar
+    return share >= DOCUMENT_SUMMARY_MIN_INTENT or (share >= 0.5 and bool(_named_sections(query)))
+
+def summary_answer(record: Optional[Dict], query: str) -> Optional[str]:
+    """The stored answer to a summary question: the digests of the sections it names, else the whole summary.
+
+    None when the record is not ready or lacks a digest the question asks for.
+    """
+    if not record or record.get("status") != "ready":
+        return None
+    named = _named_sections(query)
+    if named:
+        digests = record.get("sections") or {}
+        if not all(section in digests for section in named):
+            return None
+        inc_counter("stored_summary_answers_total", {"part": "sections"})
+        return "\n\n".join(digests[section] for section in named)
+    if not record.get("summary"):
+        return None
+    inc_counter("stored_summary_answers_total", {"part": "summary"})
+    return record["summary"]
+
+def stored_summary(file_path: Optional[str], content_hash: Optional[str], query: str) -> Optional[str]:
+    """Answer a summary question from the stored summary; None when the query or document has none."""
+    if not DOCUMENT_SUMMARY_ENABLED or not content_hash or not wants_summary(query):
+        return None
+    record = document_summaries_collection.find_one({"_id": content_hash}, {"status": 1, "summary": 1, "sections": 1})
+    if record is None and file_path:
+        # Documents ingested before summaries existed get theirs on the first summary question
+        schedule_document_summary(file_path, content_hash)
+    return summary_answer(record, query)
+
+async def astored_summary(file_path: Optional[str], content_hash: Optional[str], query: str,
+                          collection: Any) -> Optional[str]:
+    """Async variant of stored_summary; ``collection`` is a Motor collection."""
+    if not DOCUMENT_SUMMARY_ENABLED or not content_hash or not wants_summary(query):
+        return None
+    record = await collection.find_one({"_id": content_hash}, {"status": 1, "summary": 1, "sections": 1})
+    if record is None and file_path:
+        # Claiming goes through the sync client, so keep it off the event loop
+        await asyncio.to_thread(schedule_document_summary, file_path, content_hash)
+    return summary_answer(record, query)
+
+def _claim(content_hash: str) -> bool:
+    """Take the summary of ``content_hash`` for this process; False if it is done or being written elsewhere."""
+    now = datetime.utcnow()
+    try:
+        document_summaries_collection.insert_one({"_id": content_hash, "status": "pending", "claimed_at": now})
+        return True
+    except DuplicateKeyError:
+        # Failed attempts wait out the same delay, so an unavailable LLM is not asked on every question
+        claimed = document_summaries_collection.update_one(
+            {
+                "_id": content_hash,
+                "status": {"$ne": "ready"},
+                "claimed_at": {"$lt": now - timedelta(seconds=DOCUMENT_SUMMARY_RETRY_AFTER)}
+            },
+            {"$set": {"status": "pending", "claimed_at": now}}
+        )
+        return claimed.modified_count > 0
+
+def _context(documents: List, sections: List[str], budget: int) -> str:
+    chunks = [(f"[Section: {doc.metadata.get('section', 'other')}]", doc.page_content)
+              for doc in documents if doc.metadata.get("section") in sections]
+    if not chunks:
+        chunks = [(f"[Section: {doc.metadata.get('section', 'other')}]", doc.page_content) for doc in documents[:8]]
+    return pack_context(None, [], chunks, budget=budget, max_overlap=CHUNK_OVERLAP)["text"]
+
+def _section_digest(section: str, context: str) -> str:
+    prompt = f"""Summarize the {section} of the document below in a short paragraph of at most {SECTION_DIGEST_MAX_TOKENS} tokens.
+Reply with the summary only.
+
+{context}"""
+    return llm_client.complete(
+        messages=[{"role": "system", "content": prompt}],
+        temperature=0.2,
+        max_tokens=SECTION_DIGEST_MAX_TOKENS
+    ).strip()
+
+def _summarize_document(file_path: str, content_hash: str) -> None:
+    documents, metadata = load_document(file_path, content_hash)
+    if not documents:
+        raise ValueError(f"No chunks to summarize in {file_path}")
+    # Same prompt shape as a live DEFAULT_QUERY answer, with context drawn from the whole paper
+    # rather than from retrieval
+    context = format_metadata(metadata) + "\n\n" + _context(documents, SUMMARY_SECTIONS, DOCUMENT_SUMMARY_CONTEXT_TOKENS)
+    response_style = determine_response_style(analyze_query_intent(DOCUMENT_SUMMARY_QUERY), metadata)
+    summary = request_completion(generate_llm_prompt(DOCUMENT_SUMMARY_QUERY, context, response_style)).strip()
+
+    sections = {}
+    if SECTION_DIGESTS_ENABLED:
+        present = {doc.metadata.get("section") for doc in documents}
+        for section in DIGEST_SECTIONS:
+            if section in present:
+                sections[section] = _section_digest(section, _context(documents, [section], SECTION_DIGEST_CONTEXT_TOKENS))
+    _store(content_hash, summary, sections)
+
+def _store(content_hash: str, summary: str, sections: Dict[str, str]) -> None:
+    document_summaries_collection.update_one(
+        {"_id": content_hash},
+        {"$set": {
+            "status": "ready",
+            "summary": summary,
+            "sections": sections,
+            "model": LLAMA_MODEL,
+            "created_at": datetime.utcnow()
+        }, "$unset": {"error": ""}}
+    )
+    logger.info(f"Stored summary of {content_hash} ({len(sections)} section digests)")
+
+def _run_summary(file_path: str, content_hash: str) -> None:
+    try:
+        _summarize_document(file_path, content_hash)
+    except Exception as e:
+        if isinstance(e, LLMServiceError):
+            logger.warning(f"Could not summarize document {content_hash}: {str(e)}")
+        else:
+            logger.error(f"Document summary failed for {content_hash}: {str(e)}", exc_info=True)
+        # Left for the next summary question to retry
+        document_summaries_collection.update_one(
+            {"_id": content_hash, "status": "pending"},
+            {"$set": {"status": "failed", "error": str(e)}}
+        )
+    finally:
+        with _pending_lock:
+            _pending.discard(content_hash)
+
+def schedule_document_summary(file_path: str, content_hash: Optional[str]) -> None:
+    """Generate and store the summary of an ingested document off the request path, once per content hash."""
+    if not DOCUMENT_SUMMARY_ENABLED or not content_hash:
+        return
+    with _pending_lock:
+        if content_hash in _pending:
+            return
+        _pending.add(content_hash)
+    try:
+        claimed = _claim(content_hash)
+    except Exception as e:
+        logger.warning(f"Could not claim the summary of {content_hash}: {str(e)}")
+        claimed = False
+    if not claimed:
+        with _pending_lock:
+            _pending.discard(content_hash)
+        return
+    _executor.submit(_run_summary, file_path, content_hash)
+
+def record_upload_answer(file_path: str, content_hash: Optional[str], query: str, answer: Optional[str]) -> None:
+    """Summary work for an uploaded document, run once the upload's own question has been answered.
+
+    A live answer to a whole-document summary question becomes the stored summary, so the upload
+    does not pay for a second generation; any other question (or a failed answer, ``None``) leaves
+    the summary to the background worker.
+    """
+    if not DOCUMENT_SUMMARY_ENABLED or not content_hash:
+        return
+    if answer and wants_summary(query) and not _named_sections(query):
+        try:
+            if _claim(content_hash):
+                _store(content_hash, answer.strip(), {})
+        except Exception as e:
+            logger.warning(f"Could not store the summary of {content_hash}: {str(e)}")
+        return
+    schedule_document_summary(file_path, content_hash)
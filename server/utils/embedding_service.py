@@ -0,0 +1,225 @@
+"""Embedding model shared by every server process over a Unix socket.
+
+Run one service per host and point the web and ingestion workers at it:
+
+    python -m utils.embedding_service --socket /run/tattva/embed.sock --backend int8
+    EMBEDDING_SERVICE_SOCKET=/run/tattva/embed.sock gunicorn server:app
+
+Concurrent requests are coalesced into micro-batches (up to EMBEDDING_MAX_BATCH
+texts, waiting at most EMBEDDING_BATCH_WAIT_MS for more) before they reach the
+model, so one CPU copy of the model serves all workers.
+
+Backends: ``torch`` (fp32), ``int8`` (dynamic int8 quantization of the Linear
+layers) and ``onnx`` (onnxruntime through sentence-transformers; needs
+``optimum[onnxruntime]``; set EMBEDDING_ONNX_FILE to pick a quantized export
+such as ``onnx/model_qint8_avx512_vnni.onnx``). Quantized backends return
+vectors close to, but not identical with, fp32 ones, so indexes built with one
+backend keep working with another.
+"""
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", 64))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", 60))
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE")
+BACKENDS = ("torch", "int8", "onnx")
+
+# Frames are: 8-byte header (JSON length, payload length), JSON header, raw payload
+_FRAME = struct.Struct("!II")
+
+class EmbeddingServiceError(Exception):
+    """The embedding service could not embed the request"""
+    pass
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Embedding service connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _send_frame(sock: socket.socket, header: Dict, payload: bytes = b"") -> None:
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data + payload)
+
+def _recv_frame(sock: socket.socket) -> Tuple[Dict, bytes]:
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size))
+    return header, _recv_exact(sock, payload_size) if payload_size else b""
+
+def load_encoder(model_name: str, backend: str) -> Callable[[List[str]], np.ndarray]:
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    else:
+        model = SentenceTransformer(model_name, device="cpu")
+        if backend == "int8":
+            import torch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def encode(texts: List[str]) -> np.ndarray:
+        return np.asarray(model.encode(texts, batch_size=EMBEDDING_MAX_BATCH, convert_to_numpy=True), dtype="float32")
+    return encode
+
+class MicroBatcher:
+    """Funnels concurrent embed calls through one model thread in batches."""
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray],
+                 max_batch: int = EMBEDDING_MAX_BATCH, max_wait: float = EMBEDDING_BATCH_WAIT_MS / 1000):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> np.ndarray:
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        pending = [self._queue.get()]
+        count = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(item)
+            count += len(item[0])
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(texts)} texts failed: {str(e)}", exc_info=True)
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            logger.debug(f"Embedded {len(texts)} texts for {len(pending)} requests")
+            offset = 0
+            for request_texts, future in pending:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+class _EmbeddingRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Clients keep their connection open and send one request at a time
+        while True:
+            try:
+                header, _ = _recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                vectors = self.server.batcher.submit(header["texts"])
+                _send_frame(self.request, {"shape": list(vectors.shape)}, vectors.tobytes())
+            except Exception as e:
+                _send_frame(self.request, {"error": str(e)})
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, batcher: MicroBatcher):
+        # A socket left behind by a previous run would make bind fail
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.batcher = batcher
+        super().__init__(socket_path, _EmbeddingRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+class EmbeddingServiceClient:
+    """Drop-in replacement for the langchain embeddings object, backed by the shared service."""
+
+    def __init__(self, socket_path: str, timeout: float = EMBEDDING_SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send_frame(sock, {"texts": texts})
+                header, payload = _recv_frame(sock)
+                break
+            except (ConnectionError, OSError) as e:
+                self._reset()
+                # A pooled connection may have gone stale when the service restarted; retry once on a fresh one
+                if attempt:
+                    raise EmbeddingServiceError(f"Embedding service unavailable at {self.socket_path}: {str(e)}")
+        if "error" in header:
+            raise EmbeddingServiceError(header["error"])
+        return np.frombuffer(payload, dtype="float32").reshape(header["shape"])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a shared, micro-batched embedding model over a Unix socket")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVICE_SOCKET", "/tmp/tattva-embeddings.sock"))
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    parser.add_argument("--backend", choices=BACKENDS, default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    batcher = MicroBatcher(load_encoder(args.model, args.backend))
+    server = EmbeddingServer(args.socket, batcher)
+    logger.info(f"Serving {args.model} ({args.backend}) on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
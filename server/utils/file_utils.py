@@ -4,14 +4,28 @@ import PyPDF2
 from docx import Document as DocxDocument
 import pdfplumber
 import re
+import hashlib
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from docx.opc.exceptions import PackageNotFoundError
+from pdfminer.pdftypes import resolve1, PDFObjRef, PDFStream
+from pdfminer.psparser import PSLiteral, PSKeyword
 
 logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = os.getenv('ALLOWED_EXTENSIONS', 'pdf,docx').split(',')
 MAX_SECTION_CHECK = int(os.getenv('MAX_SECTION_CHECK', 100))
+# PDFs with at least this many pages are extracted in parallel page ranges
+PARALLEL_PDF_MIN_PAGES = int(os.getenv('PARALLEL_PDF_MIN_PAGES', 40))
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+PDF_MIN_SHARD_PAGES = int(os.getenv('PDF_MIN_SHARD_PAGES', 10))
+PAGE_COUNT_KEYS = ("image_count", "figure_count", "table_count")
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
 
 class FileProcessingError(Exception):
     """Custom exception for file processing errors"""
@@ -23,10 +37,7 @@ def allowed_file(filename):
 def extract_text_from_pdf(file_stream):
     try:
         pdf_reader = PyPDF2.PdfReader(file_stream)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
-        return text
+        return "".join(page.extract_text() or "" for page in pdf_reader.pages)
     except PyPDF2.errors.PdfReadError as e:
         logger.error(f"PDF read error: {str(e)}")
         raise FileProcessingError(f"Failed to read PDF: {str(e)}")
@@ -83,8 +94,8 @@ def extract_docx_metadata(file_path: str) -> dict:
         raise FileProcessingError(f"Unexpected error in DOCX metadata: {str(e)}")
     return metadata
 
-def extract_pdf_metadata(file_path: str) -> dict:
-    metadata = {
+def _new_pdf_metadata(file_path: str) -> dict:
+    return {
         "title": os.path.basename(file_path),
         "author": "Unknown",
         "keywords": "",
@@ -96,35 +107,190 @@ def extract_pdf_metadata(file_path: str) -> dict:
         "total_pages": 0,
         "sections": []
     }
-    try:
-        with pdfplumber.open(file_path) as pdf:
-            metadata["total_pages"] = len(pdf.pages)
-            if hasattr(pdf, 'metadata'):
-                pdf_meta = pdf.metadata or {}
-                metadata.update({
-                    "title": pdf_meta.get('Title', metadata['title']),
-                    "author": pdf_meta.get('Author', metadata['author']),
-                    "keywords": pdf_meta.get('Keywords', metadata['keywords']),
-                    "subject": pdf_meta.get('Subject', metadata['subject'])
-                })
-            first_page_text = pdf.pages[0].extract_text() or ""
-            metadata["is_research"] = any(
-                re.search(pattern, first_page_text, re.IGNORECASE)
-                for pattern in [r'abstract', r'introduction', r'methodology', r'references']
+
+def _scan_pdf_page(page, text: str, metadata: dict) -> None:
+    metadata["figure_count"] += len(re.findall(r'(?:Figure|Fig\.?)\s*\d+', text, re.IGNORECASE))
+    metadata["table_count"] += len(re.findall(r'(?:Table|Tab\.?)\s*\d+', text, re.IGNORECASE))
+    metadata["image_count"] += len(page.images)
+    if page.page_number == 1:
+        metadata["is_research"] = any(
+            re.search(pattern, text, re.IGNORECASE)
+            for pattern in [r'abstract', r'introduction', r'methodology', r'references']
+        )
+        section_matches = re.findall(r'^(?:[1-9]\.\s+)?([A-Z][A-Za-z\s]+?)\s*$', text, re.MULTILINE)
+        metadata["sections"] = [s.strip() for s in section_matches if len(s.strip()) > 5]
+
+def _hash_pdf_object(sha256, obj, seen: set) -> None:
+    """Feed a PDF object's value to ``sha256``, following references; object numbers are left out so an
+    identical resource hashes the same in any file."""
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in seen:
+            # Shared or cyclic references are hashed once
+            sha256.update(b"<seen>")
+            return
+        seen.add(obj.objid)
+        obj = resolve1(obj)
+    if isinstance(obj, PDFStream):
+        _hash_pdf_object(sha256, obj.attrs, seen)
+        sha256.update(obj.get_data())
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            # A parent link leads back up the page tree, which is not part of this page
+            if key != "Parent":
+                sha256.update(f"/{key}".encode("utf-8"))
+                _hash_pdf_object(sha256, obj[key], seen)
+    elif isinstance(obj, list):
+        sha256.update(b"[")
+        for item in obj:
+            _hash_pdf_object(sha256, item, seen)
+        sha256.update(b"]")
+    elif isinstance(obj, (PSLiteral, PSKeyword)):
+        sha256.update(repr(obj.name).encode("utf-8"))
+    else:
+        sha256.update(repr(obj).encode("utf-8"))
+
+def _page_content_hash(page) -> str:
+    """Hash of a page's content streams and the resources (fonts, XObjects) they draw with; a page
+    with the same hash extracts to the same text."""
+    sha256 = hashlib.sha256()
+    contents = page.page_obj.contents or []
+    for stream in contents:
+        stream = resolve1(stream)
+        if stream is not None:
+            sha256.update(stream.get_data())
+    sha256.update(b"/Resources")
+    _hash_pdf_object(sha256, page.page_obj.resources or {}, set())
+    return sha256.hexdigest()[:32]
+
+def _scan_pages(pages) -> tuple:
+    """Extract text from a run of pdfplumber pages.
+
+    Returns (page texts, partial metadata, per-page stats); stats hold each page's content
+    hash and counts so a later version of the file can reuse unchanged pages.
+    """
+    texts = []
+    partial = {key: 0 for key in PAGE_COUNT_KEYS}
+    stats = []
+    for page in pages:
+        text = page.extract_text() or ""
+        texts.append(text)
+        page_stats = {"hash": _page_content_hash(page), **{key: 0 for key in PAGE_COUNT_KEYS}}
+        if page.page_number <= MAX_SECTION_CHECK:
+            _scan_pdf_page(page, text, page_stats)
+        for key in PAGE_COUNT_KEYS:
+            partial[key] += page_stats[key]
+        if "sections" in page_stats:
+            partial["is_research"] = page_stats.pop("is_research")
+            partial["sections"] = page_stats.pop("sections")
+        stats.append(page_stats)
+        # Drop the parsed layout objects so peak memory stays at one page
+        page.close()
+    return texts, partial, stats
+
+def _scan_page_range(file_path: str, start: int, end: int) -> tuple:
+    # Runs in a pool worker, so it opens its own handle on the file
+    with pdfplumber.open(file_path) as pdf:
+        return _scan_pages(pdf.pages[start:end])
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
             )
-            for page in pdf.pages[:MAX_SECTION_CHECK]:
-                text = page.extract_text() or ""
-                metadata["figure_count"] += len(re.findall(r'(?:Figure|Fig\.?)\s*\d+', text, re.IGNORECASE))
-                metadata["table_count"] += len(re.findall(r'(?:Table|Tab\.?)\s*\d+', text, re.IGNORECASE))
-                metadata["image_count"] += len(page.images)
-                if page.page_number == 1:
-                    section_matches = re.findall(r'^(?:[1-9]\.\s+)?([A-Z][A-Za-z\s]+?)\s*$', text, re.MULTILINE)
-                    metadata["sections"] = [s.strip() for s in section_matches if len(s.strip()) > 5]
+        return _pdf_pool
+
+def _page_shards(page_count: int) -> list:
+    if PDF_EXTRACT_WORKERS < 2 or page_count < PARALLEL_PDF_MIN_PAGES:
+        return [(0, page_count)]
+    shard_size = max(PDF_MIN_SHARD_PAGES, -(-page_count // PDF_EXTRACT_WORKERS))
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+def _read_pdf_info(pdf, metadata: dict) -> None:
+    metadata["total_pages"] = len(pdf.pages)
+    pdf_meta = pdf.metadata or {}
+    metadata.update({
+        "title": pdf_meta.get('Title', metadata['title']),
+        "author": pdf_meta.get('Author', metadata['author']),
+        "keywords": pdf_meta.get('Keywords', metadata['keywords']),
+        "subject": pdf_meta.get('Subject', metadata['subject'])
+    })
+
+def _scan_pdf(file_path: str, page_limit: int = None) -> tuple:
+    """Read PDF metadata and the text of the first ``page_limit`` pages (all by default).
+
+    Large files are split into page ranges scanned in parallel by a process pool;
+    shard results are put back together in page order.
+    """
+    metadata = _new_pdf_metadata(file_path)
+    with pdfplumber.open(file_path) as pdf:
+        _read_pdf_info(pdf, metadata)
+        page_count = len(pdf.pages) if page_limit is None else min(page_limit, len(pdf.pages))
+        shards = _page_shards(page_count)
+        if len(shards) == 1:
+            results = [_scan_pages(pdf.pages[:page_count])]
+    if len(shards) > 1:
+        starts, ends = zip(*shards)
+        results = list(_get_pdf_pool().map(_scan_page_range, [file_path] * len(shards), starts, ends))
+        logger.info(f"Extracted {page_count} pages of {file_path} in {len(shards)} parallel shards")
+
+    pages = []
+    page_stats = []
+    for texts, partial, stats in results:
+        pages.extend(texts)
+        page_stats.extend(stats)
+        for key in PAGE_COUNT_KEYS:
+            metadata[key] += partial[key]
+        # Only the shard holding page 1 reports these
+        if "sections" in partial:
+            metadata["is_research"] = partial["is_research"]
+            metadata["sections"] = partial["sections"]
+    return metadata, pages, page_stats
+
+def extract_pdf_metadata(file_path: str) -> dict:
+    try:
+        metadata, _, _ = _scan_pdf(file_path, page_limit=MAX_SECTION_CHECK)
     except Exception as e:
         logger.error(f"PDF metadata extraction error: {str(e)}")
         raise FileProcessingError(f"Failed to extract PDF metadata: {str(e)}")
     return metadata
 
+def ingest_pdf(file_path: str) -> dict:
+    """Walk every page of a PDF once, collecting page text and metadata together."""
+    try:
+        metadata, pages, page_stats = _scan_pdf(file_path)
+    except Exception as e:
+        logger.error(f"PDF ingestion error: {str(e)}")
+        raise FileProcessingError(f"Failed to read PDF: {str(e)}")
+    return {"metadata": metadata, "pages": pages, "page_stats": page_stats, "text": "\n".join(pages)}
+
+def pdf_page_hashes(file_path: str) -> tuple:
+    """Document-level metadata and the content hash of every page, without extracting any text."""
+    metadata = _new_pdf_metadata(file_path)
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            _read_pdf_info(pdf, metadata)
+            hashes = []
+            for page in pdf.pages:
+                hashes.append(_page_content_hash(page))
+                page.close()
+    except Exception as e:
+        logger.error(f"PDF page hashing error: {str(e)}")
+        raise FileProcessingError(f"Failed to read PDF: {str(e)}")
+    return metadata, hashes
+
+def scan_pdf_pages(file_path: str, page_indices: list) -> tuple:
+    """Extract only the given pages (0-based); returns ({index: (text, stats)}, partial metadata)."""
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            texts, partial, stats = _scan_pages([pdf.pages[i] for i in page_indices])
+    except Exception as e:
+        logger.error(f"PDF page extraction error: {str(e)}")
+        raise FileProcessingError(f"Failed to read PDF: {str(e)}")
+    return dict(zip(page_indices, zip(texts, stats))), partial
+
 def extract_metadata(file_path: str) -> dict:
     if file_path.endswith('.pdf'):
         return extract_pdf_metadata(file_path)
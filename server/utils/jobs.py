@@ -0,0 +1,232 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+from bson import ObjectId
+from pymongo import ReturnDocument
+from werkzeug.utils import secure_filename
+from utils.db import documents_collection, ingestion_jobs_collection
+from utils.file_utils import FileProcessingError
+from utils.nlp_utils import load_document, index_document, is_indexed, index_user_document, unindex_user_document
+from utils.blob_store import release_blob
+from utils.document_summary import schedule_document_summary
+
+logger = logging.getLogger(__name__)
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 2))
+ACTIVE_STATUSES = ["queued", "running"]
+# A cancel from another process only marks the job; if its worker died it never settles, so after this
+# many seconds without a heartbeat the job is settled as cancelled by whoever looks at it next
+CANCEL_STALE_AFTER = int(os.getenv("CANCEL_STALE_AFTER", 600))
+# A running worker refreshes its job's updated_at this often, however long a stage takes
+JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", 60))
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled between stages"""
+    pass
+
+def build_document_record(user_id: str, original_name: str, stored_name: str, filepath: str, file_ext: str, metadata: Dict) -> Dict:
+    return {
+        "user_id": user_id,
+        "original_name": secure_filename(original_name),
+        "stored_name": stored_name,
+        "upload_date": datetime.utcnow(),
+        "file_type": file_ext,
+        "size": os.path.getsize(filepath),
+        "title": metadata.get("title", "Untitled Document"),
+        "author": metadata.get("author", "Unknown Author"),
+        "metadata": metadata,
+        "content_hash": metadata.get("content_hash"),
+        "version": 1
+    }
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn gives each worker its own Mongo client instead of a forked copy
+            _executor = ProcessPoolExecutor(
+                max_workers=INGESTION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def _new_job(user_id: str, filepath: str, original_name: str, stored_name: str, file_ext: str) -> Dict:
+    return {
+        "user_id": user_id,
+        "status": "queued",
+        "stage": None,
+        "original_name": secure_filename(original_name),
+        "stored_name": stored_name,
+        "filepath": filepath,
+        "file_type": file_ext,
+        "document_id": None,
+        "error": None,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+
+def submit_ingestion_job(user_id: str, filepath: str, original_name: str, stored_name: str, file_ext: str) -> str:
+    """Queue ingestion of an uploaded blob; the job takes over the caller's blob reference."""
+    job_id = str(ingestion_jobs_collection.insert_one(
+        _new_job(user_id, filepath, original_name, stored_name, file_ext)
+    ).inserted_id)
+    future = _get_executor().submit(run_ingestion_job, job_id, filepath, user_id, original_name, stored_name, file_ext)
+    _futures[job_id] = future
+    future.add_done_callback(lambda f: _futures.pop(job_id, None))
+    return job_id
+
+def reuse_ingested_document(user_id: str, filepath: str, original_name: str, stored_name: str, file_ext: str,
+                            metadata: Dict) -> str:
+    """Record a re-upload of already-ingested content as an immediately completed job.
+
+    The blob's parse and index are shared, so only the per-user documents record is written.
+    """
+    if not is_indexed(filepath):
+        # The matched record can predate content addressing (a doc_<uuid> file of its own), leaving this
+        # blob without an index for the user's search shard to take vectors from
+        documents, _ = load_document(filepath, metadata.get("content_hash"))
+        index_document(filepath, documents)
+    doc_data = build_document_record(user_id, original_name, stored_name, filepath, file_ext, metadata)
+    document_id = documents_collection.insert_one(doc_data).inserted_id
+    index_user_document(user_id, str(document_id), filepath, doc_data["content_hash"])
+    # A no-op when the content already has a summary; backfills content ingested before summaries existed
+    schedule_document_summary(filepath, doc_data["content_hash"])
+    job = _new_job(user_id, filepath, original_name, stored_name, file_ext)
+    job.update({
+        "status": "completed",
+        "document_id": str(document_id),
+        "title": doc_data["title"],
+        "author": doc_data["author"]
+    })
+    return str(ingestion_jobs_collection.insert_one(job).inserted_id)
+
+def _expire_stale_cancel(job: Optional[Dict]) -> Optional[Dict]:
+    if not job or job["status"] != "cancelling":
+        return job
+    expired = ingestion_jobs_collection.find_one_and_update(
+        {
+            "_id": job["_id"],
+            "status": "cancelling",
+            "updated_at": {"$lt": datetime.utcnow() - timedelta(seconds=CANCEL_STALE_AFTER)}
+        },
+        {"$set": {"status": "cancelled", "stage": None, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if expired is None:
+        return job
+    # Only the caller whose update settled the job releases its blob
+    logger.warning(f"Job {job['_id']} was left cancelling by a worker that stopped; settled as cancelled")
+    release_blob(job["stored_name"])
+    return expired
+
+def get_job(job_id: str, user_id: str) -> Optional[Dict]:
+    return _expire_stale_cancel(ingestion_jobs_collection.find_one({"_id": ObjectId(job_id), "user_id": user_id}))
+
+def cancel_job(job_id: str, user_id: str) -> Optional[Dict]:
+    job = ingestion_jobs_collection.find_one_and_update(
+        {"_id": ObjectId(job_id), "user_id": user_id, "status": {"$in": ACTIVE_STATUSES}},
+        {"$set": {"status": "cancelling", "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return None
+    # A job still waiting in this process's queue never reaches a worker
+    future = _futures.get(job_id)
+    if future and future.cancel():
+        release_blob(job["stored_name"])
+        job = ingestion_jobs_collection.find_one_and_update(
+            {"_id": job["_id"]},
+            {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+    return job
+
+def _checkpoint(job_oid: ObjectId, stage: str) -> None:
+    job = ingestion_jobs_collection.find_one_and_update(
+        {"_id": job_oid, "status": {"$in": ACTIVE_STATUSES}},
+        {"$set": {"status": "running", "stage": stage, "updated_at": datetime.utcnow()}}
+    )
+    if job is None:
+        raise JobCancelled(f"Job {job_oid} cancelled before {stage}")
+
+def _finish(job_oid: ObjectId, status: str, **fields) -> bool:
+    """Settle a job; False when it was already settled (e.g. a stale cancel) and its blob released."""
+    finished = ingestion_jobs_collection.update_one(
+        {"_id": job_oid, "status": {"$in": ACTIVE_STATUSES + ["cancelling"]}},
+        {"$set": {"status": status, "stage": None, "updated_at": datetime.utcnow(), **fields}}
+    )
+    return finished.modified_count > 0
+
+def _heartbeat(job_oid: ObjectId, stop: threading.Event) -> None:
+    # Keeps a live worker's job (cancelling included) from looking abandoned during a long parse or embed
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            ingestion_jobs_collection.update_one(
+                {"_id": job_oid, "status": {"$in": ACTIVE_STATUSES + ["cancelling"]}},
+                {"$set": {"updated_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.warning(f"Heartbeat of job {job_oid} failed: {str(e)}")
+
+def run_ingestion_job(job_id: str, filepath: str, user_id: str, original_name: str, stored_name: str, file_ext: str) -> None:
+    """Worker entry point: parse, chunk and embed, checking for cancellation between stages."""
+    job_oid = ObjectId(job_id)
+    document_id = None
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_oid, stop_heartbeat), name=f"job-heartbeat-{job_id}",
+                     daemon=True).start()
+    try:
+        _checkpoint(job_oid, "parsing")
+        documents, metadata = load_document(filepath)
+        if not documents and not metadata.get("text_length"):
+            raise FileProcessingError("Failed to process document content")
+
+        _checkpoint(job_oid, "indexing")
+        index_document(filepath, documents)
+
+        _checkpoint(job_oid, "saving")
+        doc_data = build_document_record(user_id, original_name, stored_name, filepath, file_ext, metadata)
+        document_id = documents_collection.insert_one(doc_data).inserted_id
+        index_user_document(user_id, str(document_id), filepath, doc_data["content_hash"])
+
+        completed = ingestion_jobs_collection.update_one(
+            {"_id": job_oid, "status": "running"},
+            {"$set": {
+                "status": "completed",
+                "stage": None,
+                "document_id": str(document_id),
+                "title": doc_data["title"],
+                "author": doc_data["author"],
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        if completed.modified_count == 0:
+            raise JobCancelled(f"Job {job_id} cancelled while saving")
+        # Answers the usual first question (a summary) before it is asked
+        schedule_document_summary(filepath, doc_data["content_hash"])
+
+    except JobCancelled as e:
+        logger.info(str(e))
+        if document_id:
+            documents_collection.delete_one({"_id": document_id})
+            unindex_user_document(user_id, str(document_id))
+        if _finish(job_oid, "cancelled"):
+            release_blob(stored_name)
+    except FileProcessingError as e:
+        logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+        if _finish(job_oid, "failed", error=str(e)):
+            release_blob(stored_name)
+    except Exception as e:
+        logger.error(f"Unexpected ingestion error in job {job_id}: {str(e)}", exc_info=True)
+        if _finish(job_oid, "failed", error="Failed to process document"):
+            release_blob(stored_name)
+    finally:
+        stop_heartbeat.set()
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional, Dict, List
+from utils.db import llm_cache_collection
+from utils.metrics import register_counter, inc_counter
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 512))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+register_counter("llm_cache_hits_total", "LLM response cache hits by tier")
+register_counter("llm_cache_misses_total", "LLM response cache lookups that reached the LLM")
+
+def normalize_query(query: str) -> str:
+    normalized = re.sub(r"\s+", " ", query.lower()).strip()
+    return normalized.rstrip("?!. ")
+
+def history_digest(chat_history: Optional[List[Dict]]) -> Optional[str]:
+    """Digest of the conversation a prompt is built from (running summary and recent turns); None if there is none."""
+    if not chat_history:
+        return None
+    history = json.dumps([[entry["type"], entry["content"]] for entry in chat_history])
+    return hashlib.sha256(history.encode("utf-8")).hexdigest()
+
+def response_cache_key(content_hash: Optional[str], query: str, response_style: Dict, model: str,
+                       chat_history: Optional[List[Dict]] = None, user_id: Optional[str] = None) -> Optional[str]:
+    """Key for a cached answer.
+
+    Answers shaped by a conversation are keyed to that conversation and its user; only history-free
+    answers are shared, across chats and across users uploading the same content.
+    """
+    if not LLM_CACHE_ENABLED or not content_hash:
+        return None
+    key = {
+        "document": content_hash,
+        "query": normalize_query(query),
+        "style": response_style,
+        "model": model
+    }
+    digest = history_digest(chat_history)
+    if digest:
+        key.update({"history": digest, "user": user_id})
+    key_source = json.dumps(key, sort_keys=True)
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+def _remember(key: str, response: str) -> None:
+    with _lru_lock:
+        _lru[key] = response
+        _lru.move_to_end(key)
+        while len(_lru) > LLM_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+def _lookup_memory(key: str) -> Optional[str]:
+    with _lru_lock:
+        if key in _lru:
+            _lru.move_to_end(key)
+            inc_counter("llm_cache_hits_total", {"tier": "memory"})
+            return _lru[key]
+    return None
+
+def _resolve_mongo_entry(key: str, entry: Optional[Dict]) -> Optional[str]:
+    if entry:
+        _remember(key, entry["response"])
+        inc_counter("llm_cache_hits_total", {"tier": "mongo"})
+        return entry["response"]
+    inc_counter("llm_cache_misses_total")
+    return None
+
+def _cache_update(response: str) -> Dict:
+    return {"$set": {"response": response, "created_at": datetime.utcnow()}}
+
+def get_cached_response(key: Optional[str]) -> Optional[str]:
+    if not key:
+        return None
+    cached = _lookup_memory(key)
+    if cached is not None:
+        return cached
+    try:
+        entry = llm_cache_collection.find_one({"_id": key}, {"response": 1})
+    except Exception as e:
+        logger.warning(f"LLM cache lookup failed: {str(e)}")
+        entry = None
+    return _resolve_mongo_entry(key, entry)
+
+def cache_response(key: Optional[str], response: str) -> None:
+    if not key or not response:
+        return
+    _remember(key, response)
+    try:
+        llm_cache_collection.update_one({"_id": key}, _cache_update(response), upsert=True)
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {str(e)}")
+
+async def aget_cached_response(key: Optional[str], collection: Any) -> Optional[str]:
+    """Async variant of get_cached_response; ``collection`` is a Motor collection."""
+    if not key:
+        return None
+    cached = _lookup_memory(key)
+    if cached is not None:
+        return cached
+    try:
+        entry = await collection.find_one({"_id": key}, {"response": 1})
+    except Exception as e:
+        logger.warning(f"LLM cache lookup failed: {str(e)}")
+        entry = None
+    return _resolve_mongo_entry(key, entry)
+
+async def acache_response(key: Optional[str], response: str, collection: Any) -> None:
+    if not key or not response:
+        return
+    _remember(key, response)
+    try:
+        await collection.update_one({"_id": key}, _cache_update(response), upsert=True)
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {str(e)}")
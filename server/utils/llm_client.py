@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import random
+import logging
+import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class LLMServiceError(Exception):
+    """LLM call failed; the message is safe to show to the user"""
+    pass
+
+class CircuitOpenError(LLMServiceError):
+    """Raised without contacting the provider while the circuit breaker is open"""
+    pass
+
+class CircuitBreaker:
+    """Opens after consecutive provider failures and lets one trial call through after a cool-down."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def admit(self) -> Optional[str]:
+        """Admit one call: "closed", "trial" for the single half-open probe, or None to refuse it.
+
+        Pass the result to ``release`` once the call is over, however it ended.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return None
+            self._trial_in_flight = True
+            return "trial"
+
+    def release(self, admission: Optional[str]) -> None:
+        # A trial that ended without recording an outcome (an unexpected error, a cancelled task)
+        # must not hold the half-open slot, or no call would ever be let through again
+        if admission == "trial":
+            with self._lock:
+                self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"LLM circuit breaker opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+class _BaseLLMClient:
+    """Configuration and retry policy shared by the blocking and asyncio clients."""
+
+    def __init__(self, api_url: str, api_key: str, model: str,
+                 pool_size: int = int(os.getenv("LLM_POOL_SIZE", 10)),
+                 max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+                 max_retries: int = int(os.getenv("LLM_MAX_RETRIES", 3)),
+                 timeout: float = float(os.getenv("LLM_TIMEOUT", 30)),
+                 backoff_base: float = float(os.getenv("LLM_BACKOFF_BASE", 0.5)),
+                 backoff_max: float = float(os.getenv("LLM_BACKOFF_MAX", 8)),
+                 max_retry_after: float = float(os.getenv("LLM_MAX_RETRY_AFTER", 30)),
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_url = api_url
+        self.model = model
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", 30))
+        )
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _payload(self, messages: List[Dict], temperature: float, max_tokens: int, stream: bool) -> Dict:
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if stream:
+            data["stream"] = True
+        return data
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    def _retry_after(self, response: Any) -> Optional[float]:
+        header = response.headers.get("Retry-After")
+        if not header:
+            return None
+        try:
+            delay = float(header)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(header) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return max(0.0, min(delay, self.max_retry_after))
+
+    def _retry_delay(self, response: Any, attempt: int) -> float:
+        """Record a retryable status with the breaker and work out how long to wait."""
+        # Rate limiting means the provider is up, so only 5xx count towards opening the circuit
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        delay = self._retry_after(response)
+        return self._backoff(attempt) if delay is None else delay
+
+    def _check_breaker(self) -> str:
+        admission = self.breaker.admit()
+        if admission is None:
+            raise CircuitOpenError("AI service is temporarily unavailable. Please try again shortly.")
+        return admission
+
+class LLMClient(_BaseLLMClient):
+    """Chat-completions client with a keep-alive pool, a concurrency cap, retries and a circuit breaker."""
+
+    def __init__(self, api_url: str, api_key: str, model: str, **options):
+        super().__init__(api_url, api_key, model, **options)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _post(self, data: Dict, stream: bool) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            admission = self._check_breaker()
+            try:
+                try:
+                    response = self.session.post(self.api_url, json=data, timeout=self.timeout, stream=stream)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self.breaker.record_failure()
+                    if last_attempt:
+                        raise
+                    delay = self._backoff(attempt)
+                    logger.warning(f"LLM request error ({str(e)}), retrying in {delay:.2f}s")
+                else:
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        self.breaker.record_success()
+                        response.raise_for_status()
+                        return response
+                    delay = self._retry_delay(response, attempt)
+                    if last_attempt:
+                        response.raise_for_status()
+                    response.close()
+                    logger.warning(f"LLM returned {response.status_code}, retrying in {delay:.2f}s")
+            finally:
+                self.breaker.release(admission)
+            time.sleep(delay)
+
+    def _acquire_slot(self) -> None:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise LLMServiceError("AI service is busy. Please try again later.")
+
+    def complete(self, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 1500) -> str:
+        self._acquire_slot()
+        try:
+            response = self._post(self._payload(messages, temperature, max_tokens, stream=False), stream=False)
+            return response.json()["choices"][0]["message"]["content"]
+        except requests.Timeout:
+            logger.error("LLM API request timed out")
+            raise LLMServiceError("Request to AI service timed out. Please try again later.")
+        except requests.RequestException as e:
+            logger.error(f"LLM API request failed: {str(e)}")
+            raise LLMServiceError(f"Failed to connect to AI service: {str(e)}")
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f"Invalid LLM API response format: {str(e)}")
+            raise LLMServiceError("Received an invalid response from the AI service.")
+        finally:
+            self._slots.release()
+
+    def stream(self, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 1500) -> Iterator[str]:
+        """Yield completion tokens as the LLM produces them (OpenAI-style SSE chunks)."""
+        self._acquire_slot()
+        try:
+            response = self._post(self._payload(messages, temperature, max_tokens, stream=True), stream=True)
+            with response:
+                # SSE is always UTF-8; without this requests falls back to ISO-8859-1 for text/*
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    delta = json.loads(payload)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except requests.Timeout:
+            logger.error("LLM API stream timed out")
+            raise LLMServiceError("Request to AI service timed out. Please try again later.")
+        except requests.RequestException as e:
+            logger.error(f"LLM API stream failed: {str(e)}")
+            raise LLMServiceError(f"Failed to connect to AI service: {str(e)}")
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f"Invalid LLM API stream chunk: {str(e)}")
+            raise LLMServiceError("Received an invalid response from the AI service.")
+        finally:
+            self._slots.release()
+
+class AsyncLLMClient(_BaseLLMClient):
+    """asyncio counterpart of LLMClient for the ASGI serving mode, built on httpx."""
+
+    def __init__(self, api_url: str, api_key: str, model: str, **options):
+        # httpx is only needed by the ASGI entry point, so the WSGI server does not import it
+        import httpx
+        super().__init__(api_url, api_key, model, **options)
+        self._httpx = httpx
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    async def _post(self, data: Dict) -> Any:
+        httpx = self._httpx
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            admission = self._check_breaker()
+            try:
+                try:
+                    response = await self.client.post(self.api_url, json=data)
+                except (httpx.ConnectError, httpx.TimeoutException) as e:
+                    self.breaker.record_failure()
+                    if last_attempt:
+                        raise
+                    delay = self._backoff(attempt)
+                    logger.warning(f"LLM request error ({str(e)}), retrying in {delay:.2f}s")
+                else:
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        self.breaker.record_success()
+                        response.raise_for_status()
+                        return response
+                    delay = self._retry_delay(response, attempt)
+                    if last_attempt:
+                        response.raise_for_status()
+                    logger.warning(f"LLM returned {response.status_code}, retrying in {delay:.2f}s")
+            finally:
+                # Also covers errors nobody records and cancellation of the awaiting task
+                self.breaker.release(admission)
+            await asyncio.sleep(delay)
+
+    async def complete(self, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 1500) -> str:
+        httpx = self._httpx
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise LLMServiceError("AI service is busy. Please try again later.")
+        try:
+            response = await self._post(self._payload(messages, temperature, max_tokens, stream=False))
+            return response.json()["choices"][0]["message"]["content"]
+        except httpx.TimeoutException:
+            logger.error("LLM API request timed out")
+            raise LLMServiceError("Request to AI service timed out. Please try again later.")
+        except httpx.HTTPError as e:
+            logger.error(f"LLM API request failed: {str(e)}")
+            raise LLMServiceError(f"Failed to connect to AI service: {str(e)}")
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f"Invalid LLM API response format: {str(e)}")
+            raise LLMServiceError("Received an invalid response from the AI service.")
+        finally:
+            self._slots.release()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
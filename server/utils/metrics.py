@@ -0,0 +1,78 @@
+import bisect
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Sequence, Tuple
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[Tuple, float]] = defaultdict(lambda: defaultdict(float))
+_help: Dict[str, str] = {}
+# name -> (bucket upper bounds, {label key: [per-bucket counts..., +Inf count, sum]})
+_histograms: Dict[str, Tuple[Tuple[float, ...], Dict[Tuple, list]]] = {}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def register_counter(name: str, help_text: str) -> None:
+    with _lock:
+        _help[name] = help_text
+        _counters[name]
+
+def inc_counter(name: str, labels: Optional[Dict[str, str]] = None, value: float = 1) -> None:
+    label_key = tuple(sorted((labels or {}).items()))
+    with _lock:
+        _counters[name][label_key] += value
+
+def get_counter(name: str, labels: Optional[Dict[str, str]] = None) -> float:
+    label_key = tuple(sorted((labels or {}).items()))
+    with _lock:
+        return _counters.get(name, {}).get(label_key, 0)
+
+def register_histogram(name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+    with _lock:
+        _help[name] = help_text
+        if name not in _histograms:
+            _histograms[name] = (tuple(sorted(buckets)), {})
+
+def observe(name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+    label_key = tuple(sorted((labels or {}).items()))
+    with _lock:
+        buckets, series = _histograms[name]
+        # Counts are stored per bucket and made cumulative when rendered
+        counts = series.setdefault(label_key, [0] * (len(buckets) + 1) + [0.0])
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+def _format_labels(label_key: Tuple) -> str:
+    if not label_key:
+        return ""
+    pairs = []
+    for key, value in label_key:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _render_histogram(name: str, buckets: Tuple[float, ...], series: Dict[Tuple, list]) -> list:
+    lines = []
+    for label_key, counts in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip([f"{b:g}" for b in buckets] + ["+Inf"], counts[:-1]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(label_key + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(label_key)} {counts[-1]:g}")
+        lines.append(f"{name}_count{_format_labels(label_key)} {cumulative}")
+    return lines
+
+def render_prometheus() -> str:
+    lines = []
+    with _lock:
+        for name in sorted(_counters):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for label_key, value in sorted(_counters[name].items()):
+                lines.append(f"{name}{_format_labels(label_key)} {value:g}")
+        for name in sorted(_histograms):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(_render_histogram(name, *_histograms[name]))
+    return "\n".join(lines) + "\n"
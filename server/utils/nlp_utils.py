@@ -1,92 +1,314 @@
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredWordDocumentLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
 import re
+import time
+import hashlib
 import logging
-import requests
-from utils.file_utils import extract_metadata, extract_text_from_pdf, extract_text_from_docx, FileProcessingError
-from typing import List, Tuple, Optional, Dict, Any
+import threading
+from functools import lru_cache
+from utils.file_utils import (extract_metadata, extract_text_from_docx, ingest_pdf, pdf_page_hashes, scan_pdf_pages,
+                              FileProcessingError, MAX_SECTION_CHECK, PAGE_COUNT_KEYS)
+from utils.cache_utils import (compute_file_hash, load_parsed_document, save_parsed_document, load_page_manifest,
+                               save_page_manifest)
+from utils.text_store import load_text, save_text, offload_text
+from utils.vector_store import (index_path_for, build_index, build_index_reusing, vectors_by_key, load_index,
+                                search_index, index_vectors)
+from utils import user_index
+from utils.bm25_index import bm25_path_for, build_bm25_index, load_bm25_index, bm25_chunk_count, search_bm25, fuse_rankings
+from utils.llm_cache import response_cache_key, get_cached_response, cache_response
+from utils.llm_client import LLMClient, LLMServiceError
+from utils.embedding_service import EmbeddingServiceClient
+from utils.context_packer import pack_context, truncate_to_tokens, load_tokenizer
+from utils.metrics import register_counter, inc_counter, register_histogram, observe
+from utils.tracing import span, traced
+from typing import List, Tuple, Optional, Dict, Any, Iterator
 import os
 
 logger = logging.getLogger(__name__)
 
-embeddings = HuggingFaceEmbeddings(model_name=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# When set, embeddings come from the shared utils.embedding_service instead of an in-process model
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET")
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY", "your_key_here")
 TOGETHER_API_URL = os.getenv("TOGETHER_API_URL", "https://api.together.xyz/v1/chat/completions")
 LLAMA_MODEL = os.getenv("LLAMA_MODEL", "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free")
-MAX_CONTEXT_LENGTH = int(os.getenv("MAX_CONTEXT_LENGTH", 8000))
+llm_client = LLMClient(TOGETHER_API_URL, TOGETHER_API_KEY, LLAMA_MODEL)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1500))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 5))
+# Each ranking contributes this many candidates to fusion (and to reranking)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+RRF_K = int(os.getenv("RRF_K", 60))
+# Optional cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2; reranking is off when unset
+RERANK_MODEL = os.getenv("RERANK_MODEL")
+# Recent turns kept out of the chat's running summary (utils.chat_memory); they and any turns not yet
+# summarized are sent verbatim, clipped to HISTORY_MESSAGE_TOKENS each
+HISTORY_CONTEXT_MESSAGES = int(os.getenv("HISTORY_CONTEXT_MESSAGES", 4))
+HISTORY_MESSAGE_TOKENS = int(os.getenv("HISTORY_MESSAGE_TOKENS", 100))
+# Retrieved chunks offered to the context packer, which keeps as many as the token budget allows
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 10))
+# A new version with more than this share of changed pages is simply parsed from scratch
+INCREMENTAL_MAX_CHANGED_RATIO = float(os.getenv("INCREMENTAL_MAX_CHANGED_RATIO", 0.5))
 
-def load_document(file_path: str) -> Tuple[Optional[List[Any]], Dict]:
-    """Load document, extract title/authors, and split into chunks."""
-    if not file_path or not os.path.exists(file_path):
-        return [], {"title": "Untitled Document", "author": "Unknown Author", "extracted_text": ""}
+register_counter("context_tokens_total", "Prompt context tokens packed, by part")
+register_histogram("document_chunks", "Chunks per parsed document", (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+register_histogram("context_tokens", "Tokens of packed prompt context per query", (250, 500, 1000, 1500, 2000, 3000, 4000, 8000))
+register_histogram("prompt_chars", "Characters per LLM prompt", (1000, 2000, 4000, 8000, 12000, 16000, 32000))
+
+# langchain, sentence-transformers and the model itself load on first use, not at import,
+# so importing the server (and each worker boot) stays fast
+_embeddings = None
+_reranker = None
+_embeddings_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+def get_embeddings() -> Any:
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None and EMBEDDING_SERVICE_SOCKET:
+                _embeddings = EmbeddingServiceClient(EMBEDDING_SERVICE_SOCKET)
+            elif _embeddings is None:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+                _embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return _embeddings
+
+def models_loaded() -> bool:
+    return _embeddings is not None
+
+def warm_up() -> float:
+    """Load the embedding model, context tokenizer and parsing stack ahead of the first request; returns seconds taken."""
+    started = time.perf_counter()
+    get_embeddings().embed_query("warm-up")
+    load_tokenizer()
+    from langchain.text_splitter import RecursiveCharacterTextSplitter  # noqa: F401
+    from langchain_core.documents import Document  # noqa: F401
+    elapsed = time.perf_counter() - started
+    logger.info(f"Models warmed up in {elapsed:.2f}s")
+    return elapsed
+
+def warm_up_started() -> bool:
+    return _warm_up_thread is not None
+
+def start_warm_up() -> bool:
+    """Run warm_up in a background thread unless one was already started."""
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is not None:
+            return False
+        _warm_up_thread = threading.Thread(target=_warm_up_quietly, name="model-warm-up", daemon=True)
+    _warm_up_thread.start()
+    return True
+
+def _warm_up_quietly() -> None:
     try:
-        metadata = extract_metadata(file_path)
-        
-        if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path, extract_images=False)
-            file_stream = open(file_path, 'rb')
-            extracted_text = extract_text_from_pdf(file_stream)
-            file_stream.close()
-        elif file_path.endswith(".docx"):
-            loader = UnstructuredWordDocumentLoader(file_path, mode="elements")
-            file_stream = open(file_path, 'rb')
-            extracted_text = extract_text_from_docx(file_stream)
-            file_stream.close()
-        else:
-            logger.error(f"Unsupported file type: {file_path}")
-            raise FileProcessingError(f"Unsupported file type: {file_path}")
+        warm_up()
+    except Exception as e:
+        logger.error(f"Model warm-up failed: {str(e)}", exc_info=True)
+
+def chunk_params() -> Dict:
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+@traced("load_document")
+def load_document(file_path: str, content_hash: Optional[str] = None) -> Tuple[Optional[List[Any]], Dict]:
+    """Load document from the parse cache, parsing and caching it on a miss.
+
+    Pass ``content_hash`` when it is already known (e.g. hashed during upload) to skip re-reading the file.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return [], {"title": "Untitled Document", "author": "Unknown Author", "text_length": 0}
+    content_hash = content_hash or compute_file_hash(file_path)
+    cached = load_parsed_document(content_hash, chunk_params())
+    if cached is not None:
+        split_docs, metadata = cached
+        for doc in split_docs:
+            doc.metadata["source"] = file_path
+        return split_docs, metadata
+    with span("parse"):
+        split_docs, metadata = parse_document(file_path)
+    return _store_parse(content_hash, split_docs, metadata)
+
+def _store_parse(content_hash: str, split_docs: List[Any], metadata: Dict) -> Tuple[List[Any], Dict]:
+    observe("document_chunks", len(split_docs))
+    metadata["content_hash"] = content_hash
+    manifest = metadata.pop("page_manifest", None)
+    # The full text goes to the text store; metadata (and so Mongo records) only keeps its length
+    offload_text(content_hash, metadata)
+    save_parsed_document(content_hash, chunk_params(), split_docs, metadata)
+    if manifest:
+        save_page_manifest(content_hash, manifest)
+    return split_docs, metadata
+
+def _page_manifest(page_texts: List[str], page_stats: List[Dict]) -> Dict:
+    """Where each page's text sits in the stored full text (pages joined by newlines), with its hash and counts."""
+    pages = []
+    offset = 0
+    for text, stats in zip(page_texts, page_stats):
+        pages.append({**stats, "start": offset, "end": offset + len(text)})
+        offset += len(text) + 1
+    return {"pages": pages}
+
+@traced("load_document_version")
+def load_document_version(file_path: str, content_hash: str, previous_hash: Optional[str]) -> Tuple[List[Any], Dict, Dict]:
+    """Parse a new version of a document, re-extracting only the PDF pages whose content changed.
 
+    Chunks and text of unchanged pages come from the previous version's parse cache, page manifest
+    and stored text; when any of those is missing the file is parsed from scratch. Returns
+    (chunks, metadata, stats).
+    """
+    cached = load_parsed_document(content_hash, chunk_params())
+    previous = load_parsed_document(previous_hash, chunk_params()) if previous_hash else None
+    manifest = load_page_manifest(previous_hash) if previous is not None else None
+    previous_text = load_text(previous_hash) if manifest is not None else None
+    if cached is not None or not file_path.endswith(".pdf") or previous_text is None:
+        split_docs, metadata = load_document(file_path, content_hash)
+        pages = metadata.get("total_pages")
+        return split_docs, metadata, {"pages_total": pages, "pages_reextracted": 0 if cached is not None else pages}
+
+    metadata, hashes = pdf_page_hashes(file_path)
+    previous_pages = manifest["pages"]
+    previous_index = {}
+    for index, page in enumerate(previous_pages):
+        previous_index.setdefault(page["hash"], index)
+    changed = [i for i, page_hash in enumerate(hashes) if page_hash not in previous_index]
+    # Research detection and section names come from page 1 and are only known for the old page 1
+    if hashes and previous_index.get(hashes[0]) not in (None, 0):
+        changed.insert(0, 0)
+    if len(changed) > INCREMENTAL_MAX_CHANGED_RATIO * len(hashes):
+        split_docs, metadata = load_document(file_path, content_hash)
+        return split_docs, metadata, {"pages_total": len(hashes), "pages_reextracted": len(hashes)}
+
+    from langchain_core.documents import Document
+    with span("parse"):
+        scanned, partial = scan_pdf_pages(file_path, changed)
+        previous_chunks = {}
+        for doc in previous[0]:
+            previous_chunks.setdefault(doc.metadata.get("page"), []).append(doc)
+        page_texts, page_stats, split_docs = [], [], []
+        for page_number, page_hash in enumerate(hashes):
+            if page_number in scanned:
+                text, stats = scanned[page_number]
+                page_doc = Document(page_content=text,
+                                    metadata={"source": file_path, "page": page_number, "page_hash": page_hash})
+                split_docs.extend(tag_sections(split_documents([page_doc])))
+            else:
+                old_number = previous_index[page_hash]
+                stats = {key: value for key, value in previous_pages[old_number].items() if key not in ("start", "end")}
+                text = previous_text[previous_pages[old_number]["start"]:previous_pages[old_number]["end"]]
+                split_docs.extend(
+                    Document(page_content=doc.page_content,
+                             metadata={**doc.metadata, "source": file_path, "page": page_number})
+                    for doc in previous_chunks.get(old_number, [])
+                )
+            page_texts.append(text)
+            page_stats.append(stats)
+
+    for key in PAGE_COUNT_KEYS:
+        metadata[key] = sum(stats[key] for stats in page_stats[:MAX_SECTION_CHECK])
+    page_one = partial if 0 in scanned else previous[1]
+    metadata["is_research"] = page_one.get("is_research", False)
+    metadata["sections"] = page_one.get("sections", [])
+    _detect_title_author(metadata, page_texts[0] if page_texts else "", file_path)
+    metadata["extracted_text"] = "\n".join(page_texts)
+    metadata["page_manifest"] = _page_manifest(page_texts, page_stats)
+    split_docs, metadata = _store_parse(content_hash, split_docs, metadata)
+    logger.info(f"Re-parsed {file_path} incrementally: {len(changed)} of {len(hashes)} pages extracted")
+    return split_docs, metadata, {"pages_total": len(hashes), "pages_reextracted": len(changed)}
+
+def get_document_text(file_path: str, content_hash: Optional[str]) -> Optional[str]:
+    """Full extracted text, re-extracting it from the file if the text store no longer has it."""
+    text = load_text(content_hash)
+    if text is None and file_path and os.path.exists(file_path):
+        content_hash = content_hash or compute_file_hash(file_path)
+        _, metadata = parse_document(file_path)
+        text = metadata.get("extracted_text", "")
+        save_text(content_hash, text)
+    return text
+
+SECTION_PATTERNS = {
+    "abstract": r"abstract|summary",
+    "introduction": r"introduction|background",
+    "methods": r"method|methodology|approach|experiment",
+    "results": r"result|finding|outcome|data",
+    "discussion": r"discussion|conclusion|implication",
+    "references": r"reference|bibliography",
+    "appendix": r"appendix|supplement"
+}
+
+def read_document(file_path: str) -> Tuple[List[Any], Dict]:
+    """Extract a document's pages/elements and metadata (title, author, full text), unsplit."""
+    from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+    from langchain_core.documents import Document
+    if file_path.endswith(".pdf"):
+        ingested = ingest_pdf(file_path)
+        metadata = ingested["metadata"]
+        extracted_text = ingested["text"]
+        docs = [
+            Document(page_content=page_text, metadata={"source": file_path, "page": page_number, "page_hash": stats["hash"]})
+            for page_number, (page_text, stats) in enumerate(zip(ingested["pages"], ingested["page_stats"]))
+        ]
+        metadata["page_manifest"] = _page_manifest(ingested["pages"], ingested["page_stats"])
+    elif file_path.endswith(".docx"):
+        metadata = extract_metadata(file_path)
+        loader = UnstructuredWordDocumentLoader(file_path, mode="elements")
+        file_stream = open(file_path, 'rb')
+        extracted_text = extract_text_from_docx(file_stream)
+        file_stream.close()
         docs = []
         for doc in loader.lazy_load():
             docs.append(doc)
-        
-        first_page = docs[0].page_content if docs else ""
-        if not metadata.get("title") or metadata["title"] == os.path.basename(file_path):
-            title_match = re.search(r'^([^\n]{10,100})(?=\n\n|\nAbstract|\n\d+\sIntroduction)', first_page, re.MULTILINE)
-            if title_match:
-                metadata["title"] = title_match.group(1).strip()
-            else:
-                metadata["title"] = "Untitled Document"
-        if not metadata.get("author") or metadata["author"] == "Unknown":
-            author_match = re.search(r'(?<=[\n\r])([A-Z][\w\s\.,]+(?:,\s*[A-Z][\w\s\.,]+)*)(?=\n(?:[A-Za-z\s]*Department|[A-Za-z\s]*University|\nAbstract))', first_page)
-            if author_match:
-                metadata["author"] = author_match.group(1).strip()
-            else:
-                metadata["author"] = "Unknown Author"
-
-        metadata["extracted_text"] = extracted_text
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", ". ", "? ", "! ", " ", ""],
-            is_separator_regex=False
-        )
-        split_docs = text_splitter.split_documents(docs)
-
-        section_patterns = {
-            "abstract": r"abstract|summary",
-            "introduction": r"introduction|background",
-            "methods": r"method|methodology|approach|experiment",
-            "results": r"result|finding|outcome|data",
-            "discussion": r"discussion|conclusion|implication",
-            "references": r"reference|bibliography",
-            "appendix": r"appendix|supplement"
-        }
+    else:
+        logger.error(f"Unsupported file type: {file_path}")
+        raise FileProcessingError(f"Unsupported file type: {file_path}")
 
-        for doc in split_docs:
-            first_200 = doc.page_content[:200].lower()
-            for section, pattern in section_patterns.items():
-                if re.search(pattern, first_200):
-                    doc.metadata["section"] = section
-                    break
-            else:
-                doc.metadata["section"] = "other"
+    _detect_title_author(metadata, docs[0].page_content if docs else "", file_path)
+    metadata["extracted_text"] = extracted_text
+    return docs, metadata
 
-        return split_docs, metadata
+def _detect_title_author(metadata: Dict, first_page: str, file_path: str) -> None:
+    if not metadata.get("title") or metadata["title"] == os.path.basename(file_path):
+        title_match = re.search(r'^([^\n]{10,100})(?=\n\n|\nAbstract|\n\d+\sIntroduction)', first_page, re.MULTILINE)
+        if title_match:
+            metadata["title"] = title_match.group(1).strip()
+        else:
+            metadata["title"] = "Untitled Document"
+    if not metadata.get("author") or metadata["author"] == "Unknown":
+        author_match = re.search(r'(?<=[\n\r])([A-Z][\w\s\.,]+(?:,\s*[A-Z][\w\s\.,]+)*)(?=\n(?:[A-Za-z\s]*Department|[A-Za-z\s]*University|\nAbstract))', first_page)
+        if author_match:
+            metadata["author"] = author_match.group(1).strip()
+        else:
+            metadata["author"] = "Unknown Author"
+
+def split_documents(docs: List[Any]) -> List[Any]:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", "? ", "! ", " ", ""],
+        is_separator_regex=False
+    )
+    return text_splitter.split_documents(docs)
+
+def chunk_hash(doc: Any) -> str:
+    # Chunks parsed before chunk hashes were stored get theirs computed on the fly
+    return doc.metadata.get("chunk_hash") or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()[:32]
+
+def tag_sections(split_docs: List[Any]) -> List[Any]:
+    for doc in split_docs:
+        doc.metadata["chunk_hash"] = chunk_hash(doc)
+        first_200 = doc.page_content[:200].lower()
+        for section, pattern in SECTION_PATTERNS.items():
+            if re.search(pattern, first_200):
+                doc.metadata["section"] = section
+                break
+        else:
+            doc.metadata["section"] = "other"
+    return split_docs
 
+def parse_document(file_path: str) -> Tuple[List[Any], Dict]:
+    """Parse document, extract title/authors, and split into chunks."""
+    try:
+        docs, metadata = read_document(file_path)
+        return tag_sections(split_documents(docs)), metadata
     except FileProcessingError as e:
         logger.error(f"Document processing failed: {str(e)}")
         raise
@@ -94,6 +316,130 @@ def load_document(file_path: str) -> Tuple[Optional[List[Any]], Dict]:
         logger.error(f"Unexpected document loading error: {str(e)}", exc_info=True)
         raise FileProcessingError(f"Unexpected error loading document: {str(e)}")
 
+def is_indexed(file_path: str) -> bool:
+    return os.path.exists(index_path_for(file_path)) and os.path.exists(bm25_path_for(file_path))
+
+@traced("index_document")
+def index_document(file_path: str, documents: List) -> Optional[str]:
+    """Build the on-disk vector and BM25 indexes for a document's chunks if they are missing."""
+    texts = [doc.page_content for doc in documents]
+    bm25_path = bm25_path_for(file_path)
+    if not os.path.exists(bm25_path):
+        try:
+            build_bm25_index(texts, bm25_path)
+        except Exception as e:
+            logger.error(f"BM25 index build failed for {file_path}: {str(e)}", exc_info=True)
+    index_path = index_path_for(file_path)
+    if os.path.exists(index_path):
+        return index_path
+    try:
+        return build_index(texts, get_embeddings(), index_path)
+    except Exception as e:
+        logger.error(f"Vector index build failed for {file_path}: {str(e)}", exc_info=True)
+        return None
+
+@traced("index_document")
+def index_document_version(file_path: str, documents: List, previous_file_path: Optional[str],
+                           previous_hash: Optional[str]) -> Dict:
+    """Index a new version of a document, embedding only chunks the previous version's index lacks."""
+    texts = [doc.page_content for doc in documents]
+    bm25_path = bm25_path_for(file_path)
+    if not os.path.exists(bm25_path):
+        try:
+            build_bm25_index(texts, bm25_path)
+        except Exception as e:
+            logger.error(f"BM25 index build failed for {file_path}: {str(e)}", exc_info=True)
+    index_path = index_path_for(file_path)
+    if os.path.exists(index_path):
+        return {"index_path": index_path, "chunks_reembedded": 0}
+    previous = {}
+    cached = load_parsed_document(previous_hash, chunk_params()) if previous_hash else None
+    if previous_file_path and cached is not None:
+        previous = vectors_by_key(index_path_for(previous_file_path), [chunk_hash(doc) for doc in cached[0]])
+    try:
+        index_path, embedded = build_index_reusing(texts, [chunk_hash(doc) for doc in documents], previous,
+                                                   get_embeddings(), index_path)
+        return {"index_path": index_path, "chunks_reembedded": embedded}
+    except Exception as e:
+        logger.error(f"Vector index build failed for {file_path}: {str(e)}", exc_info=True)
+        return {"index_path": None, "chunks_reembedded": 0}
+
+def get_reranker() -> Any:
+    global _reranker
+    if _reranker is None:
+        with _embeddings_lock:
+            if _reranker is None:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(RERANK_MODEL, device="cpu")
+    return _reranker
+
+def rerank_chunks(query: str, documents: List, chunk_ids: List[int]) -> List[int]:
+    try:
+        scores = get_reranker().predict([(query, documents[i].page_content) for i in chunk_ids])
+    except Exception as e:
+        logger.error(f"Reranking failed, keeping fused order: {str(e)}", exc_info=True)
+        return chunk_ids
+    return [i for _, i in sorted(zip(scores, chunk_ids), key=lambda pair: pair[0], reverse=True)]
+
+@traced("retrieve")
+def retrieve_chunks(query: str, documents: List, index_path: Optional[str], k: int = RETRIEVAL_TOP_K) -> List:
+    """Hybrid retrieval: vector and BM25 rankings fused by reciprocal rank, optionally cross-encoder reranked."""
+    if not documents or not index_path:
+        return []
+    candidates = max(k, HYBRID_CANDIDATES)
+    rankings = []
+    index = load_index(index_path)
+    if index is not None and index.ntotal == len(documents):
+        try:
+            with span("embed_query"):
+                query_vector = get_embeddings().embed_query(query)
+            rankings.append(search_index(index, query_vector, candidates))
+        except Exception as e:
+            logger.error(f"Vector search failed: {str(e)}", exc_info=True)
+    # Exact terms (acronyms, dataset names, symbols) that embeddings blur are caught here
+    bm25 = load_bm25_index(bm25_path_for(index_path))
+    if bm25_chunk_count(bm25) == len(documents):
+        rankings.append(search_bm25(bm25, query, candidates))
+    chunk_ids = [i for i, _ in fuse_rankings(rankings, RRF_K)[:candidates]]
+    if RERANK_MODEL and len(chunk_ids) > 1:
+        chunk_ids = rerank_chunks(query, documents, chunk_ids)
+    return [documents[i] for i in chunk_ids[:k]]
+
+def index_user_document(user_id: str, document_id: str, file_path: str, content_hash: Optional[str]) -> None:
+    """Add a stored document's chunk vectors to the user's cross-document search shard."""
+    index = load_index(index_path_for(file_path))
+    if index is None or index.ntotal == 0:
+        return
+    try:
+        user_index.add_document(user_id, document_id, content_hash, index_vectors(index))
+    except Exception as e:
+        logger.error(f"Failed to add document {document_id} to the search index of user {user_id}: {str(e)}",
+                     exc_info=True)
+
+def unindex_user_document(user_id: str, document_id: str) -> None:
+    try:
+        user_index.remove_document(user_id, document_id)
+    except Exception as e:
+        logger.error(f"Failed to remove document {document_id} from the search index of user {user_id}: {str(e)}",
+                     exc_info=True)
+
+@lru_cache(maxsize=int(os.getenv("SEARCH_CHUNK_CACHE_SIZE", 64)))
+def _cached_chunks(content_hash: str, params: Tuple) -> Optional[List[Any]]:
+    cached = load_parsed_document(content_hash, dict(params))
+    return cached[0] if cached is not None else None
+
+def search_user_documents(user_id: str, query: str, k: int = RETRIEVAL_TOP_K) -> List[Dict]:
+    """Rank chunks across all of a user's documents; each hit carries its document id and chunk text."""
+    hits = user_index.search(user_id, get_embeddings().embed_query(query), k)
+    params = tuple(sorted(chunk_params().items()))
+    for hit in hits:
+        chunks = _cached_chunks(hit["content_hash"], params) if hit["content_hash"] else None
+        chunk = chunks[hit["chunk_index"]] if chunks and hit["chunk_index"] < len(chunks) else None
+        hit["text"] = chunk.page_content if chunk else None
+        hit["page"] = chunk.metadata.get("page") if chunk else None
+        hit["section"] = chunk.metadata.get("section") if chunk else None
+    return hits
+
 def format_metadata(metadata: Dict) -> str:
     formatted = ["DOCUMENT METADATA:"]
     formatted.append(f"Title: {metadata.get('title', 'Untitled Document')}")
@@ -116,13 +462,17 @@ def analyze_query_intent(query: str) -> Dict[str, float]:
     query_lower = query.lower()
     keyword_map = {
         "casual_chat": ["hi", "hello", "hey", "what's up", "how are you"],
-        "summary_request": ["summarize", "overview", "main points", "tl;dr"],
+        "summary_request": ["summarize", "summary", "overview", "main points", "tl;dr"],
         "technical_detail": ["method", "result", "data", "analysis", "how does"],
         "comparison": ["vs", "versus", "compare", "difference", "similarity"],
         "metadata_query": ["author", "title", "date", "pages", "figure", "table"]
     }
     for intent, keywords in keyword_map.items():
-        intent_scores[intent] += sum(keyword in query_lower for keyword in keywords) * 0.3
+        # Keywords match at word starts, and short ones as whole words, so "this" is not a greeting
+        intent_scores[intent] += sum(
+            bool(re.search(rf"\b{re.escape(keyword)}" + (r"\b" if len(keyword) <= 3 else ""), query_lower))
+            for keyword in keywords
+        ) * 0.3
     if re.search(r"explain (like|to) (a|me|i'm)", query_lower):
         intent_scores["casual_chat"] += 0.5
     if re.search(r"\b(advantage|disadvantage|pros?|cons?)\b", query_lower):
@@ -151,41 +501,48 @@ def handle_metadata_query(query: str, metadata: Dict) -> Optional[str]:
         return "The document structure information isn't available."
     return None
 
-def prepare_context(query: str, documents: List, metadata: Dict, intent_scores: Dict, chat_history: List = None) -> str:
-    context_parts = []
-    if intent_scores["metadata_query"] > 0.3:
-        context_parts.append(format_metadata(metadata))
-
-    if chat_history:
-        history_str = "\n".join(
-            f"{entry['type'].upper()}: {entry['content']}" for entry in chat_history[-5:]
-        )
-        context_parts.append(f"PREVIOUS CONVERSATION:\n{history_str}")
-        query_lower = query.lower()
-        for entry in chat_history[-5:]:
-            if entry["type"] == "user" and any(word in query_lower for word in entry["content"].lower().split()):
-                context_parts.append(f"NOTE: You previously asked about '{entry['content']}', which may be related.")
+@traced("prepare_context")
+def prepare_context(query: str, documents: List, metadata: Dict, intent_scores: Dict, chat_history: List = None,
+                    index_path: Optional[str] = None) -> Dict:
+    """Pack metadata, recent history and retrieved chunks into the context token budget.
 
-    if documents:
-        if intent_scores["technical_detail"] > 0.5:
-            sections = ["methods", "results"]
-        elif intent_scores["comparison"] > 0.4:
-            sections = ["results", "discussion"]
+    Returns {"text", "usage"}, where usage reports the tokens spent on each part.
+    """
+    metadata_block = format_metadata(metadata) if intent_scores["metadata_query"] > 0.3 else None
+
+    history_summary = None
+    history_lines = []
+    for entry in reversed(chat_history or []):
+        if entry["type"] == "summary":
+            history_summary = f"SUMMARY OF EARLIER CONVERSATION: {entry['content']}"
         else:
-            sections = ["abstract", "introduction", "conclusion"]
-        relevant_docs = [d for d in documents if d.metadata.get("section") in sections]
-        if not relevant_docs and documents:
+            # Long answers are clipped; the running summary carries what they established. The packer
+            # keeps the newest lines that fit the history budget.
+            history_lines.append(f"{entry['type'].upper()}: {truncate_to_tokens(entry['content'], HISTORY_MESSAGE_TOKENS)}")
+
+    relevant_docs = []
+    if documents:
+        # Retrieve more than fit so the packer can skip chunks that repeat each other
+        relevant_docs = retrieve_chunks(query, documents, index_path, k=CONTEXT_CANDIDATES)
+        if not relevant_docs:
+            if intent_scores["technical_detail"] > 0.5:
+                sections = ["methods", "results"]
+            elif intent_scores["comparison"] > 0.4:
+                sections = ["results", "discussion"]
+            else:
+                sections = ["abstract", "introduction", "conclusion"]
+            relevant_docs = [d for d in documents if d.metadata.get("section") in sections][:CONTEXT_CANDIDATES]
+        if not relevant_docs:
             relevant_docs = documents[:3]
-        context_content = "\n\n".join(
-            f"[Section: {doc.metadata.get('section', 'other')}]\n{doc.page_content}"
-            for doc in relevant_docs[:5]
-        )
-        if len(context_content) > MAX_CONTEXT_LENGTH:
-            last_paragraph_end = context_content[:MAX_CONTEXT_LENGTH].rfind("\n\n")
-            context_content = context_content[:last_paragraph_end] if last_paragraph_end > 0 else context_content[:MAX_CONTEXT_LENGTH]
-        context_parts.append("DOCUMENT CONTENT:\n" + context_content)
+    chunks = [(f"[Section: {doc.metadata.get('section', 'other')}]", doc.page_content) for doc in relevant_docs]
 
-    return "\n\n".join(context_parts)
+    packed = pack_context(metadata_block, history_lines, chunks, max_overlap=CHUNK_OVERLAP,
+                          history_summary=history_summary)
+    usage = packed["usage"]
+    for part in ("metadata", "history", "chunks"):
+        inc_counter("context_tokens_total", {"part": part}, usage[part])
+    logger.debug(f"Packed context: {usage}")
+    return packed
 
 def determine_response_style(intent_scores: Dict, metadata: Dict) -> Dict:
     style = {
@@ -222,39 +579,88 @@ def generate_llm_prompt(query: str, context: str, response_style: Dict) -> str:
         prompt_parts.append("STRUCTURE: Bullet points for pros/cons with 1-sentence explanations")
     return "\n\n".join(prompt_parts)
 
+def llm_options(prompt: str) -> Dict:
+    return {
+        "messages": [{"role": "system", "content": prompt}],
+        "temperature": 0.7 if "casual" in prompt.lower() else 0.3,
+        "max_tokens": 1500
+    }
+
+def request_completion(prompt: str) -> str:
+    with span("llm"):
+        return llm_client.complete(**llm_options(prompt))
+
+def stream_completion(prompt: str) -> Iterator[str]:
+    # Runs while the response body streams, so it feeds the histogram rather than Server-Timing
+    with span("llm_stream"):
+        yield from llm_client.stream(**llm_options(prompt))
+
 def call_llm_api(prompt: str) -> str:
     try:
-        headers = {
-            "Authorization": f"Bearer {TOGETHER_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": LLAMA_MODEL,
-            "messages": [{"role": "system", "content": prompt}],
-            "temperature": 0.7 if "casual" in prompt.lower() else 0.3,
-            "max_tokens": 1500
-        }
-        response = requests.post(TOGETHER_API_URL, json=data, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except requests.Timeout:
-        logger.error("LLM API request timed out")
-        return "Request to AI service timed out. Please try again later."
-    except requests.RequestException as e:
-        logger.error(f"LLM API request failed: {str(e)}")
-        return f"Failed to connect to AI service: {str(e)}"
-    except KeyError as e:
-        logger.error(f"Invalid LLM API response format: {str(e)}")
-        return "Received an invalid response from the AI service."
-
-def process_document_query(file_path: str, query: str, chat_history: List = None) -> str:
-    documents, metadata = load_document(file_path)
+        return request_completion(prompt)
+    except LLMServiceError as e:
+        return str(e)
+
+def query_cache_key(query: str, metadata: Dict, chat_history: List = None, user_id: Optional[str] = None) -> Optional[str]:
+    response_style = determine_response_style(analyze_query_intent(query), metadata)
+    return response_cache_key(metadata.get("content_hash"), query, response_style, LLAMA_MODEL, chat_history, user_id)
+
+def plan_document_query(file_path: str, query: str, chat_history: List = None,
+                        documents: List = None, metadata: Dict = None, check_cache: bool = True,
+                        user_id: Optional[str] = None) -> Dict:
+    """Work out how to answer a query: either a direct response or an LLM prompt."""
+    if documents is None or metadata is None:
+        documents, metadata = load_document(file_path)
     intent_scores = analyze_query_intent(query)
     if intent_scores["metadata_query"] > 0.7:
         metadata_response = handle_metadata_query(query, metadata)
         if metadata_response:
-            return metadata_response
-    context = prepare_context(query, documents, metadata, intent_scores, chat_history)
+            return {"response": metadata_response, "prompt": None, "cache_key": None}
     response_style = determine_response_style(intent_scores, metadata)
-    prompt = generate_llm_prompt(query, context, response_style)
-    return call_llm_api(prompt)
\ No newline at end of file
+    cache_key = response_cache_key(metadata.get("content_hash"), query, response_style, LLAMA_MODEL,
+                                   chat_history, user_id)
+    if check_cache:
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            return {"response": cached, "prompt": None, "cache_key": cache_key}
+    index_path = index_path_for(file_path) if file_path else None
+    context = prepare_context(query, documents, metadata, intent_scores, chat_history, index_path)
+    prompt = generate_llm_prompt(query, context["text"], response_style)
+    observe("context_tokens", context["usage"]["total"])
+    observe("prompt_chars", len(prompt))
+    return {
+        "response": None,
+        "prompt": prompt,
+        "cache_key": cache_key,
+        "context_usage": context["usage"]
+    }
+
+def answer_query(plan: Dict) -> str:
+    if plan["response"] is not None:
+        return plan["response"]
+    try:
+        response = request_completion(plan["prompt"])
+    except LLMServiceError as e:
+        plan["failed"] = True
+        return str(e)
+    cache_response(plan["cache_key"], response)
+    return response
+
+def stream_answer(plan: Dict) -> Iterator[str]:
+    if plan["response"] is not None:
+        yield plan["response"]
+        return
+    tokens = []
+    try:
+        for token in stream_completion(plan["prompt"]):
+            tokens.append(token)
+            yield token
+    except LLMServiceError as e:
+        plan["failed"] = True
+        yield str(e)
+        return
+    cache_response(plan["cache_key"], "".join(tokens))
+
+def process_document_query(file_path: str, query: str, chat_history: List = None,
+                           documents: List = None, metadata: Dict = None) -> str:
+    return answer_query(plan_document_query(file_path, query, chat_history, documents, metadata))
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import uuid
+import cProfile
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Profiles of individual requests, captured on demand (see server.py) and kept until the
+# directory exceeds PROFILE_MAX_BYTES or PROFILE_MAX_FILES, oldest first.
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("cache", "profiles"))
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", 50 * 1024 * 1024))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+# "sample" records collapsed stacks (flamegraph input) with little overhead; "cprofile" records
+# exact call counts and times as pstats, at the cost of slowing the request down
+PROFILE_MODES = {"sample": "collapsed", "cprofile": "pstats"}
+FORMAT_EXTENSIONS = {"collapsed": ".collapsed.txt", "pstats": ".pstats"}
+
+_retention_lock = threading.Lock()
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval from a background thread."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class RequestProfile:
+    def __init__(self, mode: str):
+        self.mode = mode if mode in PROFILE_MODES else "sample"
+        self.request_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self._profiler = None
+        self._sampler = None
+
+    def start(self) -> "RequestProfile":
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident())
+            self._sampler.start()
+        return self
+
+    def stop(self, info: Dict) -> Optional[str]:
+        """Stop profiling and store the result; returns the request id it is stored under."""
+        duration = time.perf_counter() - self.started
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_format = PROFILE_MODES[self.mode]
+            path = os.path.join(PROFILE_DIR, self.request_id + FORMAT_EXTENSIONS[profile_format])
+            if self._profiler is not None:
+                self._profiler.dump_stats(path)
+            else:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(self._sampler.collapsed())
+            record = {
+                **info,
+                "request_id": self.request_id,
+                "mode": self.mode,
+                "format": profile_format,
+                "duration_s": duration,
+                "size": os.path.getsize(path),
+                "created_at": datetime.utcnow().isoformat()
+            }
+            with open(os.path.join(PROFILE_DIR, self.request_id + ".json"), "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            enforce_retention()
+            return self.request_id
+        except OSError as e:
+            logger.error(f"Failed to store profile {self.request_id}: {str(e)}")
+            return None
+
+def _valid_id(request_id: str) -> bool:
+    return len(request_id) == 32 and all(c in "0123456789abcdef" for c in request_id)
+
+def _remove_profile(request_id: str) -> None:
+    for suffix in list(FORMAT_EXTENSIONS.values()) + [".json"]:
+        path = os.path.join(PROFILE_DIR, request_id + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+def list_profiles() -> List[Dict]:
+    """Stored profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    records = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), "r", encoding="utf-8") as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(records, key=lambda record: record["created_at"], reverse=True)
+
+def get_profile(request_id: str) -> Optional[Dict]:
+    if not _valid_id(request_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, request_id + ".json"), "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    record["path"] = os.path.join(PROFILE_DIR, request_id + FORMAT_EXTENSIONS[record["format"]])
+    return record if os.path.exists(record["path"]) else None
+
+def delete_profile(request_id: str) -> bool:
+    if get_profile(request_id) is None:
+        return False
+    _remove_profile(request_id)
+    return True
+
+def enforce_retention() -> None:
+    with _retention_lock:
+        records = list_profiles()
+        total = sum(record.get("size", 0) for record in records)
+        while records and (total > PROFILE_MAX_BYTES or len(records) > PROFILE_MAX_FILES):
+            oldest = records.pop()
+            _remove_profile(oldest["request_id"])
+            total -= oldest.get("size", 0)
@@ -0,0 +1,84 @@
+import os
+import logging
+import tempfile
+from typing import Dict, Optional
+import zstandard
+from utils.db import documents_collection
+from utils.cache_utils import compute_file_hash
+
+logger = logging.getLogger(__name__)
+
+# Full document text lives in zstd files keyed by content hash, not in Mongo records
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", os.path.join("cache", "text"))
+TEXT_COMPRESSION_LEVEL = int(os.getenv("TEXT_COMPRESSION_LEVEL", 10))
+# Legacy records carry the text twice; never read it back from Mongo
+DOCUMENT_PROJECTION = {"extracted_text": 0, "metadata.extracted_text": 0}
+
+def text_path_for(content_hash: str) -> str:
+    return os.path.join(TEXT_STORE_DIR, content_hash[:2], content_hash + ".txt.zst")
+
+def save_text(content_hash: str, text: str) -> None:
+    text_path = text_path_for(content_hash)
+    if os.path.exists(text_path):
+        return
+    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+    data = zstandard.ZstdCompressor(level=TEXT_COMPRESSION_LEVEL).compress(text.encode("utf-8"))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(text_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, text_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def load_text(content_hash: Optional[str]) -> Optional[str]:
+    if not content_hash:
+        return None
+    text_path = text_path_for(content_hash)
+    if not os.path.exists(text_path):
+        return None
+    with open(text_path, 'rb') as f:
+        return zstandard.ZstdDecompressor().decompress(f.read()).decode("utf-8")
+
+def remove_text(content_hash: str) -> None:
+    text_path = text_path_for(content_hash)
+    if os.path.exists(text_path):
+        os.remove(text_path)
+
+def offload_text(content_hash: str, metadata: Dict) -> Dict:
+    """Move ``extracted_text`` out of parser metadata into the text store, leaving its length behind."""
+    text = metadata.pop("extracted_text", "") or ""
+    if text:
+        save_text(content_hash, text)
+    metadata["text_length"] = len(text)
+    return metadata
+
+def migrate_all(upload_folder: str = "uploads") -> int:
+    """Strip extracted_text from existing documents records, saving it to the text store first."""
+    migrated = 0
+    legacy = {"$or": [{"extracted_text": {"$exists": True}}, {"metadata.extracted_text": {"$exists": True}}]}
+    fields = {"content_hash": 1, "stored_name": 1, "extracted_text": 1, "metadata.extracted_text": 1}
+    for doc in documents_collection.find(legacy, fields):
+        content_hash = doc.get("content_hash")
+        filepath = os.path.join(upload_folder, doc.get("stored_name", ""))
+        if not content_hash and os.path.isfile(filepath):
+            content_hash = compute_file_hash(filepath)
+        if not content_hash:
+            logger.warning(f"Document {doc['_id']} has no content hash or file; leaving its text in place")
+            continue
+        text = doc.get("extracted_text") or doc.get("metadata", {}).get("extracted_text") or ""
+        if text:
+            save_text(content_hash, text)
+        documents_collection.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"content_hash": content_hash, "metadata.content_hash": content_hash,
+                      "metadata.text_length": len(text)},
+             "$unset": {"extracted_text": "", "metadata.extracted_text": ""}}
+        )
+        migrated += 1
+    return migrated
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"Moved the text of {migrate_all()} documents to {TEXT_STORE_DIR}")
@@ -0,0 +1,65 @@
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional
+from utils.metrics import register_histogram, observe
+
+# Spans of the request being served in this thread/task: name -> [total seconds, calls].
+# Work on background threads has no trace and only feeds the histograms.
+_current_trace: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("trace", default=None)
+_SERVER_TIMING_UNSAFE = re.compile(r"[^A-Za-z0-9_\-.]")
+
+register_histogram("stage_duration_seconds", "Time spent per pipeline stage")
+
+def start_trace() -> Token:
+    return _current_trace.set({})
+
+def current_trace() -> Optional[Dict[str, List[float]]]:
+    return _current_trace.get()
+
+def end_trace(token: Token) -> Dict[str, List[float]]:
+    trace = _current_trace.get() or {}
+    _current_trace.reset(token)
+    return trace
+
+def add_to_trace(name: str, seconds: float) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        entry = trace.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+def record_span(name: str, seconds: float) -> None:
+    observe("stage_duration_seconds", seconds, {"stage": name})
+    add_to_trace(name, seconds)
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+def traced(name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing(trace: Dict[str, List[float]], total: Optional[float] = None) -> str:
+    """Render a trace as a Server-Timing header value (durations in milliseconds)."""
+    metrics = []
+    for name, (seconds, calls) in trace.items():
+        metric = f"{_SERVER_TIMING_UNSAFE.sub('_', name)};dur={seconds * 1000:.1f}"
+        if calls > 1:
+            metric += f';desc="{calls} calls"'
+        metrics.append(metric)
+    if total is not None:
+        metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
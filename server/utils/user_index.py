@@ -0,0 +1,182 @@
+import os
+import json
+import fcntl
+import bisect
+import hashlib
+import tempfile
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import faiss
+from utils.vector_store import write_index
+
+logger = logging.getLogger(__name__)
+
+# One HNSW shard per user over every chunk of every document they uploaded. Vectors are copied
+# from the per-document flat indexes, so adding a document never re-embeds it.
+USER_INDEX_DIR = os.getenv("USER_INDEX_DIR", os.path.join("cache", "user_indexes"))
+HNSW_M = int(os.getenv("USER_INDEX_HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("USER_INDEX_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.getenv("USER_INDEX_EF_SEARCH", 64))
+# HNSW cannot delete in place; deleted documents are filtered out until they make up this share of the shard
+COMPACT_DELETED_RATIO = float(os.getenv("USER_INDEX_COMPACT_RATIO", 0.3))
+
+def shard_dir_for(user_id: str) -> str:
+    return os.path.join(USER_INDEX_DIR, hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32])
+
+def _paths(user_id: str) -> Tuple[str, str]:
+    shard_dir = shard_dir_for(user_id)
+    return os.path.join(shard_dir, "index.faiss"), os.path.join(shard_dir, "documents.json")
+
+@contextmanager
+def _shard_lock(user_id: str) -> Iterator[None]:
+    # Ingestion workers and web workers may all add to the same user's shard
+    shard_dir = shard_dir_for(user_id)
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(os.path.join(shard_dir, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _new_index(dim: int) -> Any:
+    hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return faiss.IndexIDMap2(hnsw)
+
+def _read_shard(user_id: str) -> Tuple[Optional[Any], Dict]:
+    index_path, documents_path = _paths(user_id)
+    if not os.path.exists(index_path) or not os.path.exists(documents_path):
+        return None, {"next_id": 0, "documents": []}
+    with open(documents_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return faiss.read_index(index_path), manifest
+
+def _write_shard(user_id: str, index: Any, manifest: Dict) -> None:
+    index_path, documents_path = _paths(user_id)
+    # Index first: ids the manifest does not know yet are simply skipped by readers
+    write_index(index, index_path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(documents_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, documents_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _compact(index: Any, manifest: Dict) -> Tuple[Any, Dict]:
+    live = [doc for doc in manifest["documents"] if not doc.get("deleted")]
+    compacted = _new_index(index.d)
+    documents = []
+    next_id = 0
+    for doc in live:
+        vectors = np.vstack([index.reconstruct(doc["first_id"] + i) for i in range(doc["count"])])
+        compacted.add_with_ids(vectors, np.arange(next_id, next_id + doc["count"], dtype="int64"))
+        documents.append({**doc, "first_id": next_id})
+        next_id += doc["count"]
+    logger.info(f"Compacted user index from {index.ntotal} to {compacted.ntotal} vectors")
+    return compacted, {"next_id": next_id, "documents": documents}
+
+def add_document(user_id: str, document_id: str, content_hash: Optional[str], vectors: np.ndarray) -> None:
+    """Append a document's chunk vectors (normalised, in chunk order) to the user's shard."""
+    if vectors is None or not len(vectors):
+        return
+    with _shard_lock(user_id):
+        index, manifest = _read_shard(user_id)
+        if any(doc["document_id"] == document_id and not doc.get("deleted") for doc in manifest["documents"]):
+            return
+        if index is None:
+            index = _new_index(vectors.shape[1])
+        first_id = manifest["next_id"]
+        # Each document owns a contiguous id range, so the manifest needs one entry per document, not per chunk
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"),
+                           np.arange(first_id, first_id + len(vectors), dtype="int64"))
+        manifest["documents"].append({
+            "document_id": document_id,
+            "content_hash": content_hash,
+            "first_id": first_id,
+            "count": len(vectors)
+        })
+        manifest["next_id"] = first_id + len(vectors)
+        _write_shard(user_id, index, manifest)
+
+def remove_document(user_id: str, document_id: str) -> None:
+    with _shard_lock(user_id):
+        index, manifest = _read_shard(user_id)
+        if index is None:
+            return
+        removed = [doc for doc in manifest["documents"] if doc["document_id"] == document_id and not doc.get("deleted")]
+        if not removed:
+            return
+        for doc in removed:
+            doc["deleted"] = True
+        deleted = sum(doc["count"] for doc in manifest["documents"] if doc.get("deleted"))
+        if deleted and deleted >= COMPACT_DELETED_RATIO * index.ntotal:
+            index, manifest = _compact(index, manifest)
+        _write_shard(user_id, index, manifest)
+
+def has_shard(user_id: str) -> bool:
+    return all(os.path.exists(path) for path in _paths(user_id))
+
+def _backfill_marker(user_id: str) -> str:
+    return os.path.join(shard_dir_for(user_id), "backfilled")
+
+def is_backfilled(user_id: str) -> bool:
+    """Whether every document the user had before the shard existed has been added to it."""
+    return os.path.exists(_backfill_marker(user_id))
+
+def mark_backfilled(user_id: str) -> None:
+    # A separate marker rather than a manifest field: ingestion creates the shard (and manifest)
+    # on its own, which says nothing about the user's older documents
+    os.makedirs(shard_dir_for(user_id), exist_ok=True)
+    with open(_backfill_marker(user_id), "w") as f:
+        f.write("1")
+
+@lru_cache(maxsize=int(os.getenv("USER_INDEX_CACHE_SIZE", 16)))
+def _open_shard(user_id: str, index_mtime: int, documents_mtime: int) -> Tuple[Any, Dict]:
+    index, manifest = _read_shard(user_id)
+    faiss.downcast_index(index.index).hnsw.efSearch = HNSW_EF_SEARCH
+    live = [doc for doc in manifest["documents"] if not doc.get("deleted")]
+    manifest["first_ids"] = [doc["first_id"] for doc in live]
+    manifest["live"] = live
+    return index, manifest
+
+def search(user_id: str, query_vector: List[float], k: int) -> List[Dict]:
+    """Top ``k`` chunks across the user's documents as {document_id, content_hash, chunk_index, score}."""
+    if not has_shard(user_id):
+        return []
+    index_path, documents_path = _paths(user_id)
+    index, manifest = _open_shard(user_id, os.stat(index_path).st_mtime_ns, os.stat(documents_path).st_mtime_ns)
+    live = manifest["live"]
+    if not live:
+        return []
+    # Over-fetch so hits on deleted documents do not leave the page short
+    fetch = min(index.ntotal, k * 2 if len(live) < len(manifest["documents"]) else k)
+    query = np.asarray(query_vector, dtype="float32").reshape(1, -1)
+    # Stored vectors are normalised, so inner product is cosine similarity
+    faiss.normalize_L2(query)
+    scores, ids = index.search(query, fetch)
+    hits = []
+    for vector_id, score in zip(ids[0], scores[0]):
+        if vector_id < 0:
+            continue
+        slot = bisect.bisect_right(manifest["first_ids"], int(vector_id)) - 1
+        if slot < 0:
+            continue
+        doc = live[slot]
+        chunk_index = int(vector_id) - doc["first_id"]
+        if chunk_index >= doc["count"]:
+            continue
+        hits.append({
+            "document_id": doc["document_id"],
+            "content_hash": doc["content_hash"],
+            "chunk_index": chunk_index,
+            "score": float(score)
+        })
+        if len(hits) == k:
+            break
+    return hits
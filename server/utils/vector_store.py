@@ -0,0 +1,101 @@
+import os
+import tempfile
+import logging
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional, Any
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".faiss"
+
+def index_path_for(file_path: str) -> str:
+    return os.path.splitext(file_path)[0] + INDEX_SUFFIX
+
+def _as_matrix(vectors: List[List[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype="float32")
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    # Normalised vectors make inner product equal to cosine similarity
+    faiss.normalize_L2(matrix)
+    return matrix
+
+def build_index(texts: List[str], embeddings: Any, index_path: str) -> Optional[str]:
+    if not texts:
+        return None
+    vectors = _as_matrix(embeddings.embed_documents(texts))
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    write_index(index, index_path)
+    logger.info(f"Built vector index with {index.ntotal} chunks at {index_path}")
+    return index_path
+
+def build_index_reusing(texts: List[str], keys: List[str], previous: Dict[str, np.ndarray], embeddings: Any,
+                        index_path: str) -> Tuple[Optional[str], int]:
+    """Like build_index, but chunks whose key has a vector in ``previous`` are not embedded again.
+
+    Returns (index path, number of chunks embedded).
+    """
+    if not texts:
+        return None, 0
+    missing = [i for i, key in enumerate(keys) if key not in previous]
+    fresh = _as_matrix(embeddings.embed_documents([texts[i] for i in missing])) if missing else None
+    dimension = fresh.shape[1] if fresh is not None else len(next(iter(previous.values())))
+    if previous and len(next(iter(previous.values()))) != dimension:
+        # The embedding model changed since the previous version; nothing can be reused
+        return build_index(texts, embeddings, index_path), len(texts)
+    vectors = np.empty((len(texts), dimension), dtype="float32")
+    for row, i in enumerate(missing):
+        vectors[i] = fresh[row]
+    for i, key in enumerate(keys):
+        if key in previous:
+            vectors[i] = previous[key]
+    index = faiss.IndexFlatIP(dimension)
+    index.add(vectors)
+    write_index(index, index_path)
+    logger.info(f"Built vector index with {index.ntotal} chunks at {index_path}, {len(missing)} newly embedded")
+    return index_path, len(missing)
+
+def write_index(index: Any, index_path: str) -> None:
+    index_dir = os.path.dirname(index_path) or "."
+    os.makedirs(index_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def index_vectors(index: Any) -> np.ndarray:
+    """The (already normalised) vectors stored in a flat index, in chunk order."""
+    return index.reconstruct_n(0, index.ntotal)
+
+def vectors_by_key(index_path: str, keys: List[str]) -> Dict[str, np.ndarray]:
+    """Map each chunk key to its stored vector; empty if the index is missing or out of step with ``keys``."""
+    index = load_index(index_path)
+    if index is None or index.ntotal != len(keys):
+        return {}
+    return dict(zip(keys, index_vectors(index)))
+
+@lru_cache(maxsize=int(os.getenv("VECTOR_INDEX_CACHE_SIZE", 32)))
+def _open_index(index_path: str, mtime: float) -> Any:
+    return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+def load_index(index_path: str) -> Optional[Any]:
+    if not index_path or not os.path.exists(index_path):
+        return None
+    try:
+        # Keyed on mtime so a rebuilt index is picked up without restarting
+        return _open_index(index_path, os.path.getmtime(index_path))
+    except Exception as e:
+        logger.warning(f"Failed to open vector index {index_path}: {str(e)}")
+        return None
+
+def search_index(index: Any, query_vector: List[float], k: int) -> List[Tuple[int, float]]:
+    if index is None or index.ntotal == 0:
+        return []
+    scores, ids = index.search(_as_matrix(query_vector), min(k, index.ntotal))
+    return [(int(i), float(score)) for i, score in zip(ids[0], scores[0]) if i >= 0]